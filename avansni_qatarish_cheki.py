@@ -6,21 +6,35 @@ OFD serveriga avans qaytarish chekini yuborish:
 - ReceiptSeq avtomatik oshib boradi (logs/last_seq.txt orqali).
 - Avvalgi avans chekdagi itemlar qaytadi.
 - IsRefund = 1 bo‘ladi.
-- RefundInfo ichiga avvalgi avans chek javobidan olingan TerminalID, ReceiptSeq, DateTime kiritiladi.
+- RefundInfo ichiga avvalgi avans chek javobidan olingan TerminalID, ReceiptSeq, DateTime kiritiladi
+  (db/receipts.db dan: argument – FiscalSign / ReceiptSeq / order id, bo‘lmasa oxirgi avans).
 """
 
-import subprocess
 import requests
 import json
 import os
+import sys
 from datetime import datetime
 
+from metrics import StageTimer
+from ofd_client import get_client
+from ofd_signer import SigningError, get_signer
+from outbox import Outbox
+from receipt_archive import archive_receipt
+from receipt_codec import encode_receipt
+from receipt_seq import next_receipt_seq
+from receipt_store import record_receipt, resolve_link
+
 # ------------------------------
 # 0. Konfiguratsiya
 # ------------------------------
 CERT_FILE = "certificates/EZ000000000931.crt"
 KEY_FILE = "certificates/amaar.key"
 OFD_URL = "https://test.ofd.uz/emp/v3/receipt"
+signer = get_signer(CERT_FILE, KEY_FILE)  # kalit bir marta o‘qiladi
+ofd_client = get_client(OFD_URL)  # keep-alive ulanishlar pool’i
+outbox = Outbox()  # tasdiqlanmagan cheklar fon worker orqali qayta yuboriladi
+timer = StageTimer("advance_refund", flush_at_exit=True)  # bosqichlar vaqti -> logs/metrics.prom
 
 merchant = {
     "TIN": "190261951",
@@ -59,19 +73,9 @@ items = [
 # 1. ReceiptSeq avtomatik oshirish
 # ------------------------------
 os.makedirs("logs", exist_ok=True)
-seq_file = "logs/last_seq.txt"
-if os.path.exists(seq_file):
-    with open(seq_file, "r") as sf:
-        try:
-            last_seq = int(sf.read().strip())
-        except ValueError:
-            last_seq = 0
-else:
-    last_seq = 0
-
-ReceiptSeq = last_seq + 1
-with open(seq_file, "w") as sf:
-    sf.write(str(ReceiptSeq))
+timer.reset()
+ReceiptSeq = next_receipt_seq()  # qulf ostida, logs/last_seq.txt bilan mos
+timer.lap("seq_alloc")
 
 # ------------------------------
 # 2. Umumiy summalarni hisoblash
@@ -87,8 +91,8 @@ ReceivedCard = 250114
 # ------------------------------
 now_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-# ⚠️ Bu qiymatlar avans chek javobidan olinadi (advance_response.log ichida bor)
-refund_info = {
+# ⚠️ Bu qiymatlar avans chek javobidan olinadi – lokal ombordan (topilmasa quyidagilar)
+refund_info = resolve_link("advance", sys.argv[1] if len(sys.argv) > 1 else None, with_sign=False) or {
     "TerminalID": "EZ000000000931",   # javobdan TerminalID
     "ReceiptSeq": "179",               # javobdan ReceiptSeq
     "DateTime": "20251020234941"      # javobdan DateTime
@@ -118,45 +122,43 @@ receipt_data = {
 # 4. JSON faylga yozish
 # ------------------------------
 receipt_json_path = os.path.join("logs", "RefundAdvanceReceipt.json")
-with open(receipt_json_path, "w", encoding="utf-8") as f:
-    json.dump(receipt_data, f, ensure_ascii=False, indent=4)
+receipt_bytes = encode_receipt(receipt_data, "advance_refund")  # ixcham, deterministik UTF-8
+with open(receipt_json_path, "wb") as f:
+    f.write(receipt_bytes)
+timer.lap("json_dump")
 
-print(f"✅ RefundAdvanceReceipt.json yaratildi: {receipt_json_path}")
+print(f"✅ RefundAdvanceReceipt.json yaratildi: {receipt_json_path} ({len(receipt_bytes)} bayt)")
 
 # ------------------------------
 # 5. JSONni imzolash
 # ------------------------------
 os.makedirs("keys", exist_ok=True)
 signed_path = os.path.join("keys", "RefundAdvanceReceipt.p7b")
-cmd = [
-    "openssl", "cms", "-sign",
-    "-nodetach", "-binary",
-    "-in", receipt_json_path,
-    "-text",
-    "-outform", "der",
-    "-out", signed_path,
-    "-nocerts",
-    "-signer", CERT_FILE,
-    "-inkey", KEY_FILE
-]
 
 print("Avans qaytarish chekini imzolash...")
 try:
-    subprocess.run(cmd, check=True)
+    signed_data = signer.sign(receipt_bytes)
+    with open(signed_path, "wb") as f:
+        f.write(signed_data)
+    timer.lap("sign")
     print(f"✅ Imzolangan fayl yaratildi: {signed_path}")
-except subprocess.CalledProcessError as e:
+except SigningError as e:
     print("❌ OpenSSL imzolash xatosi:", e)
     raise SystemExit(1)
 
 # ------------------------------
 # 6. OFD serveriga yuborish
 # ------------------------------
-headers = {"Content-Type": "application/octet-stream"}
 print("Avans qaytarish chekini yuborish...")
 
 try:
-    with open(signed_path, "rb") as f:
-        response = requests.post(OFD_URL, headers=headers, data=f, timeout=60)
+    outbox_id = outbox.put(signed_data, {"type": "advance_refund", "ReceiptSeq": ReceiptSeq, "url": OFD_URL})
+    response = ofd_client.post_receipt(signed_data)
+    timer.lap("send")
+    _, ofd_body = outbox.settle(outbox_id, response)  # FiscalSign kelmasa chek outbox’da qoladi
+    timer.response(ofd_body.get("Code") if ofd_body else None)
+    record_receipt("advance_refund", receipt_data, ofd_body, response.status_code)  # db/receipts.db
+    archive_receipt("advance_refund", receipt_data, receipt_bytes, signed_data, response.text, ofd_body)  # logs/archive (tarix)
 
     body = {}
     try:
@@ -184,3 +186,5 @@ except requests.exceptions.RequestException as e:
     with open("logs/refund_advance_error.log", "w", encoding="utf-8") as f:
         f.write(str(e))
     raise SystemExit(1)
+
+timer.lap("persist")
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+bench_receipts.py – Chek turlarining o‘tkazuvchanlik (throughput) benchmarki
+
+- Lokal OFD stub (ofd_stub.py) ishga tushiriladi yoki --url orqali tashqi stub beriladi.
+- Barcha chek turlari: sale, marketplace_sale, refund, marketplace_refund,
+  advance, advance_refund, credit, credit_refund.
+- Har bir chek uchun bosqichlar vaqti o‘lchanadi: build, serialize, sign, send, persist.
+- Natija: receipts/sec va har bir bosqich bo‘yicha o‘rtacha / p50 / p95 (ms).
+- ReceiptSeq haqiqiy logs/last_seq.txt dan emas, logs/bench/last_seq.txt dan olinadi.
+
+Ishga tushirish:
+    python bench_receipts.py -n 200 --latency 0.05 --error-rate 0.01
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import marketplace_receipt as mr
+from ofd_client import OfdClient
+from ofd_signer import get_signer
+from ofd_stub import StubConfig, start_stub
+from receipt_codec import encode_receipt
+from receipt_engine import KINDS
+from receipt_seq import SeqAllocator
+
+CERT_FILE = "certificates/EZ000000000931.crt"
+KEY_FILE = "certificates/amaar.key"
+BENCH_DIR = "logs/bench"
+
+STAGES = ("build", "serialize", "sign", "send", "persist")
+RECEIPT_TYPES = tuple(KINDS)
+
+ADVANCE_CONTRACT_ID = "2f138c8f0fe3499a9be756f4bdccc6d5"
+
+_commission = {"TIN": mr.merchant["TIN"], "PINFL": mr.merchant["PINFL"]}
+
+
+def _item(name, barcode, spic, package, price, vat, amount, discount=0, other=0, labels=()):
+    return {
+        "Name": name, "Barcode": barcode, "Labels": list(labels), "SPIC": spic,
+        "PackageCode": package, "OwnerType": 0, "GoodPrice": price, "Price": price,
+        "VAT": vat, "VATPercent": 12, "Amount": amount, "Discount": discount,
+        "Other": other, "Voucher": 0, "CommissionInfo": _commission,
+    }
+
+
+SALE_ITEMS = [
+    _item("Kompyuter sichqonchasi", "1234567890123", "08471012005000000", "1503256", 150000, 16071, 1000),
+    _item("Klaviatura", "2345678901234", "08471012004000000", "1503267", 250000, 26786, 2000),
+]
+ADVANCE_ITEMS = [
+    _item("Kompyuter sichqonchasi", "1234567890123", "08471012005000000", "1503256",
+          750338, 80393, 1000, 250112, 250112, ["468449404843551080626"]),
+]
+CREDIT_ITEMS = [
+    _item("Kompyuter sichqonchasi", "1234567890123", "08471012005000000", "1503256",
+          300000, 36000, 2000, 300000),
+]
+
+
+def _base(seq, items, is_refund, receipt_type, cash=0, card=None, now=None):
+    now_time = (now or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
+    total_price = sum(i["Price"] for i in items)
+    return {
+        "ReceiptSeq": seq,
+        "IsRefund": is_refund,
+        "Items": items,
+        "ReceivedCash": cash,
+        "ReceivedCard": total_price if card is None else card,
+        "TotalVAT": sum(i["VAT"] for i in items),
+        "Time": now_time,
+        "ReceiptType": receipt_type,
+        "Location": mr.LOCATION,
+        "ExtraInfo": {"PhoneNumber": mr.PHONE_NUMBER, "RequestTime": now_time, "CreatedTime": now_time},
+        "MerchantInfo": mr.merchant,
+    }
+
+
+def _link(resp, with_sign=True):
+    info = {"TerminalID": resp.get("TerminalID", ""), "ReceiptSeq": str(resp.get("ReceiptSeq", "")),
+            "DateTime": resp.get("DateTime", "")}
+    if with_sign:
+        info["FiscalSign"] = resp.get("FiscalSign", "")
+    return info
+
+
+# ReceiptType bo‘yicha benchmark itemlari va ReceivedCard (None – jami summa)
+BENCH_ITEMS = {0: (SALE_ITEMS, None), 1: (ADVANCE_ITEMS, 250114), 2: (CREDIT_ITEMS, 0)}
+
+
+def build(kind, seq, order_items, last):
+    """kind turidagi chekni yig‘adi; last – oldingi javoblar (refund/credit bog‘lanishi uchun)."""
+    spec = KINDS.get(kind)
+    if spec is None:
+        raise ValueError(f"Noma’lum chek turi: {kind}")
+    if spec.marketplace:
+        items, total_price, total_vat = mr.normalize_items_batched(order_items)
+        delivery = mr.make_delivery_item(mr.EMPTY_TAXI_INFO)
+        items.append(delivery)
+        return mr.build_receipt(items, seq, is_refund=spec.is_refund,
+                                totals=(total_price + delivery["Price"], total_vat + delivery["VAT"]))
+    items, card = BENCH_ITEMS[spec.receipt_type]
+    receipt = _base(seq, items, spec.is_refund, spec.receipt_type, card=card)
+    if spec.advance:
+        receipt["AdvanceContractID"] = ADVANCE_CONTRACT_ID
+    if spec.link_field:
+        # receipt_engine’dagi bog‘lanish qoidasi: birinchi manba turining oxirgi javobi
+        receipt[spec.link_field] = _link(last.get(spec.sources[0], {}), spec.with_sign)
+    return receipt
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(p / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def run_kind(kind, n, signer, client, seq, order_items, last, out_dir):
+    timings = {stage: [] for stage in STAGES}
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(n):
+        t0 = time.perf_counter()
+        receipt = build(kind, seq.next(), order_items, last)
+        t1 = time.perf_counter()
+        receipt_bytes = encode_receipt(receipt, kind)
+        t2 = time.perf_counter()
+        signed_data = signer.sign(receipt_bytes)
+        t3 = time.perf_counter()
+        response = client.post_receipt(signed_data)
+        t4 = time.perf_counter()
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if body.get("FiscalSign"):
+            last[kind] = body
+        else:
+            errors += 1
+        with open(os.path.join(out_dir, f"{kind}.json"), "wb") as f:
+            f.write(receipt_bytes)
+        with open(os.path.join(out_dir, f"{kind}.p7b"), "wb") as f:
+            f.write(signed_data)
+        with open(os.path.join(out_dir, f"{kind}_response.json"), "w", encoding="utf-8") as f:
+            f.write(response.text)
+        t5 = time.perf_counter()
+        for stage, dt in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+            timings[stage].append(dt)
+    elapsed = time.perf_counter() - started
+    return {"kind": kind, "count": n, "errors": errors, "elapsed": elapsed,
+            "rps": n / elapsed if elapsed else 0.0, "timings": timings}
+
+
+def format_report(results):
+    lines = []
+    header = f"{'type':<20}{'rps':>9}{'err':>6}" + "".join(f"{s + ' ms':>22}" for s in STAGES)
+    lines.append(header)
+    lines.append(f"{'':<35}" + "".join(f"{'mean/p50/p95':>22}" for _ in STAGES))
+    for r in results:
+        cells = []
+        for stage in STAGES:
+            vals = r["timings"][stage]
+            mean = sum(vals) / len(vals) * 1000 if vals else 0.0
+            cells.append(f"{mean:7.2f}/{percentile(vals, 50) * 1000:6.2f}/{percentile(vals, 95) * 1000:6.2f}")
+        lines.append(f"{r['kind']:<20}{r['rps']:9.1f}{r['errors']:6d}" + "".join(f"{c:>22}" for c in cells))
+    total = sum(r["count"] for r in results)
+    elapsed = sum(r["elapsed"] for r in results)
+    lines.append(f"Jami: {total} chek, {total / elapsed if elapsed else 0:.1f} receipts/sec")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chek turlari benchmarki (lokal OFD stub bilan)")
+    parser.add_argument("-n", type=int, default=100, help="har bir tur uchun cheklar soni")
+    parser.add_argument("--types", default=",".join(RECEIPT_TYPES))
+    parser.add_argument("--url", help="tashqi stub URL (berilmasa ichki stub ishga tushadi)")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--cert", default=CERT_FILE)
+    parser.add_argument("--key", default=KEY_FILE)
+    parser.add_argument("--json", help="natijani JSON faylga yozish")
+    args = parser.parse_args(argv)
+
+    server = None
+    url = args.url
+    if not url:
+        server, url = start_stub(StubConfig(latency=args.latency, jitter=args.jitter,
+                                            error_rate=args.error_rate))
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    signer = get_signer(args.cert, args.key)
+    client = OfdClient(url)
+    seq = SeqAllocator(os.path.join(BENCH_DIR, "last_seq.txt"), block_size=100)
+    order_items = mr.load_order_items()
+
+    last = {}
+    results = []
+    for kind in args.types.split(","):
+        # Bog‘langan turlar uchun (refund/credit) oldin bitta manba chek bo‘lishi kerak
+        results.append(run_kind(kind.strip(), args.n, signer, client, seq, order_items, last, BENCH_DIR))
+    seq.release()
+    if server is not None:
+        server.shutdown()
+
+    print(format_report(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump([{k: v for k, v in r.items() if k != "timings"} for r in results], f, indent=4)
+    return results
+
+
+if __name__ == "__main__":
+    main()
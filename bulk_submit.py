@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+bulk_submit.py – Imzolangan cheklarni asyncio orqali ko‘plab yuborish
+
+- Ko‘p .p7b (DER) cheklar qabul qilinadi, bir vaqtda N tagacha so‘rov OFD’da bo‘ladi.
+- So‘rovlar ofd_client dagi keep-alive pool orqali, thread executor ichida yuboriladi.
+- Har bir terminal ichida ReceiptSeq tartibi saqlanadi:
+    * "start"  – keyingi chek oldingisining so‘rovi (limiter’dan o‘tib) socket’ga to‘liq
+                 yozilgandan keyingina yuboriladi, javobi kutilmaydi;
+    * "strict" – keyingi chek oldingisiga javob kelgandan keyingina yuboriladi.
+- Javoblar (QRCodeURL, FiscalSign, TerminalID, ReceiptSeq) har biri tugashi bilan yig‘iladi.
+- --concurrency – yuqori chegara: haqiqiy parallellik ofd_client’da (AIMD) OFD holatiga moslashadi,
+  circuit ochilsa qolgan cheklar CircuitOpenError xatosi bilan qaytadi.
+
+Foydalanish:
+    python bulk_submit.py --terminal EZ000000000931 --concurrency 8 keys/*.p7b
+"""
+
+import argparse
+import asyncio
+import json
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from ofd_client import OFD_URL, OfdClient
+from ofd_signer import extract_content
+
+SignedReceipt = namedtuple("SignedReceipt", "terminal_id receipt_seq payload name")
+
+RESULT_FIELDS = ("Code", "QRCodeURL", "FiscalSign", "TerminalID", "ReceiptSeq", "DateTime")
+
+
+def load_signed(path, terminal_id):
+    """Fayldagi DER chekdan ReceiptSeq ni o‘qib SignedReceipt yaratadi."""
+    with open(path, "rb") as f:
+        payload = f.read()
+    receipt = json.loads(extract_content(payload))
+    return SignedReceipt(terminal_id, int(receipt["ReceiptSeq"]), payload, path)
+
+
+def parse_response(receipt, status, text):
+    """OFD javobidan kerakli maydonlarni ajratadi, QRCodeURL unescape qilinadi."""
+    result = {
+        "name": receipt.name,
+        "terminal_id": receipt.terminal_id,
+        "receipt_seq": receipt.receipt_seq,
+        "status": status,
+        "error": None,
+    }
+    try:
+        body = json.loads(text)
+    except ValueError:
+        result["error"] = "JSON emas: " + text[:200]
+        return result
+
+    for key in RESULT_FIELDS:
+        if key in body:
+            result[key] = body[key]
+    qurl = result.get("QRCodeURL")
+    if qurl:
+        try:
+            result["QRCodeURL"] = qurl.encode("utf-8").decode("unicode_escape")
+        except Exception:
+            pass
+    if body.get("Code") not in (0, None):
+        result["error"] = body.get("Message") or f"Code {body.get('Code')}"
+    return result
+
+
+class BulkSubmitter:
+    """Cheklarni cheklangan parallellik bilan yuboradi."""
+
+    def __init__(self, client=None, concurrency=8, order="start", url=OFD_URL):
+        if order not in ("start", "strict"):
+            raise ValueError("order 'start' yoki 'strict' bo‘lishi kerak")
+        self.concurrency = concurrency
+        self.order = order
+        self.client = client or OfdClient(url, pool_size=concurrency)
+
+    def _post(self, payload, on_sent=None):
+        resp = self.client.post_receipt(payload, on_sent=on_sent)
+        return resp.status_code, resp.text
+
+    async def _submit_one(self, loop, executor, sem, receipt, prev_gate, gate):
+        if prev_gate is not None:
+            await prev_gate.wait()
+        async with sem:
+            # "start": darvoza so‘rov yozib bo‘lingach ochiladi (executor thread’idan), xato bo‘lsa – finally da
+            on_sent = (lambda: loop.call_soon_threadsafe(gate.set)) if self.order == "start" else None
+            future = loop.run_in_executor(executor, self._post, receipt.payload, on_sent)
+            try:
+                status, text = await future
+                result = parse_response(receipt, status, text)
+            except Exception as e:
+                result = parse_response(receipt, None, "")
+                result["error"] = str(e)
+            finally:
+                gate.set()
+        return result
+
+    async def iter_results(self, receipts):
+        """Javoblarni tugash tartibida (as_completed) qaytaruvchi async generator."""
+        by_terminal = defaultdict(list)
+        for r in receipts:
+            by_terminal[r.terminal_id].append(r)
+
+        loop = asyncio.get_running_loop()
+        sem = asyncio.Semaphore(self.concurrency)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            tasks = []
+            for chain in by_terminal.values():
+                chain.sort(key=lambda r: r.receipt_seq)
+                prev_gate = None
+                for receipt in chain:
+                    gate = asyncio.Event()
+                    tasks.append(asyncio.ensure_future(
+                        self._submit_one(loop, executor, sem, receipt, prev_gate, gate)))
+                    prev_gate = gate
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+
+    async def submit_all(self, receipts, on_result=None):
+        results = []
+        async for result in self.iter_results(receipts):
+            if on_result is not None:
+                on_result(result)
+            results.append(result)
+        return results
+
+
+def submit_all(receipts, concurrency=8, order="start", url=OFD_URL, on_result=None):
+    """Sinxron koddan chaqirish uchun qulay o‘ram."""
+    submitter = BulkSubmitter(concurrency=concurrency, order=order, url=url)
+    return asyncio.run(submitter.submit_all(receipts, on_result=on_result))
+
+
+def _print_result(result):
+    if result["error"]:
+        print(f"❌ {result['name']} (seq {result['receipt_seq']}): {result['error']}")
+    else:
+        print(f"✅ {result['name']} (seq {result['receipt_seq']}): "
+              f"FiscalSign {result.get('FiscalSign')} {result.get('QRCodeURL', '')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Imzolangan cheklarni OFD’ga ko‘plab yuborish")
+    parser.add_argument("files", nargs="+", help=".p7b fayllar")
+    parser.add_argument("--terminal", default="EZ000000000931")
+    parser.add_argument("--url", default=OFD_URL)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--order", choices=("start", "strict"), default="start")
+    parser.add_argument("--out", default="logs/bulk_results.json")
+    args = parser.parse_args()
+
+    signed = [load_signed(p, args.terminal) for p in args.files]
+    all_results = submit_all(signed, args.concurrency, args.order, args.url, _print_result)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(all_results, f, ensure_ascii=False, indent=4)
+    ok = sum(1 for r in all_results if not r["error"])
+    print(f"Natija: {ok}/{len(all_results)} muvaffaqiyatli, {args.out} ga saqlandi ✅")
@@ -3,36 +3,44 @@
 credit_receipt.py – Kredit chek yuborish
 - ReceiptSeq avtomatik
 - Avvalgi sotuvdan olingan SaleReceiptInfo qo‘shiladi
+  (db/receipts.db dan: argument – FiscalSign / ReceiptSeq / order id, bo‘lmasa oxirgi sotuv)
 """
 
-import subprocess
-import requests
 import json
 import os
+import sys
 from datetime import datetime
 
+from metrics import StageTimer
+from ofd_client import get_client
+from ofd_signer import get_signer
+from outbox import Outbox
+from receipt_archive import archive_receipt
+from receipt_codec import encode_receipt
+from receipt_seq import next_receipt_seq
+from receipt_store import record_receipt, resolve_link
+
 CERT_FILE = "certificates/EZ000000000931.crt"
 KEY_FILE = "certificates/amaar.key"
 OFD_URL = "https://test.ofd.uz/emp/v3/receipt"
+signer = get_signer(CERT_FILE, KEY_FILE)  # kalit bir marta o‘qiladi
+ofd_client = get_client(OFD_URL)  # keep-alive ulanishlar pool’i
+outbox = Outbox()  # tasdiqlanmagan cheklar fon worker orqali qayta yuboriladi
+timer = StageTimer("credit", flush_at_exit=True)  # bosqichlar vaqti -> logs/metrics.prom
 
 os.makedirs("logs", exist_ok=True)
 
 # Sequence
-seq_file = "logs/last_seq.txt"
-if os.path.exists(seq_file):
-    last_seq = int(open(seq_file).read().strip() or "0")
-else:
-    last_seq = 0
-ReceiptSeq = last_seq + 1
-with open(seq_file, "w") as f:
-    f.write(str(ReceiptSeq))
-
-# Avvalgi sotuv chekidan ma’lumot olish
+timer.reset()
+ReceiptSeq = next_receipt_seq()  # qulf ostida, logs/last_seq.txt bilan mos
+timer.lap("seq_alloc")
+
+# Avvalgi sotuv chekidan ma’lumot olish (lokal ombordan, indeks bo‘yicha)
+sale_receipt_info = resolve_link(("sale", "marketplace_sale"), sys.argv[1] if len(sys.argv) > 1 else None)
 last_sale_file = "logs/last_sale_info.json"
-if not os.path.exists(last_sale_file):
+if sale_receipt_info is None and not os.path.exists(last_sale_file):
     print("❌ Avval sotuv chek yuborilmagan, last_sale_info.json yo‘q!")
     exit(1)
-last_sale = json.load(open(last_sale_file, encoding="utf-8"))
 
 # Items (misol uchun kredit chek)
 items = [
@@ -69,7 +77,7 @@ receipt_data = {
     "ReceiptType": 2,
     "Location": {"Latitude": 41.2967745, "Longitude": 69.2179078},
     "ExtraInfo": {"PhoneNumber": "998901234567"},
-    "SaleReceiptInfo": {
+    "SaleReceiptInfo": sale_receipt_info or {
     "TerminalID": "EZ000000000931",
     "ReceiptSeq": "76",
     "DateTime": "20250924163331",
@@ -79,25 +87,28 @@ receipt_data = {
 }
 
 receipt_json_path = "logs/CreditReceipt.json"
-with open(receipt_json_path, "w", encoding="utf-8") as f:
-    json.dump(receipt_data, f, ensure_ascii=False, indent=4)
-print(f"✅ CreditReceipt.json yaratildi: {receipt_json_path}")
+receipt_bytes = encode_receipt(receipt_data, "credit")  # ixcham, deterministik UTF-8
+with open(receipt_json_path, "wb") as f:
+    f.write(receipt_bytes)
+timer.lap("json_dump")
+print(f"✅ CreditReceipt.json yaratildi: {receipt_json_path} ({len(receipt_bytes)} bayt)")
 
 # Sign
 signed_path = "keys/CreditReceipt.p7b"
-cmd = [
-    "openssl", "cms", "-sign", "-nodetach", "-binary",
-    "-in", receipt_json_path, "-text", "-outform", "der",
-    "-out", signed_path, "-nocerts",
-    "-signer", CERT_FILE, "-inkey", KEY_FILE
-]
-subprocess.run(cmd, check=True)
+signed_data = signer.sign(receipt_bytes)
+with open(signed_path, "wb") as f:
+    f.write(signed_data)
+timer.lap("sign")
 print(f"✅ Imzolangan fayl yaratildi: {signed_path}")
 
 # Send
-headers = {"Content-Type": "application/octet-stream"}
-with open(signed_path, "rb") as f:
-    resp = requests.post(OFD_URL, headers=headers, data=f, timeout=60)
+outbox_id = outbox.put(signed_data, {"type": "credit", "ReceiptSeq": ReceiptSeq, "url": OFD_URL})
+resp = ofd_client.post_receipt(signed_data)
+timer.lap("send")
+_, ofd_body = outbox.settle(outbox_id, resp)  # FiscalSign kelmasa chek outbox’da qoladi
+timer.response(ofd_body.get("Code") if ofd_body else None)
+record_receipt("credit", receipt_data, ofd_body, resp.status_code)  # db/receipts.db
+archive_receipt("credit", receipt_data, receipt_bytes, signed_data, resp.text, ofd_body)  # logs/archive (tarix)
 
 print("Status:", resp.status_code)
 print("Body:", resp.text)
@@ -124,3 +135,5 @@ try:
 
 except Exception:
     print("❌ Server javobi JSON emas")
+
+timer.lap("persist")
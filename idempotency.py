@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+idempotency.py – Qayta urinishlarda chekni ikki marta fiskallashtirmaslik uchun kesh
+
+- Kalit: tur + order id + chekning kanonik mazmuni (sha256). ReceiptSeq va vaqt maydonlari
+  (Time, ExtraInfo.RequestTime / CreatedTime) kalitga kirmaydi – qayta ishga tushirilgan
+  skript yoki takrorlangan so‘rov o‘sha kalitni beradi.
+- "done": OFD FiscalSign bergan – yangi ReceiptSeq olinmaydi, saqlangan javob qaytariladi.
+- "pending": imzolangan, lekin javob kelmagan (timeout) – o‘sha imzolangan DER (o‘sha
+  ReceiptSeq) qayta yuboriladi; OFD uni ikkinchi chek deb qabul qilmaydi.
+- "claimed": kalit egallangan, lekin chek hali imzolanmagan – ReceiptSeq faqat claim
+  yutilgandan keyin ajratiladi (parallel nusxa seq sarflamaydi), so‘ng fill() bilan "pending".
+  CLAIM_TIMEOUT dan eski "claimed" yozuv (jarayon yiqilgan) tashlab yuborilgan hisoblanadi.
+- OFD aniq rad etsa (fail) yozuv o‘chiriladi – tuzatilgan chek yangidan yuborilishi mumkin.
+- Order id bo‘lmasa kesh ishlatilmaydi: bir xil mazmunli ikki sotuv haqiqiy ikki chek bo‘lishi mumkin.
+- Hajm cheklangan: TTL dan eski va MAX_ENTRIES dan ortiq (eng eskilari) yozuvlar o‘chiriladi.
+- terminal_id: chek qaysi terminalda imzolangan (terminal_pool) – "pending" chek o‘sha terminal
+  orqali qayta yuboriladi (ReceiptSeq terminalga tegishli). Eski yozuvlarda NULL – asosiy terminal.
+
+Foydalanish:
+    python idempotency.py --stats
+    python idempotency.py --purge
+    python idempotency.py --order ORD-1
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+IDEMPOTENCY_FILE = "db/idempotency.db"
+TTL = 3 * 24 * 3600      # soniya
+MAX_ENTRIES = 100000
+PURGE_EVERY = 500        # shuncha yangi yozuvdan keyin eskilari tozalanadi
+BUSY_TIMEOUT = 30.0
+CLAIM_TIMEOUT = 60.0     # soniya – imzolanmay qolgan "claimed" yozuv shundan keyin eskirgan
+
+# Har urinishda o‘zgaradigan, mazmunga kirmaydigan maydonlar
+VOLATILE_KEYS = frozenset(("ReceiptSeq", "Time"))
+VOLATILE_EXTRA = frozenset(("RequestTime", "CreatedTime"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency (
+    key          TEXT PRIMARY KEY,
+    kind         TEXT NOT NULL,
+    order_id     TEXT NOT NULL,
+    receipt_seq  INTEGER NOT NULL,
+    state        TEXT NOT NULL,
+    signed       BLOB NOT NULL,
+    outbox_id    TEXT,
+    response     TEXT,
+    created      REAL NOT NULL,
+    updated      REAL NOT NULL,
+    terminal_id  TEXT
+);
+CREATE INDEX IF NOT EXISTS idempotency_created ON idempotency (created);
+CREATE INDEX IF NOT EXISTS idempotency_order ON idempotency (order_id);
+"""
+
+COLUMNS = ("key", "kind", "order_id", "receipt_seq", "state", "signed", "outbox_id", "response",
+           "created", "updated", "terminal_id")
+
+
+def canonical_content(receipt_data):
+    """Kalit uchun chek mazmuni: o‘zgaruvchan maydonlarsiz, kalitlari saralangan JSON."""
+    if not isinstance(receipt_data, dict):  # receipt_model.Receipt
+        receipt_data = receipt_data.to_dict()
+    content = {k: v for k, v in receipt_data.items() if k not in VOLATILE_KEYS}
+    extra = content.get("ExtraInfo")
+    if isinstance(extra, dict):
+        content["ExtraInfo"] = {k: v for k, v in extra.items() if k not in VOLATILE_EXTRA}
+    return json.dumps(content, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def idempotency_key(kind, order_id, receipt_data):
+    """sha256(tur, order id, kanonik mazmun) yoki None (order id yo‘q bo‘lsa)."""
+    if not order_id:
+        return None
+    h = hashlib.sha256()
+    h.update(f"{kind}\0{order_id}\0".encode("utf-8"))
+    h.update(canonical_content(receipt_data))
+    return h.hexdigest()
+
+
+class IdempotencyCache:
+    """SQLite (WAL) kesh; har bir thread o‘z ulanishini ishlatadi."""
+
+    def __init__(self, path=IDEMPOTENCY_FILE, ttl=TTL, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._claims = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        if "terminal_id" not in {row[1] for row in conn.execute("PRAGMA table_info(idempotency)")}:
+            try:  # terminal_id ustunisiz eski baza
+                conn.execute("ALTER TABLE idempotency ADD COLUMN terminal_id TEXT")
+            except sqlite3.OperationalError:
+                pass  # boshqa jarayon allaqachon qo‘shgan
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Yozuv dict’i (response – dict) yoki None; muddati o‘tganlar hisobga olinmaydi."""
+        if not key:
+            return None
+        now = time.time()
+        row = self._conn().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM idempotency WHERE key = ? AND created > ?"
+            " AND NOT (state = 'claimed' AND updated <= ?)",
+            (key, now - self.ttl, now - CLAIM_TIMEOUT)).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(COLUMNS, row))
+        entry["response"] = json.loads(entry["response"]) if entry["response"] else None
+        return entry
+
+    def claim(self, key, kind, order_id, receipt_seq=None, signed_data=None, terminal_id=None):
+        """
+        Yangi urinishni "pending" deb yozadi (receipt_seq va signed_data berilmasa – "claimed",
+        keyin fill() yoki release()). Shu kalit bilan boshqa urinish oldinroq yozilgan bo‘lsa
+        False – chaqiruvchi seq ajratmasligi va yubormasligi kerak.
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("DELETE FROM idempotency WHERE key = ? AND (created <= ?"
+                     " OR (state = 'claimed' AND updated <= ?))", (key, now - self.ttl, now - CLAIM_TIMEOUT))
+        state = "claimed" if signed_data is None else "pending"
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO idempotency (key, kind, order_id, receipt_seq, state, signed,"
+            " created, updated, terminal_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, kind, str(order_id), int(receipt_seq or 0), state, signed_data or b"", now, now, terminal_id))
+        if cur.rowcount != 1:
+            return False
+        self._claims += 1
+        if self._claims % PURGE_EVERY == 0:
+            self.purge()
+        return True
+
+    def fill(self, key, receipt_seq, signed_data):
+        """claim() qilingan kalitga ajratilgan ReceiptSeq va imzolangan chek: "claimed" -> "pending"."""
+        if key:
+            self._conn().execute("UPDATE idempotency SET state = 'pending', receipt_seq = ?, signed = ?, updated = ?"
+                                 " WHERE key = ? AND state = 'claimed'",
+                                 (int(receipt_seq), signed_data, time.time(), key))
+
+    def release(self, key):
+        """Imzolanmay qolgan claim (masalan, imzolash xatosi) – kalit bo‘shatiladi."""
+        if key:
+            self._conn().execute("DELETE FROM idempotency WHERE key = ? AND state = 'claimed'", (key,))
+
+    def attach_outbox(self, key, outbox_id):
+        if key:
+            self._conn().execute("UPDATE idempotency SET outbox_id = ?, updated = ? WHERE key = ?",
+                                 (outbox_id, time.time(), key))
+
+    def settle(self, key, verdict, body):
+        """outbox.classify_response natijasi bo‘yicha: done – javob saqlanadi, fail – o‘chiriladi."""
+        if not key:
+            return
+        conn = self._conn()
+        if verdict == "done":
+            conn.execute("UPDATE idempotency SET state = 'done', response = ?, updated = ? WHERE key = ?",
+                         (json.dumps(body, ensure_ascii=False), time.time(), key))
+        elif verdict == "fail":
+            conn.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+        # retry – "pending" qoladi, keyingi urinish o‘sha imzolangan chekni yuboradi
+
+    def purge(self):
+        """TTL dan eski va MAX_ENTRIES dan ortiq yozuvlarni o‘chiradi; o‘chirilganlar soni."""
+        conn = self._conn()
+        removed = conn.execute("DELETE FROM idempotency WHERE created <= ?",
+                               (time.time() - self.ttl,)).rowcount
+        removed += conn.execute(
+            "DELETE FROM idempotency WHERE key IN (SELECT key FROM idempotency ORDER BY created DESC"
+            " LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+        return removed
+
+    def stats(self):
+        rows = self._conn().execute("SELECT state, COUNT(*) FROM idempotency GROUP BY state").fetchall()
+        return dict(rows)
+
+    def by_order(self, order_id):
+        rows = self._conn().execute(
+            "SELECT key, kind, receipt_seq, state, response, created FROM idempotency WHERE order_id = ?"
+            " ORDER BY created", (str(order_id),)).fetchall()
+        return [dict(zip(("key", "kind", "receipt_seq", "state", "response", "created"), row)) for row in rows]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_idempotency(path=IDEMPOTENCY_FILE):
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = IdempotencyCache(path)
+        return cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Idempotentlik keshi")
+    parser.add_argument("--path", default=IDEMPOTENCY_FILE)
+    parser.add_argument("--stats", action="store_true")
+    parser.add_argument("--purge", action="store_true")
+    parser.add_argument("--order")
+    args = parser.parse_args()
+
+    cache = IdempotencyCache(args.path)
+    if args.purge:
+        print(f"🧹 {cache.purge()} ta eski yozuv o‘chirildi")
+    if args.order:
+        print(json.dumps(cache.by_order(args.order), ensure_ascii=False, indent=4))
+    print(json.dumps(cache.stats(), indent=4))
@@ -3,36 +3,46 @@
 credit_refund.py – Kredit chekni qaytarish
 - ReceiptSeq avtomatik
 - Avval yuborilgan kredit chekining SaleReceiptInfo ma’lumotlari bilan
+  (db/receipts.db dan: argument – FiscalSign / ReceiptSeq / order id, bo‘lmasa oxirgi kredit)
 """
 
-import subprocess
-import requests
 import json
 import os
+import sys
 from datetime import datetime
 
+from metrics import StageTimer
+from ofd_client import get_client
+from ofd_signer import get_signer
+from outbox import Outbox
+from receipt_archive import archive_receipt
+from receipt_codec import encode_receipt
+from receipt_seq import next_receipt_seq
+from receipt_store import record_receipt, resolve_link
+
 CERT_FILE = "certificates/EZ000000000931.crt"
 KEY_FILE = "certificates/amaar.key"
 OFD_URL = "https://test.ofd.uz/emp/v3/receipt"
+signer = get_signer(CERT_FILE, KEY_FILE)  # kalit bir marta o‘qiladi
+ofd_client = get_client(OFD_URL)  # keep-alive ulanishlar pool’i
+outbox = Outbox()  # tasdiqlanmagan cheklar fon worker orqali qayta yuboriladi
+timer = StageTimer("credit_refund", flush_at_exit=True)  # bosqichlar vaqti -> logs/metrics.prom
 
 os.makedirs("logs", exist_ok=True)
 
 # Sequence
-seq_file = "logs/last_seq.txt"
-if os.path.exists(seq_file):
-    last_seq = int(open(seq_file).read().strip() or "0")
-else:
-    last_seq = 0
-ReceiptSeq = last_seq + 1
-with open(seq_file, "w") as f:
-    f.write(str(ReceiptSeq))
+timer.reset()
+ReceiptSeq = next_receipt_seq()  # qulf ostida, logs/last_seq.txt bilan mos
+timer.lap("seq_alloc")
 
-# Avvalgi kredit chekining ma’lumotlari
+# Avvalgi kredit chekining ma’lumotlari (lokal ombordan, bo‘lmasa last_credit_info.json)
+last_credit = resolve_link("credit", sys.argv[1] if len(sys.argv) > 1 else None)
 last_credit_file = "logs/last_credit_info.json"
-if not os.path.exists(last_credit_file):
-    print("❌ Avval kredit chek yuborilmagan, last_credit_info.json yo‘q!")
-    exit(1)
-last_credit = json.load(open(last_credit_file, encoding="utf-8"))
+if last_credit is None:
+    if not os.path.exists(last_credit_file):
+        print("❌ Avval kredit chek yuborilmagan, last_credit_info.json yo‘q!")
+        exit(1)
+    last_credit = json.load(open(last_credit_file, encoding="utf-8"))
 
 # Items – qaytarilayotgan mahsulot
 items = [
@@ -78,25 +88,28 @@ receipt_data = {
 }
 
 receipt_json_path = "logs/CreditRefund.json"
-with open(receipt_json_path, "w", encoding="utf-8") as f:
-    json.dump(receipt_data, f, ensure_ascii=False, indent=4)
-print(f"✅ CreditRefund.json yaratildi: {receipt_json_path}")
+receipt_bytes = encode_receipt(receipt_data, "credit_refund")  # ixcham, deterministik UTF-8
+with open(receipt_json_path, "wb") as f:
+    f.write(receipt_bytes)
+timer.lap("json_dump")
+print(f"✅ CreditRefund.json yaratildi: {receipt_json_path} ({len(receipt_bytes)} bayt)")
 
 # Sign
 signed_path = "keys/CreditRefund.p7b"
-cmd = [
-    "openssl", "cms", "-sign", "-nodetach", "-binary",
-    "-in", receipt_json_path, "-text", "-outform", "der",
-    "-out", signed_path, "-nocerts",
-    "-signer", CERT_FILE, "-inkey", KEY_FILE
-]
-subprocess.run(cmd, check=True)
+signed_data = signer.sign(receipt_bytes)
+with open(signed_path, "wb") as f:
+    f.write(signed_data)
+timer.lap("sign")
 print(f"✅ Imzolangan fayl yaratildi: {signed_path}")
 
 # Send
-headers = {"Content-Type": "application/octet-stream"}
-with open(signed_path, "rb") as f:
-    resp = requests.post(OFD_URL, headers=headers, data=f, timeout=60)
+outbox_id = outbox.put(signed_data, {"type": "credit_refund", "ReceiptSeq": ReceiptSeq, "url": OFD_URL})
+resp = ofd_client.post_receipt(signed_data)
+timer.lap("send")
+_, ofd_body = outbox.settle(outbox_id, resp)  # FiscalSign kelmasa chek outbox’da qoladi
+timer.response(ofd_body.get("Code") if ofd_body else None)
+record_receipt("credit_refund", receipt_data, ofd_body, resp.status_code)  # db/receipts.db
+archive_receipt("credit_refund", receipt_data, receipt_bytes, signed_data, resp.text, ofd_body)  # logs/archive (tarix)
 
 print("Status:", resp.status_code)
 print("Body:", resp.text)
@@ -110,3 +123,5 @@ try:
         open("logs/kridet_qaytish_qrcode.txt", "w", encoding="utf-8").write(unescaped)
 except Exception:
     print("❌ Server javobi JSON emas")
+
+timer.lap("persist")
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+marketplace_receipt.py – Marketplace order chekini yig‘ish uchun umumiy funksiyalar
+
+- sotuv_cheki.py va qaytuv_cheki2.py dagi itemlarni normalizatsiya qilish,
+  delivery (TaxiInfo) itemi, summalar va Receipt JSON yig‘ish shu yerda.
+- Konfiguratsiya (sellerlar, marketplace, merchant) chaqiruvchi tomonidan beriladi;
+  quyidagi qiymatlar sotuv_cheki.py dagi standart qiymatlar.
+- Katta (minglab qatorli) orderlar uchun ustunli (columnar) normalizatsiya:
+  VAT butun sonlarda hisoblanadi, Amount, TotalVAT va total_price bitta o‘tishda chiqadi.
+- catalog (product_catalog.ProductCatalog) berilsa, bo‘sh SPIC / PackageCode / Name
+  maydonlari katalogdan to‘ldiriladi.
+
+Paritet tekshiruvi (eski per-item sikl bilan solishtirish):
+    python marketplace_receipt.py --check
+"""
+
+import json
+import os
+import sys
+from array import array
+from datetime import datetime
+
+from product_catalog import DELIVERY_SKU
+
+amountKop = 1000
+
+# Sellerlar
+sellers = [
+    {"id": "s1", "TIN": "", "PINFL": "", "HasVAT": True},
+    {"id": "s2", "TIN": "311439965", "PINFL": "", "HasVAT": False},
+    {"id": "s3", "TIN": "311439965", "PINFL": "", "HasVAT": True},
+]
+seller_map = {s["id"]: s for s in sellers}
+
+# Marketplace
+marketplace = {
+    "name": "AMAAR MARKET",
+    "address": "Oʻzbekiston, Qashqadaryo viloyati, Qarshi, Beshkent Yoʻli koʻchasi, 1/153",
+    "ep_number": "EP000000000589",
+    "receipt_number": "RCP-0001",
+}
+
+# Merchant
+merchant = {
+    "TIN": "190261951",
+    "PINFL": "30747919403015",
+    "ContractDate": "2025-09-21 07:41:09",
+    "ContractNumber": "264"
+}
+
+LOCATION = {"Latitude": 41.2967745, "Longitude": 69.2179078}
+PHONE_NUMBER = "998901234567"
+
+ORDER_FILE = "db/order_default.json"
+DELIVERY_FILE = "db/delivery_default.json"
+EMPTY_TAXI_INFO = {"TIN": "", "PINFL": "", "CarNumber": ""}
+
+# 🚚 Xizmat bazaviy narxi
+DELIVERY_TOTAL_PRICE = 15000
+
+
+def load_order_items(order_file=ORDER_FILE):
+    """Order faylidan raw itemlarni o‘qiydi (fayl yo‘q yoki buzilgan bo‘lsa – bo‘sh ro‘yxat)."""
+    if not os.path.exists(order_file):
+        return []
+    with open(order_file, "r", encoding="utf-8") as of:
+        try:
+            return json.load(of).get("items", [])
+        except Exception as e:
+            print("❌ Order faylni o‘qishda xatolik:", e)
+            return []
+
+
+def load_order_id(order_file=ORDER_FILE):
+    """Order id: fayldagi "order_id" / "id", bo‘lmasa fayl nomi (masalan order_default)."""
+    try:
+        with open(order_file, "r", encoding="utf-8") as of:
+            order = json.load(of)
+        order_id = order.get("order_id") or order.get("id")
+    except Exception:
+        order_id = None
+    return str(order_id) if order_id else os.path.splitext(os.path.basename(order_file))[0]
+
+
+def load_taxi_info(delivery_file=DELIVERY_FILE):
+    if os.path.exists(delivery_file):
+        with open(delivery_file, "r", encoding="utf-8") as df:
+            try:
+                return json.load(df)
+            except Exception:
+                pass
+    return dict(EMPTY_TAXI_INFO)
+
+
+def as_int(value):
+    """Pul / miqdor qiymatini butun songa keltiradi (1.5 kg * amountKop, 1500.0 narx -> int)."""
+    return value if isinstance(value, int) else round(value)
+
+
+def normalize_items(raw_items, seller_map=seller_map):
+    """Order itemlarini OFD itemlariga aylantiradi; seller topilmagan itemlar tashlab ketiladi."""
+    items = []
+    for it in raw_items:
+        sid = it.get("seller_id")
+        seller_info = seller_map.get(sid)
+
+        if not seller_info:
+            continue
+
+        has_vat = seller_info.get("HasVAT", True)
+        price = as_int(it["Price"])
+        vat_percent = 12 if has_vat else 0
+
+        if has_vat:
+            # Price ichida QQS bor
+            vat_sum = round(price * vat_percent / (100 + vat_percent))
+            good_price = price
+        else:
+            # QQS yo‘q
+            vat_sum = 0
+            good_price = price
+
+        item = {
+            "Name": it["Name"],
+            "Barcode": it.get("Barcode", ""),
+            "Labels": it.get("Labels", []),
+            "SPIC": it.get("SPIC", ""),
+            "PackageCode": it.get("PackageCode", ""),
+            "OwnerType": 0,
+            "GoodPrice": good_price,
+            "Price": price,
+            "VAT": vat_sum,
+            "VATPercent": vat_percent,
+            "Amount": as_int(it["Amount"] * amountKop),
+            "Discount": 0,
+            "Other": 0,
+            "Voucher": 0,
+            "CommissionInfo": {
+                "TIN": seller_info["TIN"],
+                "PINFL": seller_info.get("PINFL", "")
+            }
+        }
+
+        items.append(item)
+    return items
+
+
+def vat_from_gross(price, vat_percent):
+    """
+    round(price * vat_percent / (100 + vat_percent)) bilan aynan bir xil natija,
+    lekin float’siz: qoldiq bo‘yicha "half-even" yaxlitlash (Python round() kabi).
+    """
+    if not vat_percent:
+        return 0
+    if not isinstance(price, int):
+        return round(price * vat_percent / (100 + vat_percent))
+    divisor = 100 + vat_percent
+    q, r = divmod(price * vat_percent, divisor)
+    r2 = 2 * r
+    if r2 > divisor or (r2 == divisor and q & 1):
+        q += 1
+    return q
+
+
+class ItemColumns:
+    """Normalizatsiya qilingan itemlar ustunlar ko‘rinishida (pul qiymatlari – int64 massivlar)."""
+
+    __slots__ = ("raw", "commission", "price", "vat", "vat_percent", "amount")
+
+    def __init__(self):
+        self.raw = []            # matnli maydonlar (Name, Barcode, ...) uchun manba item
+        self.commission = []     # seller bo‘yicha umumiy CommissionInfo dict’lari
+        self.price = array("q")
+        self.vat = array("q")
+        self.vat_percent = array("b")
+        self.amount = array("q")
+
+    def __len__(self):
+        return len(self.price)
+
+    def to_items(self):
+        """OFD item dict’lari (normalize_items bilan bir xil shakl)."""
+        return [{
+            "Name": it["Name"],
+            "Barcode": it.get("Barcode", ""),
+            "Labels": it.get("Labels", []),
+            "SPIC": it.get("SPIC", ""),
+            "PackageCode": it.get("PackageCode", ""),
+            "OwnerType": 0,
+            "GoodPrice": price,
+            "Price": price,
+            "VAT": vat_sum,
+            "VATPercent": vat_percent,
+            "Amount": amount,
+            "Discount": 0,
+            "Other": 0,
+            "Voucher": 0,
+            "CommissionInfo": commission
+        } for it, price, vat_sum, vat_percent, amount, commission
+            in zip(self.raw, self.price, self.vat, self.vat_percent, self.amount, self.commission)]
+
+
+def normalize_columns(raw_items, seller_map=seller_map, unknown=None, catalog=None):
+    """
+    Bitta o‘tish: (ItemColumns, total_price, total_vat).
+    normalize_items() bilan bir xil qoidalar – seller topilmasa item tashlanadi
+    (unknown dict berilsa, unga {seller_id: tashlangan itemlar soni} yoziladi).
+    Seller bo‘yicha VATPercent va CommissionInfo bir marta hisoblanib keshlanadi.
+    seller_map – dict yoki seller_registry.SellerRegistry.
+    """
+    cols = ItemColumns()
+    raw, commissions = cols.raw, cols.commission
+    prices, vats, vat_percents, amounts = cols.price, cols.vat, cols.vat_percent, cols.amount
+    per_seller = {}
+    total_price = 0
+    total_vat = 0
+    for it in raw_items:
+        sid = it.get("seller_id")
+        seller = per_seller.get(sid)
+        if seller is None:
+            seller_info = seller_map.get(sid)
+            if not seller_info:
+                if unknown is not None:
+                    unknown[sid] = unknown.get(sid, 0) + 1
+                continue
+            seller = per_seller[sid] = (
+                12 if seller_info.get("HasVAT", True) else 0,
+                {"TIN": seller_info["TIN"], "PINFL": seller_info.get("PINFL", "")},
+            )
+        vat_percent, commission = seller
+        if catalog is not None:
+            it = catalog.enrich(it)
+        price = as_int(it["Price"])
+        vat_sum = vat_from_gross(price, vat_percent)
+
+        raw.append(it)
+        commissions.append(commission)
+        prices.append(price)
+        vats.append(vat_sum)
+        vat_percents.append(vat_percent)
+        amounts.append(as_int(it["Amount"] * amountKop))
+        total_price += price
+        total_vat += vat_sum
+    return cols, total_price, total_vat
+
+
+def normalize_items_batched(raw_items, seller_map=seller_map, unknown=None, catalog=None):
+    """(items, total_price, total_vat) – build_receipt(..., totals=...) ga tayyor."""
+    cols, total_price, total_vat = normalize_columns(raw_items, seller_map, unknown, catalog)
+    return cols.to_items(), total_price, total_vat
+
+
+def make_delivery_item(taxi_info, delivery_total_price=DELIVERY_TOTAL_PRICE, catalog=None):
+    entry = (catalog.get(DELIVERY_SKU) if catalog is not None else None) or {}
+    return {
+        "Name": "Maxsulotlarni yetkazib berish xizmati",
+        "Barcode": DELIVERY_SKU,
+        "Labels": [],
+        "SPIC": entry.get("SPIC", "10112006002000000"),
+        "PackageCode": entry.get("PackageCode", "1209779"),
+        "OwnerType": 0,
+        "GoodPrice": delivery_total_price,
+        "Price": delivery_total_price,
+        "VAT": round(delivery_total_price * 12 / 112),  # QQS ichidan ajratiladi
+        "VATPercent": 12,
+        "Amount": 1 * amountKop,
+        "Discount": 0,
+        "Other": 0,
+        "Voucher": 0,
+        "TaxiInfo": taxi_info
+    }
+
+
+def split_payment(total_price, payment_type):
+    """(ReceivedCash, ReceivedCard) – payment_type: card | cash | mix."""
+    if payment_type == "cash":
+        return total_price, 0
+    if payment_type == "card":
+        return 0, total_price
+    if payment_type == "mix":
+        cash = total_price // 2
+        return cash, total_price - cash
+    return 0, 0
+
+
+def build_receipt(items, receipt_seq, is_refund=0, payment_type="card",
+                  marketplace=marketplace, merchant=merchant, now=None, totals=None):
+    """
+    Marketplace chekining to‘liq Receipt JSON (dict) ko‘rinishi.
+    totals=(total_price, total_vat) berilsa, itemlar qayta yig‘ilmaydi.
+    """
+    if totals is not None:
+        total_price, total_vat = totals
+    else:
+        total_price = sum(i["Price"] for i in items)
+        total_vat = sum(i["VAT"] for i in items)
+    received_cash, received_card = split_payment(total_price, payment_type)
+
+    now_time = (now or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
+    return {
+        "ReceiptSeq": receipt_seq,
+        "IsRefund": is_refund,
+        "Items": items,
+        "ReceivedCash": received_cash,
+        "ReceivedCard": received_card,
+        "TotalVAT": total_vat,
+        "Time": now_time,
+        "ReceiptType": 0,
+        "Location": LOCATION,
+        "ExtraInfo": {
+            "PhoneNumber": PHONE_NUMBER,
+            "MarketplaceName": marketplace["name"],
+            "MarketplaceAddress": marketplace["address"],
+            "EPNumber": marketplace["ep_number"],
+            "ReceiptNumber": marketplace["receipt_number"],
+            "RequestTime": now_time,
+            "CreatedTime": now_time
+        },
+        "MerchantInfo": merchant
+    }
+
+
+def unescape_qr(qurl):
+    try:
+        return qurl.encode("utf-8").decode("unicode_escape")
+    except Exception:
+        return qurl
+
+
+def _check_parity(rounds=200, size=2000):
+    """Tasodifiy orderlarda normalize_items() va normalize_items_batched() ni solishtiradi."""
+    import random
+
+    rng = random.Random(112)
+    sids = list(seller_map) + ["unknown"]
+    for _ in range(rounds):
+        raw_items = [{
+            "Name": f"Item {i}",
+            "Barcode": str(rng.randrange(10 ** 12)),
+            "SPIC": "08471012005000000",
+            "PackageCode": "1503256",
+            "Price": rng.choice([rng.randrange(1, 10 ** 7), rng.randrange(1, 10 ** 12), 56 * rng.randrange(1, 10 ** 5),
+                                 float(rng.randrange(1, 10 ** 7)), rng.randrange(1, 10 ** 7) + 0.5]),
+            "Amount": rng.choice([rng.randrange(1, 50), rng.randrange(1, 50) / 4, 1.5]),
+            "seller_id": rng.choice(sids),
+        } for i in range(rng.randrange(size))]
+        expected = normalize_items(raw_items, seller_map)
+        items, total_price, total_vat = normalize_items_batched(raw_items, seller_map)
+        if items != expected or any(type(i["Amount"]) is not int or type(i["Price"]) is not int for i in items):
+            return False
+        if total_price != sum(i["Price"] for i in expected) or total_vat != sum(i["VAT"] for i in expected):
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--check":
+        if _check_parity():
+            print("✅ Batched normalizatsiya per-item sikl bilan bir xil")
+        else:
+            print("❌ Paritet buzildi")
+            raise SystemExit(1)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+metrics.py – Bosqichlar vaqti va hisoblagichlar (Prometheus / JSON)
+
+- Bosqichlar: order_load, normalize, seq_alloc, json_dump, sign, send, persist.
+- ofd_receipt_stage_seconds{stage, type} – latency histogrammasi.
+- ofd_receipts_total{type} va ofd_responses_total{type, code} – hisoblagichlar.
+- Doimiy servis /metrics (Prometheus text) va /metrics.json orqali beradi.
+- Bir martalik skriptlar chiqishda o‘z qiymatlarini logs/metrics_state.json ga (qulf ostida)
+  qo‘shib, logs/metrics.prom (node_exporter textfile) va logs/metrics.json ni yangilaydi.
+
+Foydalanish (skriptda):
+    timer = StageTimer("sale")
+    ...                      # order o‘qish
+    timer.lap("order_load")
+    ...
+    timer.response(resp_json.get("Code"))
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from receipt_seq import atomic_write, file_lock
+
+STATE_FILE = "logs/metrics_state.json"
+PROM_FILE = "logs/metrics.prom"
+JSON_FILE = "logs/metrics.json"
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGES = ("order_load", "normalize", "seq_alloc", "json_dump", "sign", "send", "persist")
+
+
+class Registry:
+    """Jarayon ichidagi metrikalar (thread-safe)."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._hist = {}       # (stage, type) -> [counts..., +Inf], sum
+        self._counters = {}   # (name, labels tuple) -> qiymat
+
+    def observe(self, stage, seconds, receipt_type=""):
+        key = (stage, receipt_type)
+        with self._lock:
+            hist = self._hist.get(key)
+            if hist is None:
+                hist = self._hist[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+            hist["counts"][bisect_left(self.buckets, seconds)] += 1
+            hist["sum"] += seconds
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "buckets": list(self.buckets),
+                "histograms": [{"stage": s, "type": t, "counts": list(h["counts"]), "sum": h["sum"]}
+                               for (s, t), h in self._hist.items()],
+                "counters": [{"name": n, "labels": dict(lbl), "value": v}
+                             for (n, lbl), v in self._counters.items()],
+            }
+
+    def merge(self, snap):
+        if not snap or list(snap.get("buckets", [])) != list(self.buckets):
+            return
+        with self._lock:
+            for h in snap.get("histograms", []):
+                key = (h["stage"], h["type"])
+                cur = self._hist.setdefault(key, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0})
+                cur["counts"] = [a + b for a, b in zip(cur["counts"], h["counts"])]
+                cur["sum"] += h["sum"]
+            for c in snap.get("counters", []):
+                key = (c["name"], tuple(sorted(c["labels"].items())))
+                self._counters[key] = self._counters.get(key, 0) + c["value"]
+
+    def reset(self):
+        with self._lock:
+            self._hist.clear()
+            self._counters.clear()
+
+    def render_prometheus(self):
+        snap = self.snapshot()
+        out = [
+            "# HELP ofd_receipt_stage_seconds Chek bosqichlari davomiyligi",
+            "# TYPE ofd_receipt_stage_seconds histogram",
+        ]
+        for h in sorted(snap["histograms"], key=lambda h: (h["stage"], h["type"])):
+            labels = f'stage="{h["stage"]}",type="{h["type"]}"'
+            cumulative = 0
+            for le, n in zip(list(self.buckets) + ["+Inf"], h["counts"]):
+                cumulative += n
+                out.append(f'ofd_receipt_stage_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            out.append(f"ofd_receipt_stage_seconds_sum{{{labels}}} {h['sum']:.6f}")
+            out.append(f"ofd_receipt_stage_seconds_count{{{labels}}} {cumulative}")
+
+        names = sorted({c["name"] for c in snap["counters"]})
+        for name in names:
+            out.append(f"# TYPE {name} counter")
+            for c in sorted((c for c in snap["counters"] if c["name"] == name),
+                            key=lambda c: sorted(c["labels"].items())):
+                labels = ",".join(f'{k}="{v}"' for k, v in sorted(c["labels"].items()))
+                out.append(f"{name}{{{labels}}} {c['value']}")
+        return "\n".join(out) + "\n"
+
+    def to_json(self):
+        """Har bir (stage, type) uchun count / mean / p50 / p95 (bucket chegarasi bo‘yicha)."""
+        snap = self.snapshot()
+        stages = []
+        for h in snap["histograms"]:
+            total = sum(h["counts"])
+            stages.append({
+                "stage": h["stage"], "type": h["type"], "count": total,
+                "mean": h["sum"] / total if total else 0.0,
+                "p50": self._quantile(h["counts"], 0.50),
+                "p95": self._quantile(h["counts"], 0.95),
+            })
+        return {"stages": stages, "counters": snap["counters"]}
+
+    def _quantile(self, counts, q):
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for le, n in zip(list(self.buckets) + [float("inf")], counts):
+            seen += n
+            if seen >= rank:
+                return le
+        return float("inf")
+
+
+REGISTRY = Registry()
+
+
+@contextmanager
+def timed(stage, receipt_type="", registry=REGISTRY):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(stage, time.perf_counter() - start, receipt_type)
+
+
+class StageTimer:
+    """Ketma-ket bosqichlar uchun "lap" taymer: har lap oldingisidan beri o‘tgan vaqtni yozadi."""
+
+    def __init__(self, receipt_type, registry=REGISTRY, flush_at_exit=False):
+        self.receipt_type = receipt_type
+        self.registry = registry
+        self._last = time.perf_counter()
+        registry.inc("ofd_receipts_total", type=receipt_type)
+        if flush_at_exit:
+            flush_on_exit()
+
+    def reset(self):
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.registry.observe(stage, now - self._last, self.receipt_type)
+        self._last = now
+
+    def response(self, code):
+        record_response(self.receipt_type, code, self.registry)
+
+
+def record_response(receipt_type, code, registry=REGISTRY):
+    """OFD javobi Code bo‘yicha hisoblagich (JSON emas / tarmoq xatosi – "none")."""
+    registry.inc("ofd_responses_total", type=receipt_type, code="none" if code is None else str(code))
+
+
+def flush(registry=REGISTRY, state_file=STATE_FILE, prom_file=PROM_FILE, json_file=JSON_FILE):
+    """Jarayon metrikalarini diskdagi umumiy holatga qo‘shadi va eksport fayllarini yangilaydi."""
+    os.makedirs(os.path.dirname(state_file) or ".", exist_ok=True)
+    with file_lock(state_file + ".lock"):
+        total = Registry(registry.buckets)
+        try:
+            with open(state_file, "r", encoding="utf-8") as f:
+                total.merge(json.load(f))
+        except (OSError, ValueError):
+            pass
+        total.merge(registry.snapshot())
+        registry.reset()
+        atomic_write(state_file, json.dumps(total.snapshot(), ensure_ascii=False))
+        atomic_write(prom_file, total.render_prometheus())
+        atomic_write(json_file, json.dumps(total.to_json(), ensure_ascii=False, indent=4))
+
+
+_exit_hook = False
+
+
+def flush_on_exit():
+    global _exit_hook
+    if not _exit_hook:
+        _exit_hook = True
+        atexit.register(flush)
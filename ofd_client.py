@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+ofd_client.py – OFD serveriga umumiy HTTP klient
+
+- Bitta requests.Session: TCP/TLS ulanishlar pool’da saqlanadi (keep-alive),
+  shuning uchun birinchi chekdan keyingi cheklar handshake to‘lamaydi.
+- Ulanish (connect) va javob kutish (read) timeoutlari alohida.
+- Pool hajmi va timeoutlar parametr yoki muhit o‘zgaruvchilari orqali sozlanadi:
+  OFD_POOL_SIZE, OFD_CONNECT_TIMEOUT, OFD_READ_TIMEOUT.
+- Sotuv, qaytarish, avans va kredit cheklari bir xil klientdan foydalanadi.
+- Moslashuvchan parallellik (AIMD): p95 latency va xatolar ulushi me’yorida bo‘lsa bir vaqtdagi
+  so‘rovlar chegarasi asta-sekin oshadi, timeout / 5xx / Code != 0 da ikki barobar kamayadi.
+  Read timeout ham kuzatilgan p95 ga moslashadi (OFD_READ_TIMEOUT – yuqori chegara).
+- Circuit breaker: timeout / ulanish xatosi / 5xx ketma-ket davom etsa ochiladi, yangi so‘rovlar
+  OFD’ga bormaydi (CircuitOpenError) – cheklar outbox’da kutadi; sovish vaqtidan keyin bitta
+  sinov so‘rovi o‘tkaziladi, muvaffaqiyatli bo‘lsa yopiladi.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import REGISTRY
+
+OFD_URL = "https://test.ofd.uz/emp/v3/receipt"
+
+POOL_SIZE = int(os.environ.get("OFD_POOL_SIZE", "10"))
+CONNECT_TIMEOUT = float(os.environ.get("OFD_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("OFD_READ_TIMEOUT", "60"))
+MIN_READ_TIMEOUT = float(os.environ.get("OFD_MIN_READ_TIMEOUT", "10"))
+LATENCY_TARGET = float(os.environ.get("OFD_LATENCY_TARGET", "2.0"))  # soniya, p95 uchun
+
+WINDOW = 200             # oxirgi shuncha javob bo‘yicha p95 va xatolar ulushi
+ERROR_RATE_LIMIT = 0.05  # shundan yuqori bo‘lsa parallellik oshirilmaydi
+DECREASE_FACTOR = 0.5
+BREAKER_FAILURES = 5     # ketma-ket shuncha transport / 5xx xatosi – circuit ochiladi
+BREAKER_COOLDOWN = 5.0   # soniya, har ochilishda ikki barobar (BREAKER_MAX_COOLDOWN gacha)
+BREAKER_MAX_COOLDOWN = 120.0
+
+HEADERS = {
+    "Content-Type": "application/octet-stream",
+    "Connection": "keep-alive",
+}
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Circuit ochiq – so‘rov OFD’ga yuborilmadi (chek outbox’da qoladi)."""
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)]
+
+
+class AdaptiveLimiter:
+    """
+    AIMD: har muvaffaqiyatli javobda chegara += 1 / chegara (taxminan bir "aylanish"da +1),
+    timeout / 5xx / Code != 0 da chegara *= DECREASE_FACTOR (bir aylanish ichida bir marta).
+    """
+
+    def __init__(self, max_limit, initial=2, min_limit=1, latency_target=LATENCY_TARGET, window=WINDOW):
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self._samples = deque(maxlen=window)   # (latency, ok)
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, ok):
+        with self._cond:
+            self.in_flight -= 1
+            self._samples.append((latency, ok))
+            if not ok:
+                now = time.monotonic()
+                # Bir to‘lqindagi bir nechta xato chegarani bir marta kamaytiradi
+                if now - self._last_decrease >= max(latency, 0.1):
+                    self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                    self._last_decrease = now
+                    REGISTRY.inc("ofd_limit_decreases_total")
+            elif self.healthy():
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def healthy(self):
+        with self._cond:
+            if not self._samples:
+                return True
+            errors = sum(1 for _, ok in self._samples if not ok)
+            if errors / len(self._samples) > ERROR_RATE_LIMIT:
+                return False
+            return self.p95() <= self.latency_target
+
+    def p95(self):
+        with self._cond:
+            return _percentile([lat for lat, _ in self._samples], 0.95) if self._samples else 0.0
+
+    def sample_count(self):
+        return len(self._samples)
+
+
+class CircuitBreaker:
+    """closed -> (ketma-ket xatolar) open -> (cooldown) half_open -> sinov natijasiga ko‘ra."""
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN, max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.failures = failures
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = "closed"
+        self.cooldown = cooldown
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probe = False
+        self._lock = threading.Lock()
+
+    def ready(self):
+        """allow() ning holatni o‘zgartirmaydigan varianti."""
+        with self._lock:
+            return self.state == "closed" or (
+                self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown)
+
+    def allow(self):
+        """So‘rov yuborish mumkinmi; half_open’da faqat bitta sinov so‘roviga ruxsat."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+                self._probe = False
+            if self.state == "half_open" and not self._probe:
+                self._probe = True
+                return True
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                if self.state != "closed":
+                    print("✅ OFD circuit yopildi")
+                self.state = "closed"
+                self.cooldown = self.base_cooldown
+                self._consecutive = 0
+                return
+            self._consecutive += 1
+            if self.state == "half_open":
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                self._open()
+            elif self.state == "closed" and self._consecutive >= self.failures:
+                self._open()
+
+    def _open(self):
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._probe = False
+        REGISTRY.inc("ofd_circuit_opens_total")
+        print(f"⚠️ OFD circuit ochildi: {self._consecutive} ta ketma-ket xato, {self.cooldown:g} s kutiladi")
+
+
+def _ofd_code(response):
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    return body.get("Code") if isinstance(body, dict) else None
+
+
+class _SentBody:
+    """
+    DER chek fayl-obyekt sifatida: http.client uni bo‘laklab socket’ga yozadi va oxirgi bo‘lakdan
+    keyin yana read() chaqiradi – o‘sha paytda so‘rov to‘liq yozilgan, on_sent() bir marta chaqiriladi.
+    """
+
+    def __init__(self, data, on_sent):
+        self._data = data
+        self._pos = 0
+        self._on_sent = on_sent
+
+    def __len__(self):  # requests Content-Length ni shundan oladi (chunked emas)
+        return len(self._data)
+
+    def read(self, size=-1):
+        if self._pos >= len(self._data):
+            on_sent, self._on_sent = self._on_sent, None
+            if on_sent is not None:
+                on_sent()
+            return b""
+        end = len(self._data) if size is None or size < 0 else self._pos + size
+        chunk = self._data[self._pos:end]
+        self._pos += len(chunk)
+        return chunk
+
+
+class OfdClient:
+    """Bitta OFD endpoint uchun keep-alive ulanishlar pool’i (moslashuvchan parallellik + circuit breaker)."""
+
+    def __init__(self, url=OFD_URL, pool_size=POOL_SIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        self.url = url
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.limiter = AdaptiveLimiter(pool_size)
+        self.breaker = CircuitBreaker()
+
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        # Qayta yuborish yo‘q: ReceiptSeq bir marta ishlatiladi, takrorlashni chaqiruvchi hal qiladi
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=0, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def available(self):
+        """Circuit yopiq (yoki sinov vaqti kelgan)mi – yangi chekni darhol yuborish mumkinmi."""
+        return self.breaker.ready()
+
+    def current_timeout(self):
+        """(connect, read): read – kuzatilgan p95 ning 4 barobari, [MIN_READ_TIMEOUT, read_timeout] oralig‘ida."""
+        connect, read = self.timeout
+        if self.limiter.sample_count() < 20:
+            return self.timeout
+        return connect, min(read, max(MIN_READ_TIMEOUT, 4 * self.limiter.p95()))
+
+    def post_receipt(self, signed_data, timeout=None, on_sent=None):
+        """
+        Imzolangan DER chekni yuboradi va requests.Response qaytaradi.
+        Circuit ochiq bo‘lsa CircuitOpenError (requests.exceptions.ConnectionError).
+        on_sent – so‘rov socket’ga to‘liq yozilgach (javobni kutishdan oldin) shu thread’da chaqiriladi.
+        """
+        if on_sent is not None:
+            signed_data = _SentBody(signed_data, on_sent)
+        if not self.breaker.allow():
+            REGISTRY.inc("ofd_circuit_rejected_total")
+            raise CircuitOpenError(f"OFD circuit ochiq ({self.url})")
+        self.limiter.acquire()
+        started = time.monotonic()
+        transport_ok = ok = False
+        try:
+            response = self.session.post(self.url, data=signed_data, timeout=timeout or self.current_timeout())
+            transport_ok = response.status_code < 500
+            ok = transport_ok and _ofd_code(response) in (0, None)
+            return response
+        finally:
+            self.limiter.release(time.monotonic() - started, ok)
+            # Code != 0 – chekning o‘zi rad etilgan, endpoint ishlayapti: circuit’ga ta’sir qilmaydi
+            self.breaker.record(transport_ok)
+
+    def status(self):
+        return {"url": self.url, "limit": round(self.limiter.limit, 2), "in_flight": self.limiter.in_flight,
+                "p95": round(self.limiter.p95(), 4), "circuit": self.breaker.state}
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url=OFD_URL, terminal_id=None, **kwargs):
+    """
+    URL bo‘yicha bitta umumiy OfdClient (jarayon ichida qayta ishlatiladi).
+    terminal_id berilsa har bir terminal (fiskal modul) o‘z klientini oladi – parallellik
+    chegarasi va circuit terminal bo‘yicha alohida (terminal_pool).
+    """
+    key = (url, terminal_id)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OfdClient(url, **kwargs)
+            _clients[key] = client
+        return client
+
+
+def post_receipt(signed_data, url=OFD_URL):
+    return get_client(url).post_receipt(signed_data)
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+ofd_signer.py – Chekni jarayon ichida CMS bilan imzolash
+
+- `openssl cms -sign -nodetach -binary -text -outform der -nocerts` buyrug‘ining
+  o‘rnini bosadi: xuddi shu libcrypto ichidagi CMS_sign() ctypes orqali chaqiriladi.
+- Sertifikat va kalit (certificates/amaar.key) bir marta o‘qiladi va xotirada turadi.
+- Imzolanadigan JSON va natijaviy DER baytlar diskka yozilmasdan qaytariladi.
+- libcrypto topilmasa, eski `openssl cms` subprocess yo‘liga qaytadi.
+- Ko‘p cheklar uchun SigningPool: har bir CPU yadrosida kalitni bir marta o‘qigan
+  worker jarayon; DER natijalar yuborilgan tartibda qaytadi.
+- CmsVerifier: arxivdagi DER imzoni certificates/ dagi EP/EZ sertifikatlari bilan
+  tekshiradi (CMS_verify, imzo zanjiri emas – imzoning o‘zi); ommaviy tekshiruv receipt_verify.py da.
+
+Tekshirish (CLI bilan bayt-ma-bayt solishtirish):
+    python ofd_signer.py --check logs/ReceiptInfo.json
+Pool o‘tkazuvchanligi (1..N worker):
+    python ofd_signer.py --pool-bench logs/ReceiptInfo.json 2000
+"""
+
+import ctypes
+import ctypes.util
+import os
+import time
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+CERT_FILE = "certificates/EP000000000589.crt"
+KEY_FILE = "certificates/amaar.key"
+
+# openssl/cms.h dagi flaglar (CLI bilan bir xil: -binary -text -nocerts)
+CMS_TEXT = 0x1
+CMS_NOCERTS = 0x2
+CMS_BINARY = 0x80
+SIGN_FLAGS = CMS_BINARY | CMS_TEXT | CMS_NOCERTS
+CMS_NO_SIGNER_CERT_VERIFY = 0x20
+BIO_CTRL_INFO = 3  # BIO_get_mem_data
+VERIFY_FLAGS = CMS_BINARY | CMS_NO_SIGNER_CERT_VERIFY
+
+
+class SigningError(RuntimeError):
+    """Imzolashda xatolik (kalit/sertifikat o‘qilmadi yoki CMS_sign muvaffaqiyatsiz)."""
+
+
+def _load_libcrypto():
+    names = [ctypes.util.find_library("crypto"), "libcrypto.so.3", "libcrypto.so.1.1",
+             "libcrypto-3-x64.dll", "libcrypto-1_1-x64.dll", "libcrypto.dylib"]
+    for name in names:
+        if not name:
+            continue
+        try:
+            lib = ctypes.CDLL(name)
+        except OSError:
+            continue
+
+        vp = ctypes.c_void_p
+        lib.BIO_new_mem_buf.argtypes = [ctypes.c_char_p, ctypes.c_int]
+        lib.BIO_new_mem_buf.restype = vp
+        lib.BIO_free.argtypes = [vp]
+        lib.PEM_read_bio_X509.argtypes = [vp, vp, vp, vp]
+        lib.PEM_read_bio_X509.restype = vp
+        lib.PEM_read_bio_PrivateKey.argtypes = [vp, vp, vp, vp]
+        lib.PEM_read_bio_PrivateKey.restype = vp
+        lib.X509_free.argtypes = [vp]
+        lib.EVP_PKEY_free.argtypes = [vp]
+        lib.CMS_sign.argtypes = [vp, vp, vp, vp, ctypes.c_uint]
+        lib.CMS_sign.restype = vp
+        lib.CMS_ContentInfo_free.argtypes = [vp]
+        lib.i2d_CMS_ContentInfo.argtypes = [vp, ctypes.POINTER(ctypes.c_void_p)]
+        lib.i2d_CMS_ContentInfo.restype = ctypes.c_int
+        # Tekshirish (CmsVerifier)
+        lib.d2i_CMS_ContentInfo.argtypes = [vp, ctypes.POINTER(ctypes.c_void_p), ctypes.c_long]
+        lib.d2i_CMS_ContentInfo.restype = vp
+        lib.d2i_X509.argtypes = [vp, ctypes.POINTER(ctypes.c_void_p), ctypes.c_long]
+        lib.d2i_X509.restype = vp
+        lib.CMS_verify.argtypes = [vp, vp, vp, vp, vp, ctypes.c_uint]
+        lib.CMS_verify.restype = ctypes.c_int
+        lib.BIO_s_mem.restype = vp
+        lib.BIO_new.argtypes = [vp]
+        lib.BIO_new.restype = vp
+        lib.BIO_ctrl.argtypes = [vp, ctypes.c_int, ctypes.c_long, vp]
+        lib.BIO_ctrl.restype = ctypes.c_long
+        lib.OPENSSL_sk_new_null.restype = vp
+        lib.OPENSSL_sk_push.argtypes = [vp, vp]
+        lib.OPENSSL_sk_push.restype = ctypes.c_int
+        lib.OPENSSL_sk_free.argtypes = [vp]
+        lib.ERR_get_error.restype = ctypes.c_ulong
+        lib.ERR_error_string_n.argtypes = [ctypes.c_ulong, ctypes.c_char_p, ctypes.c_size_t]
+        return lib
+    return None
+
+
+_libcrypto = _load_libcrypto()
+
+
+def openssl_cli_sign(data, cert_file=CERT_FILE, key_file=KEY_FILE):
+    """Eski usul: vaqtinchalik fayllar orqali `openssl cms -sign` (fallback va tekshiruv uchun)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        in_path = os.path.join(tmp, "receipt.json")
+        out_path = os.path.join(tmp, "receipt.p7b")
+        with open(in_path, "wb") as f:
+            f.write(data)
+        cmd = [
+            "openssl", "cms", "-sign",
+            "-nodetach", "-binary",
+            "-in", in_path,
+            "-text",
+            "-outform", "der",
+            "-out", out_path,
+            "-nocerts",
+            "-signer", cert_file,
+            "-inkey", key_file
+        ]
+        try:
+            subprocess.run(cmd, check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise SigningError(f"openssl cms xatosi: {e}") from e
+        with open(out_path, "rb") as f:
+            return f.read()
+
+
+class CmsSigner:
+    """Bitta terminal sertifikati + kalit uchun xotirada turadigan imzolovchi."""
+
+    def __init__(self, cert_file=CERT_FILE, key_file=KEY_FILE):
+        self.cert_file = cert_file
+        self.key_file = key_file
+        self._cert = None
+        self._key = None
+        if _libcrypto is not None:
+            self._cert = self._read_pem(cert_file, _libcrypto.PEM_read_bio_X509)
+            self._key = self._read_pem(key_file, _libcrypto.PEM_read_bio_PrivateKey)
+
+    @staticmethod
+    def _read_pem(path, reader):
+        with open(path, "rb") as f:
+            pem = f.read()
+        bio = _libcrypto.BIO_new_mem_buf(pem, len(pem))
+        if not bio:
+            raise SigningError(f"BIO yaratilmadi: {path}")
+        try:
+            obj = reader(bio, None, None, None)
+        finally:
+            _libcrypto.BIO_free(bio)
+        if not obj:
+            raise SigningError(f"PEM o‘qilmadi: {path}")
+        return obj
+
+    @property
+    def in_process(self):
+        return self._key is not None
+
+    def sign(self, data):
+        """JSON baytlarini imzolab, DER SignedData qaytaradi."""
+        if not self.in_process:
+            return openssl_cli_sign(data, self.cert_file, self.key_file)
+
+        bio = _libcrypto.BIO_new_mem_buf(data, len(data))
+        if not bio:
+            raise SigningError("BIO yaratilmadi")
+        try:
+            cms = _libcrypto.CMS_sign(self._cert, self._key, None, bio, SIGN_FLAGS)
+        finally:
+            _libcrypto.BIO_free(bio)
+        if not cms:
+            raise SigningError("CMS_sign muvaffaqiyatsiz")
+
+        try:
+            size = _libcrypto.i2d_CMS_ContentInfo(cms, None)
+            if size <= 0:
+                raise SigningError("DER kodlashda xatolik")
+            buf = ctypes.create_string_buffer(size)
+            ptr = ctypes.c_void_p(ctypes.addressof(buf))
+            _libcrypto.i2d_CMS_ContentInfo(cms, ctypes.byref(ptr))
+            return buf.raw
+        finally:
+            _libcrypto.CMS_ContentInfo_free(cms)
+
+    def sign_file(self, in_path, out_path):
+        """`openssl cms -sign -in ... -out ...` ning to‘g‘ridan-to‘g‘ri o‘rinbosari."""
+        with open(in_path, "rb") as f:
+            signed = self.sign(f.read())
+        with open(out_path, "wb") as f:
+            f.write(signed)
+        return signed
+
+    def close(self):
+        if self._key is not None:
+            _libcrypto.EVP_PKEY_free(self._key)
+            self._key = None
+        if self._cert is not None:
+            _libcrypto.X509_free(self._cert)
+            self._cert = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+_signers = {}
+_signers_lock = threading.Lock()
+
+
+def get_signer(cert_file=CERT_FILE, key_file=KEY_FILE):
+    """(cert, key) juftligi uchun keshlangan CmsSigner."""
+    key = (os.path.abspath(cert_file), os.path.abspath(key_file))
+    with _signers_lock:
+        signer = _signers.get(key)
+        if signer is None:
+            signer = CmsSigner(cert_file, key_file)
+            _signers[key] = signer
+        return signer
+
+
+def sign_bytes(data, cert_file=CERT_FILE, key_file=KEY_FILE):
+    return get_signer(cert_file, key_file).sign(data)
+
+
+def _last_ssl_error():
+    """libcrypto xato navbatidagi birinchi xato matni (navbat tozalanadi)."""
+    code = _libcrypto.ERR_get_error()
+    text = None
+    if code:
+        buf = ctypes.create_string_buffer(256)
+        _libcrypto.ERR_error_string_n(code, buf, len(buf))
+        text = buf.value.decode("ascii", "replace")
+    while _libcrypto.ERR_get_error():
+        pass
+    return text
+
+
+def read_certificates(paths):
+    """PEM (bir faylda bir nechta) yoki DER sertifikatlar -> [(fayl, baytlar, pem_mi)]."""
+    certs = []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        if b"-----BEGIN CERTIFICATE-----" in data:
+            for block in data.split(b"-----END CERTIFICATE-----")[:-1]:
+                certs.append((path, block + b"-----END CERTIFICATE-----\n", True))
+        else:
+            certs.append((path, data, False))
+    return certs
+
+
+def openssl_cli_verify(der, cert_files):
+    """Eski usul: `openssl cms -verify -noverify` (libcrypto topilmaganda) -> (ok, sabab, mazmun)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        in_path = os.path.join(tmp, "receipt.p7b")
+        out_path = os.path.join(tmp, "content.bin")
+        certs_path = os.path.join(tmp, "certs.pem")
+        with open(in_path, "wb") as f:
+            f.write(der)
+        with open(certs_path, "wb") as f:
+            for path in cert_files:
+                with open(path, "rb") as cf:
+                    f.write(cf.read().rstrip(b"\n") + b"\n")
+        cmd = ["openssl", "cms", "-verify", "-inform", "der", "-in", in_path, "-binary",
+               "-noverify", "-certfile", certs_path, "-out", out_path]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True)
+        except OSError as e:
+            raise SigningError(f"openssl cms xatosi: {e}") from e
+        if result.returncode == 0:
+            with open(out_path, "rb") as f:
+                return True, None, f.read()
+        return False, (result.stderr.strip().splitlines() or ["verify failed"])[-1], None
+
+
+class CmsVerifier:
+    """
+    DER SignedData imzosini berilgan sertifikatlar bilan tekshiradi.
+    Cheklar -nocerts bilan imzolangan: imzolovchi sertifikat (issuer + serial) shu ro‘yxatdan topiladi.
+    """
+
+    def __init__(self, cert_files):
+        self.cert_files = list(cert_files)
+        self._certs = []
+        self._stack = None
+        if _libcrypto is None:
+            return
+        self._stack = _libcrypto.OPENSSL_sk_new_null()
+        for path, data, is_pem in read_certificates(self.cert_files):
+            if is_pem:
+                bio = _libcrypto.BIO_new_mem_buf(data, len(data))
+                try:
+                    cert = _libcrypto.PEM_read_bio_X509(bio, None, None, None)
+                finally:
+                    _libcrypto.BIO_free(bio)
+            else:
+                buf = ctypes.create_string_buffer(data, len(data))
+                ptr = ctypes.c_void_p(ctypes.addressof(buf))
+                cert = _libcrypto.d2i_X509(None, ctypes.byref(ptr), len(data))
+            if not cert:
+                _last_ssl_error()
+                raise SigningError(f"Sertifikat o‘qilmadi: {path}")
+            self._certs.append(cert)
+            _libcrypto.OPENSSL_sk_push(self._stack, cert)
+
+    @property
+    def in_process(self):
+        return self._stack is not None
+
+    def verify(self, der):
+        """
+        (True, None, ichki mazmun) yoki (False, sabab, None) – imzo shu sertifikatlardan
+        biriga mos kelsa True; mazmun – imzolangan baytlar (chek JSON).
+        """
+        if not self.in_process:
+            return openssl_cli_verify(der, self.cert_files)
+        buf = ctypes.create_string_buffer(der, len(der))
+        ptr = ctypes.c_void_p(ctypes.addressof(buf))
+        cms = _libcrypto.d2i_CMS_ContentInfo(None, ctypes.byref(ptr), len(der))
+        if not cms:
+            return False, _last_ssl_error() or "DER SignedData o‘qilmadi", None
+        out = _libcrypto.BIO_new(_libcrypto.BIO_s_mem())
+        try:
+            if _libcrypto.CMS_verify(cms, self._stack, None, None, out, VERIFY_FLAGS) != 1:
+                return False, _last_ssl_error() or "imzo mos emas", None
+            data = ctypes.c_void_p()
+            n = _libcrypto.BIO_ctrl(out, BIO_CTRL_INFO, 0, ctypes.byref(data))
+            return True, None, ctypes.string_at(data, n) if n > 0 else b""
+        finally:
+            _libcrypto.BIO_free(out)
+            _libcrypto.CMS_ContentInfo_free(cms)
+
+    def close(self):
+        if self._stack is not None:
+            _libcrypto.OPENSSL_sk_free(self._stack)
+            self._stack = None
+        for cert in self._certs:
+            _libcrypto.X509_free(cert)
+        self._certs = []
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+_pool_signer = None  # worker jarayon ichidagi imzolovchi
+
+
+def _pool_init(cert_file, key_file):
+    global _pool_signer
+    _pool_signer = CmsSigner(cert_file, key_file)
+
+
+def _pool_sign_chunk(chunk):
+    return [_pool_signer.sign(data) for data in chunk]
+
+
+class SigningPool:
+    """
+    Ko‘p yadroli imzolash: har bir worker kalitni bir marta o‘qiydi.
+    workers=1 bo‘lsa jarayon ochilmaydi – joriy jarayondagi CmsSigner ishlatiladi.
+    """
+
+    def __init__(self, cert_file=CERT_FILE, key_file=KEY_FILE, workers=None, chunk_size=16):
+        self.cert_file = cert_file
+        self.key_file = key_file
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = max(1, chunk_size)
+        self._executor = None
+        if self.workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_pool_init,
+                                                 initargs=(cert_file, key_file))
+
+    def imap(self, iterable):
+        """
+        Baytlar oqimini imzolaydi, DER’larni kirish tartibida qaytaradi (generator).
+        Bir vaqtda ko‘pi bilan 2 * workers bo‘lak ishlovda – kirish oqimi to‘liq o‘qilmaydi.
+        """
+        if self._executor is None:
+            signer = get_signer(self.cert_file, self.key_file)
+            for data in iterable:
+                yield signer.sign(data)
+            return
+
+        in_flight = deque()
+        chunk = []
+        for data in iterable:
+            chunk.append(data)
+            if len(chunk) >= self.chunk_size:
+                in_flight.append(self._executor.submit(_pool_sign_chunk, chunk))
+                chunk = []
+                if len(in_flight) >= 2 * self.workers:
+                    yield from in_flight.popleft().result()
+        if chunk:
+            in_flight.append(self._executor.submit(_pool_sign_chunk, chunk))
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+    def sign_many(self, datas):
+        return list(self.imap(datas))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _der_read(der, pos):
+    """DER TLV: (tag, qiymat boshi, qiymat oxiri) qaytaradi."""
+    tag = der[pos]
+    length = der[pos + 1]
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7F
+        length = int.from_bytes(der[pos:pos + n], "big")
+        pos += n
+    return tag, pos, pos + length
+
+
+def extract_content(der):
+    """SignedData ichidagi imzolangan kontent (chek JSON baytlari)."""
+    try:
+        _, pos, _ = _der_read(der, 0)            # ContentInfo SEQUENCE
+        pos = _der_read(der, pos)[2]             # contentType OID
+        _, pos, _ = _der_read(der, pos)          # [0] EXPLICIT
+        _, pos, _ = _der_read(der, pos)          # SignedData SEQUENCE
+        pos = _der_read(der, pos)[2]             # version
+        pos = _der_read(der, pos)[2]             # digestAlgorithms
+        _, pos, _ = _der_read(der, pos)          # encapContentInfo SEQUENCE
+        pos = _der_read(der, pos)[2]             # eContentType
+        _, pos, _ = _der_read(der, pos)          # [0] EXPLICIT
+        tag, start, end = _der_read(der, pos)    # eContent OCTET STRING
+    except IndexError as e:
+        raise SigningError("DER SignedData buzilgan") from e
+    if tag != 0x04:
+        raise SigningError("eContent OCTET STRING emas")
+    return bytes(der[start:end])
+
+
+def check_against_cli(data, cert_file=CERT_FILE, key_file=KEY_FILE, attempts=5):
+    """
+    CLI va jarayon ichidagi natijani solishtiradi.
+    signingTime imzolangan atribut bo‘lgani uchun ikkalasi bir soniya ichida bo‘lishi shart,
+    soniya almashsa qayta uriniladi.
+    """
+    signer = get_signer(cert_file, key_file)
+    for _ in range(attempts):
+        before = datetime.now(timezone.utc).replace(microsecond=0)
+        cli = openssl_cli_sign(data, cert_file, key_file)
+        own = signer.sign(data)
+        after = datetime.now(timezone.utc).replace(microsecond=0)
+        if before == after:
+            return cli == own, cli, own
+    raise SigningError("Bir soniya ichida solishtirib bo‘lmadi")
+
+
+def pool_bench(data, count=2000, cert_file=CERT_FILE, key_file=KEY_FILE, max_workers=None):
+    """1..max_workers worker bilan imzolash tezligi: [(workers, imzo/soniya), ...]."""
+    results = []
+    for workers in range(1, (max_workers or os.cpu_count() or 1) + 1):
+        with SigningPool(cert_file, key_file, workers) as pool:
+            pool.sign_many([data] * (workers * pool.chunk_size))  # workerlarni isitish
+            started = time.perf_counter()
+            pool.sign_many([data] * count)
+            results.append((workers, count / (time.perf_counter() - started)))
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "--pool-bench":
+        path = sys.argv[2] if len(sys.argv) > 2 else "logs/ReceiptInfo.json"
+        count = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+        with open(path, "rb") as f:
+            payload = f.read()
+        for n, rate in pool_bench(payload, count):
+            print(f"{n} worker: {rate:8.1f} imzo/soniya")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "--check":
+        path = sys.argv[2] if len(sys.argv) > 2 else "logs/ReceiptInfo.json"
+        cert = sys.argv[3] if len(sys.argv) > 3 else CERT_FILE
+        with open(path, "rb") as f:
+            payload = f.read()
+        if not get_signer(cert, KEY_FILE).in_process:
+            print("❌ libcrypto topilmadi, jarayon ichida imzolash mavjud emas")
+            raise SystemExit(1)
+        same, cli_der, own_der = check_against_cli(payload, cert, KEY_FILE)
+        if same:
+            print(f"✅ CLI bilan bir xil DER ({len(own_der)} bayt)")
+        else:
+            print(f"❌ Farq bor: CLI {len(cli_der)} bayt, ichki {len(own_der)} bayt")
+            raise SystemExit(1)
+    else:
+        print("Foydalanish: python ofd_signer.py --check [receipt.json] [cert.crt]")
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+ofd_stub.py – test.ofd.uz o‘rniga lokal OFD imitatori (benchmark va sinov uchun)
+
+- POST /emp/v3/receipt: DER (SignedData) tanani qabul qiladi, ichidagi chek JSON’dan
+  ReceiptSeq va ReceiptType ni o‘qiydi.
+- Haqiqiy OFD kabi javob: Code, Message, TerminalID, ReceiptSeq, DateTime, FiscalSign
+  va \\u0026 bilan escape qilingan QRCodeURL.
+- Sozlanadigan kechikish (latency + jitter), rad etish (Code != 0) va 5xx ulushi.
+
+Ishga tushirish:
+    python ofd_stub.py --port 8780 --latency 0.15 --jitter 0.05 --error-rate 0.01
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ofd_signer import SigningError, extract_content
+
+RECEIPT_PATH = "/emp/v3/receipt"
+
+QR_PATHS = {0: "epi", 1: "epi/avans", 2: "epi/credit"}
+
+
+class StubConfig:
+    def __init__(self, terminal_id="EZ000000000931", latency=0.0, jitter=0.0,
+                 error_rate=0.0, server_error_rate=0.0, seed=None):
+        self.terminal_id = terminal_id
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.stats = {"requests": 0, "accepted": 0, "rejected": 0, "server_errors": 0}
+        self.stats_lock = threading.Lock()
+
+    def roll(self):
+        with self.rng_lock:
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            return delay, self.rng.random(), "%012d" % self.rng.randrange(10 ** 12)
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            self.stats[key] += 1
+
+
+def make_response(config, receipt, fiscal_sign, now=None):
+    """Haqiqiy OFD javobiga o‘xshash JSON matni (QRCodeURL ichida \\u0026)."""
+    date_time = (now or datetime.now()).strftime("%Y%m%d%H%M%S")
+    seq = receipt.get("ReceiptSeq")
+    path = QR_PATHS.get(receipt.get("ReceiptType", 0), "epi")
+    qr = f"https://ofd.soliq.uz/{path}?t={config.terminal_id}&r={seq}&c={date_time}&s={fiscal_sign}"
+    body = {
+        "Code": 0,
+        "Message": "accepted",
+        "TerminalID": config.terminal_id,
+        "ReceiptSeq": seq,
+        "DateTime": date_time,
+        "FiscalSign": fiscal_sign,
+        "QRCodeURL": qr,
+    }
+    return json.dumps(body, indent=4).replace("&", "\\u0026")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config = None
+    protocol_version = "HTTP/1.1"
+    # Sarlavha va tana bitta segmentda ketsin (Nagle + delayed ACK ~40 ms kechikish bermasin)
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, text):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        der = self.rfile.read(length)
+        if self.path != RECEIPT_PATH:
+            self._reply(404, json.dumps({"status": 404, "error": "Not Found", "path": self.path}))
+            return
+
+        delay, dice, fiscal_sign = self.config.roll()
+        if delay:
+            time.sleep(delay)
+
+        if dice < self.config.server_error_rate:
+            self.config.count("server_errors")
+            self._reply(503, "<html><body>503 Service Temporarily Unavailable</body></html>")
+            return
+
+        try:
+            receipt = json.loads(extract_content(der))
+        except (SigningError, ValueError):
+            self.config.count("rejected")
+            self._reply(200, json.dumps({"Code": -1, "Message": "invalid receipt format"}))
+            return
+
+        if dice < self.config.server_error_rate + self.config.error_rate:
+            self.config.count("rejected")
+            self._reply(200, json.dumps({"Code": -5, "Message": "receipt rejected",
+                                         "ReceiptSeq": receipt.get("ReceiptSeq")}))
+            return
+
+        self.config.count("accepted")
+        self._reply(200, make_response(self.config, receipt, fiscal_sign))
+
+
+def make_stub_server(config, host="127.0.0.1", port=0):
+    handler = type("BoundStubHandler", (StubHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_stub(config=None, host="127.0.0.1", port=0):
+    """Stub’ni fon thread’da ishga tushiradi: (server, url)."""
+    server = make_stub_server(config or StubConfig(), host, port)
+    threading.Thread(target=server.serve_forever, name="ofd-stub", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{RECEIPT_PATH}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lokal OFD imitatori")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8780)
+    parser.add_argument("--terminal", default="EZ000000000931")
+    parser.add_argument("--latency", type=float, default=0.0, help="soniya")
+    parser.add_argument("--jitter", type=float, default=0.0, help="soniya")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--server-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    cfg = StubConfig(args.terminal, args.latency, args.jitter, args.error_rate, args.server_error_rate)
+    srv = make_stub_server(cfg, args.host, args.port)
+    print(f"✅ OFD stub: http://{args.host}:{args.port}{RECEIPT_PATH}")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        print("Statistika:", cfg.stats)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+order_stream.py – Ko‘p orderli NDJSON oqimidan cheklar (doimiy xotira bilan)
+
+- Kirish: fayl yoki pipe, har qatorda bitta order:
+    {"order_id": "ORD-1", "items": [...], "payment_type": "card", "taxi_info": {...}, "type": "sale"}
+- Generatorlar zanjiri: qator -> order -> Receipt JSON -> imzo -> yuborish -> natija.
+  Har bosqich bittadan element o‘tkazadi, yuborishda esa faqat --window tagacha chek
+  xotirada turadi – orderlar soni qancha bo‘lmasin, xotira o‘zgarmaydi.
+- Normalizatsiya marketplace_receipt dagi ustunli yo‘l bilan (sotuv_cheki.py bilan bir xil);
+  cheklar dict emas, receipt_model.Receipt (slotlar, int summalar, umumiy CommissionInfo) –
+  imzo va yuborish navbatlarida chek boshiga xotira ~2.5 baravar kam.
+- Har bir chek ReceiptSeq olishdan oldin receipt_validator bilan tekshiriladi: xatoli order
+  xabar berilib tashlanadi – seq, imzo va OFD so‘rovi sarflanmaydi.
+- Qaytuv (type: refund) RefundInfo’si: order["link"] (FiscalSign / ReceiptSeq) yoki order_id
+  bo‘yicha db/receipts.db dagi asl sotuvdan; topilmasa order tashlanadi. Asl sotuv
+  refund_ledger daftarida bo‘lsa (yoki order["returns"] berilsa) qoldiq imzodan oldin
+  ushlab qo‘yiladi va itemlar daftardan olinadi (receipt_engine bilan bir xil): qoldiq
+  yetmasa yoki qaytuv allaqachon fiskallashtirilgan bo‘lsa order tashlanadi.
+- --sign-workers N: imzolash N ta jarayonda (ofd_signer.SigningPool), tartib saqlanadi.
+- Har bir chek outbox’ga yoziladi, natija db/receipts.db ga va --out NDJSON fayliga qatorma-qator;
+  so‘rov, imzo va javob logs/archive segmentlariga (guruhli fsync bilan).
+
+Foydalanish:
+    python order_stream.py orders.ndjson --out logs/stream_results.ndjson
+    cat orders.ndjson | python order_stream.py - --window 16
+    python order_stream.py backlog.ndjson --sign-workers 8
+    python order_stream.py orders.ndjson --dry-run     # faqat yig‘ish va imzolash (ReceiptSeq ajratilmaydi)
+"""
+
+import argparse
+import json
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import marketplace_receipt as mr
+from ofd_client import get_client
+from ofd_signer import SigningPool, get_signer
+from product_catalog import get_catalog
+from outbox import Outbox
+from receipt_archive import get_archive, response_fields
+from receipt_codec import encode_receipt, get_encoder
+from receipt_model import Item, Receipt
+from receipt_seq import get_allocator
+from receipt_store import get_store, link_info, resolve_link
+from receipt_validator import format_issues, validate
+from refund_ledger import LedgerError, RefundDone, get_ledger, order_returns, refund_key
+from seller_registry import get_registry
+
+CERT_FILE = "certificates/EP000000000589.crt"
+KEY_FILE = "certificates/amaar.key"
+OFD_URL = "https://txkm.soliq.uz/emp/v3/receipt"
+
+ORDER_TYPES = {"sale": 0, "refund": 1}  # type -> IsRefund
+LINK_SOURCES = ("marketplace_sale", "sale")  # qaytuvning asl cheki turlari
+
+
+def iter_orders(lines):
+    """NDJSON qatorlaridan order dict’lari; buzilgan qator xabar berilib tashlanadi."""
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            order = json.loads(line)
+        except ValueError as e:
+            print(f"❌ {line_no}-qator JSON emas: {e}", file=sys.stderr)
+            continue
+        if not isinstance(order, dict) or not isinstance(order.get("items"), list):
+            print(f"❌ {line_no}-qatorda items yo‘q", file=sys.stderr)
+            continue
+        order.setdefault("order_id", f"line-{line_no}")
+        yield order
+
+
+def refund_link(order, store):
+    """Qaytuv orderining RefundInfo’si: order["link"] yoki order_id bo‘yicha asl sotuv; topilmasa None."""
+    if order.get("link"):
+        return resolve_link(LINK_SOURCES, order["link"], store=store)
+    row = store.by_order(order["order_id"], LINK_SOURCES)
+    return link_info(row) if row else None
+
+
+def reserve_refund(order, refund_info, ledger, dry_run=False):
+    """
+    Daftardagi sotuv qaytuvi: (refund_id, itemlar, RefundInfo) – qoldiq ushlab qo‘yiladi;
+    sotuv daftarda yo‘q va returns berilmagan bo‘lsa None (order itemlari bilan).
+    LedgerError / RefundDone – order tashlanadi.
+    """
+    fiscal_sign = refund_info.get("FiscalSign")
+    if "returns" not in order and not (fiscal_sign and ledger.has_sale(fiscal_sign)):
+        return None
+    refund_id = refund_key(order, order["order_id"])
+    items, link = ledger.reserve(refund_id, fiscal_sign, order_returns(order.get("returns", "all")), dry_run)
+    return refund_id, items, link
+
+
+def iter_receipts(orders, seq, seller_map=None, marketplace=mr.marketplace,
+                  merchant=mr.merchant, taxi_info=None, catalog=None, validator=None, store=None,
+                  ledger=None, dry_run=False):
+    """
+    (order_id, type, receipt_data, refund_id) – har bir order uchun yangi ReceiptSeq bilan
+    (seq None bo‘lsa ReceiptSeq None qoladi). validator berilsa tekshiruvdan o‘tmagan
+    order seq olmasdan tashlanadi.
+    seller_map berilmasa db/sellers.json reestri (oqim davomida o‘zgarsa qayta o‘qiladi).
+    store – qaytuvlar RefundInfo’si uchun (berilmasa db/receipts.db).
+    ledger – qaytuv qoldig‘i refund_id bo‘yicha ushlab qo‘yiladi (berilmasa daftarsiz, refund_id None);
+    dry_run – qoldiq o‘zgarmaydi.
+    """
+    seller_map = seller_map or get_registry(fallback=mr.sellers)
+    store = store or get_store()
+    catalog = catalog or get_catalog()
+    default_taxi = taxi_info or mr.load_taxi_info()
+    for order in orders:
+        if hasattr(seller_map, "refresh"):
+            seller_map.refresh()
+        order_type = order.get("type", "sale")
+        if order_type not in ORDER_TYPES:
+            print(f"❌ {order['order_id']}: noma’lum tur {order_type}", file=sys.stderr)
+            continue
+        unknown_sellers = {}
+        cols, total_price, total_vat = mr.normalize_columns(order["items"], seller_map, unknown_sellers, catalog)
+        if unknown_sellers and hasattr(seller_map, "note_unknown"):
+            seller_map.note_unknown(unknown_sellers, f"(order {order['order_id']})")
+        delivery = Item.from_dict(mr.make_delivery_item(order.get("taxi_info") or default_taxi, catalog=catalog))
+        receipt_data = Receipt.from_columns(cols, None, (delivery,), is_refund=ORDER_TYPES[order_type],
+                                            payment_type=order.get("payment_type", "card"),
+                                            marketplace=marketplace, merchant=merchant,
+                                            totals=(total_price + delivery.price, total_vat + delivery.vat))
+        refund_id = None
+        if ORDER_TYPES[order_type]:
+            refund_info = refund_link(order, store)
+            if refund_info is None:
+                print(f"❌ {order['order_id']}: qaytuvning asl cheki topilmadi (RefundInfo)", file=sys.stderr)
+                continue
+            if ledger is not None:
+                try:
+                    reserved = reserve_refund(order, refund_info, ledger, dry_run)
+                except LedgerError as e:  # RefundDone ham – qayta fiskallashtirilmaydi
+                    print(f"❌ {order['order_id']}: qaytuv daftar bo‘yicha mumkin emas – {e}", file=sys.stderr)
+                    continue
+                if reserved is not None:
+                    refund_id, items, refund_info = reserved
+                    receipt_data = Receipt.build([Item.from_dict(i) for i in items], None, is_refund=1,
+                                                 payment_type=order.get("payment_type", "card"),
+                                                 marketplace=marketplace, merchant=merchant)
+            receipt_data["RefundInfo"] = refund_info
+        if validator is not None:
+            issues = validator(receipt_data)
+            if issues:
+                if refund_id is not None and not dry_run:
+                    ledger.release(refund_id)
+                print(f"❌ {order['order_id']}: chek rad etildi – {format_issues(issues)}", file=sys.stderr)
+                continue
+        if seq is not None:
+            receipt_data["ReceiptSeq"] = seq.next()
+        yield order["order_id"], order_type, receipt_data, refund_id
+
+
+def iter_signed(receipts, signer):
+    """
+    (order_id, type, receipt_data, refund_id, signed_data).
+    signer – CmsSigner yoki SigningPool (ko‘p jarayonli, natija tartibi saqlanadi).
+    """
+    if not isinstance(signer, SigningPool):
+        for order_id, order_type, receipt_data, refund_id in receipts:
+            yield order_id, order_type, receipt_data, refund_id, signer.sign(encode_receipt(receipt_data, order_type))
+        return
+
+    # Pool oldinga o‘qigan, hali imzosi qaytmagan cheklar (soni pool oynasi bilan cheklangan)
+    pending = deque()
+
+    def serialized():
+        for order_id, order_type, receipt_data, refund_id in receipts:
+            pending.append((order_id, order_type, receipt_data, refund_id))
+            yield encode_receipt(receipt_data, order_type)
+
+    for signed_data in signer.imap(serialized()):
+        yield pending.popleft() + (signed_data,)
+
+
+def iter_submitted(signed, client, outbox, url, window=8, archive=None):
+    """
+    Cheklarni ReceiptSeq tartibida yuboradi; bir vaqtda ko‘pi bilan window ta so‘rov.
+    Oqim bitta terminal (url) uchun: har so‘rov oldingisi socket’ga to‘liq yozilgandan keyingina
+    yuboriladi (bulk_submit "start" tartibi) – javoblar parallel kutiladi, seq’lar OFD’ga
+    o‘sish tartibida yetadi.
+    Natijalar kirish tartibida qaytadi: (order_id, type, receipt_data, refund_id, status, verdict, body).
+    archive berilsa so‘rov, imzo va javob logs/archive ga qo‘shiladi.
+    """
+    encode = get_encoder().encode
+
+    def send(outbox_id, order_type, receipt_data, signed_data, prev_sent, sent):
+        try:
+            if prev_sent is not None:
+                prev_sent.wait()
+            response = client.post_receipt(signed_data, on_sent=sent.set)
+        finally:
+            sent.set()  # xato bo‘lsa ham keyingi chek to‘xtab qolmaydi
+        verdict, body = outbox.settle(outbox_id, response)
+        if archive is not None:
+            archive.append(order_type, encode(receipt_data), signed_data, response.text,
+                           receipt_data["ReceiptSeq"], *response_fields(body))
+        return response.status_code, verdict, body
+
+    in_flight = deque()
+    prev_sent = None  # oldingi chek so‘rovi yozib bo‘lindi (executor navbati FIFO – u allaqachon ishlayapti)
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        for order_id, order_type, receipt_data, refund_id, signed_data in signed:
+            # refund – javob kelmasa daftar hold’ini fon worker yakunlaydi
+            outbox_id = outbox.put(signed_data, {"type": order_type, "url": url, "order_id": order_id,
+                                                 "ReceiptSeq": receipt_data["ReceiptSeq"], "refund": refund_id})
+            sent = threading.Event()
+            in_flight.append((order_id, order_type, receipt_data, refund_id, outbox_id,
+                              executor.submit(send, outbox_id, order_type, receipt_data, signed_data,
+                                              prev_sent, sent)))
+            prev_sent = sent
+            if len(in_flight) >= window:
+                yield _collect(outbox, in_flight.popleft())
+        while in_flight:
+            yield _collect(outbox, in_flight.popleft())
+
+
+def _collect(outbox, pending):
+    order_id, order_type, receipt_data, refund_id, outbox_id, future = pending
+    try:
+        status, verdict, body = future.result()
+    except Exception as e:
+        # Tarmoq xatosi: chek outbox’da qoladi, fon worker qayta yuboradi va natijani
+        # db/receipts.db ga yozadi (receipt_service yoki outbox.py --drain)
+        outbox.mark_retry(outbox_id, e)
+        status, verdict, body = None, "retry", {"error": str(e)}
+    return order_id, order_type, receipt_data, refund_id, status, verdict, body
+
+
+def run(lines, out, signer, client, url, seq, window=8, dry_run=False, outbox=None, store=None,
+        archive=None, ledger=None):
+    """
+    Butun zanjirni ishga tushiradi; (jami, qabul qilingan) sonini qaytaradi.
+    dry_run – ReceiptSeq ajratilmaydi (hisoblagich va daftar qoldig‘i o‘zgarmaydi), hech narsa yuborilmaydi.
+    """
+    store = store or get_store()
+    ledger = ledger or get_ledger()
+    signed = iter_signed(iter_receipts(iter_orders(lines), None if dry_run else seq, validator=validate,
+                                       store=store, ledger=ledger, dry_run=dry_run), signer)
+    total = accepted = 0
+    if dry_run:
+        for order_id, order_type, receipt_data, _, signed_data in signed:
+            total += 1
+            out.write(json.dumps({"order_id": order_id, "type": order_type,
+                                  "ReceiptSeq": receipt_data["ReceiptSeq"],
+                                  "size": len(signed_data)}, ensure_ascii=False) + "\n")
+        return total, 0
+
+    outbox = outbox or Outbox()
+    archive = archive or get_archive()
+    for order_id, order_type, receipt_data, refund_id, status, verdict, body in iter_submitted(
+            signed, client, outbox, url, window, archive):
+        total += 1
+        if verdict == "done":
+            accepted += 1
+            if body.get("QRCodeURL"):
+                body["QRCodeURL"] = mr.unescape_qr(body["QRCodeURL"])
+        ledger.settle(refund_id, verdict, body if verdict == "done" else None)
+        store.record(order_type, receipt_data, body if verdict != "retry" else None, status, order_id, refund_id)
+        out.write(json.dumps({"order_id": order_id, "type": order_type,
+                              "ReceiptSeq": receipt_data["ReceiptSeq"], "status": status,
+                              "verdict": verdict, "response": body}, ensure_ascii=False) + "\n")
+    return total, accepted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NDJSON orderlar oqimidan cheklar yuborish")
+    parser.add_argument("input", help="NDJSON fayl yoki '-' (stdin)")
+    parser.add_argument("--out", default="logs/stream_results.ndjson", help="'-' – stdout")
+    parser.add_argument("--cert", default=CERT_FILE)
+    parser.add_argument("--key", default=KEY_FILE)
+    parser.add_argument("--url", default=OFD_URL)
+    parser.add_argument("--window", type=int, default=8, help="bir vaqtdagi so‘rovlar soni")
+    parser.add_argument("--seq-block", type=int, default=100)
+    parser.add_argument("--sign-workers", type=int, default=1, help="imzolash jarayonlari soni")
+    parser.add_argument("--dry-run", action="store_true", help="yubormasdan faqat yig‘ish va imzolash")
+    args = parser.parse_args()
+
+    src = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    dst = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    allocator = get_allocator(block_size=args.seq_block)
+    if args.sign_workers > 1:
+        signer = SigningPool(args.cert, args.key, args.sign_workers)
+    else:
+        signer = get_signer(args.cert, args.key)
+    try:
+        n, ok = run(src, dst, signer, get_client(args.url), args.url,
+                    allocator, args.window, args.dry_run)
+    finally:
+        allocator.release()
+        if isinstance(signer, SigningPool):
+            signer.close()
+        if dst is not sys.stdout:
+            dst.close()
+    print(f"Natija: {ok}/{n} chek qabul qilindi ✅", file=sys.stderr)
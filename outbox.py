@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+outbox.py – OFD tasdiqlamagan cheklar uchun diskdagi outbox va fon qayta yuboruvchi
+
+- Imzolangan chek yuborishdan OLDIN logs/outbox.log ga yoziladi (append + fsync).
+- Fayl faqat oxiriga yoziladi: put / lease / retry / done / fail yozuvlari; holat qayta o‘qib tiklanadi.
+- Chek faqat OFD javobida FiscalSign kelganda "done" bo‘ladi.
+- Timeout yoki JSON emas javob – chek outbox’da qoladi, fon worker uni
+  eksponensial backoff + jitter bilan qayta yuboradi.
+- OFD aniq rad etsa (Code != 0, FiscalSign yo‘q) – "fail" deb belgilanadi, qo‘lda ko‘rish uchun.
+- Yangi yozuv "yuborilmoqda" holatida yoziladi (next_at = hozir + IN_FLIGHT_LEASE, ya’ni
+  connect + read timeout): oldingi plandagi post javob kutayotganda worker (yoki boshqa
+  jarayondagi --drain) o‘sha chekni ikkinchi marta yubormaydi. Worker ham yuborishdan oldin
+  lease() bilan yozuvni egallaydi; navbatga qo‘yilgan (queue) yozuv lease=0 bilan yoziladi.
+- Hamma chek yakunlanganda log siqiladi (compact).
+- OFD circuit ochiq bo‘lsa (ofd_client) worker kutadi – yangi cheklar shu yerda navbatda turadi.
+
+Fon worker’ni alohida ishga tushirish:
+    python outbox.py --drain
+    python outbox.py --status
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+from ofd_client import CONNECT_TIMEOUT, READ_TIMEOUT, CircuitOpenError
+from receipt_seq import atomic_write, file_lock
+
+OUTBOX_FILE = "logs/outbox.log"
+COMPACT_AFTER = 4 * 1024 * 1024  # bayt
+
+BASE_DELAY = 2.0
+MAX_DELAY = 300.0
+IN_FLIGHT_LEASE = CONNECT_TIMEOUT + READ_TIMEOUT + 5.0  # soniya – post javobini kutish muddati
+
+
+def backoff_delay(attempt, base=BASE_DELAY, cap=MAX_DELAY):
+    """"Full jitter" eksponensial kechikish: [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def classify_response(status_code, text):
+    """("done" | "fail" | "retry", javob dict yoki None)."""
+    try:
+        body = json.loads(text)
+    except ValueError:
+        return "retry", None
+    if not isinstance(body, dict):
+        return "retry", None
+    if body.get("FiscalSign"):
+        return "done", body
+    if status_code is not None and status_code >= 500:
+        return "retry", body
+    if body.get("Code") not in (0, None):
+        return "fail", body
+    return "retry", body
+
+
+class Outbox:
+    """Append-only outbox fayli va uning xotiradagi holati."""
+
+    def __init__(self, path=OUTBOX_FILE, compact_after=COMPACT_AFTER):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.compact_after = compact_after
+        self._entries = {}      # id -> entry (faqat yakunlanmaganlar)
+        self._offset = 0
+        self._inode = None
+        self._mutex = threading.RLock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    # --- log fayli ---
+
+    def _append(self, record, durable=False):
+        with file_lock(self.lock_path), self._mutex:
+            self.refresh()  # boshqa jarayonlar yozganlarini avval o‘qib olamiz
+            self._write(record, durable)
+
+    def _write(self, record, durable=False):
+        """file_lock va _mutex ostida chaqiriladi."""
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with open(self.path, "ab") as f:
+            f.write(line)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+            self._inode = os.fstat(f.fileno()).st_ino
+            self._offset = f.tell()
+        self._apply(record)
+
+    def _apply(self, record):
+        op = record["op"]
+        entry_id = record["id"]
+        if op == "put":
+            self._entries[entry_id] = {
+                "id": entry_id,
+                "payload": record["payload"],
+                "meta": record.get("meta", {}),
+                "created": record["ts"],
+                "attempts": 0,
+                "next_at": record.get("next_at", 0.0),
+                "error": None,
+            }
+        elif op == "lease":
+            entry = self._entries.get(entry_id)
+            if entry is not None:
+                entry["next_at"] = record["next_at"]
+        elif op == "retry":
+            entry = self._entries.get(entry_id)
+            if entry is not None:
+                entry["attempts"] = record["attempts"]
+                entry["next_at"] = record["next_at"]
+                entry["error"] = record.get("error")
+        elif op in ("done", "fail"):
+            self._entries.pop(entry_id, None)
+
+    def refresh(self):
+        """Boshqa jarayonlar yozgan yangi yozuvlarni o‘qiydi."""
+        with self._mutex:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            if st.st_ino != self._inode or st.st_size < self._offset:
+                # Fayl siqilgan (compact) – boshidan o‘qiymiz
+                self._entries = {}
+                self._offset = 0
+                self._inode = st.st_ino
+            if st.st_size == self._offset:
+                return
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+            end = data.rfind(b"\n") + 1  # yarim yozilgan oxirgi qator keyinroq o‘qiladi
+            for line in data[:end].splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError):
+                    continue
+            self._offset += end
+
+    # --- API ---
+
+    def put(self, signed_data, meta=None, lease=IN_FLIGHT_LEASE):
+        """
+        Imzolangan chekni yuborishdan oldin diskka (fsync bilan) yozadi.
+        lease – chaqiruvchi o‘zi yuborayotgan muddat: shu vaqtgacha worker yozuvga tegmaydi
+        (0 – darhol worker navbatida).
+        """
+        entry_id = uuid.uuid4().hex
+        now = time.time()
+        self._append({
+            "op": "put",
+            "id": entry_id,
+            "ts": now,
+            "next_at": now + lease,
+            "meta": meta or {},
+            "payload": base64.b64encode(signed_data).decode("ascii"),
+        }, durable=True)
+        return entry_id
+
+    def lease(self, entry_id, seconds=IN_FLIGHT_LEASE):
+        """
+        Yozuvni yuborish uchun egallaydi: vaqti kelgan bo‘lsa next_at = hozir + seconds va True;
+        yakunlangan yoki boshqa yuboruvchi egallagan bo‘lsa False.
+        """
+        with file_lock(self.lock_path), self._mutex:
+            self.refresh()
+            entry = self._entries.get(entry_id)
+            now = time.time()
+            if entry is None or entry["next_at"] > now:
+                return False
+            self._write({"op": "lease", "id": entry_id, "ts": now, "next_at": now + seconds})
+            return True
+
+    def release(self, entry_id):
+        """Egallangan yozuvni darhol worker navbatiga qaytaradi (masalan, circuit ochiq – yuborilmadi)."""
+        self._append({"op": "lease", "id": entry_id, "ts": time.time(), "next_at": 0.0})
+
+    def mark_done(self, entry_id, response):
+        self._append({"op": "done", "id": entry_id, "ts": time.time(), "response": response}, durable=True)
+
+    def mark_failed(self, entry_id, response):
+        self._append({"op": "fail", "id": entry_id, "ts": time.time(), "response": response}, durable=True)
+
+    def mark_retry(self, entry_id, error, attempts=None):
+        entry = self._entries.get(entry_id)
+        if attempts is None:
+            attempts = (entry["attempts"] if entry else 0) + 1
+        next_at = time.time() + backoff_delay(attempts)
+        self._append({"op": "retry", "id": entry_id, "ts": time.time(),
+                      "attempts": attempts, "next_at": next_at, "error": str(error)[:500]})
+
+    def settle(self, entry_id, response):
+        """requests.Response bo‘yicha yozuvni yakunlaydi yoki qayta yuborishga qoldiradi."""
+        verdict, body = classify_response(response.status_code, response.text)
+        if verdict == "done":
+            self.mark_done(entry_id, body)
+        elif verdict == "fail":
+            self.mark_failed(entry_id, body)
+        else:
+            self.mark_retry(entry_id, f"HTTP {response.status_code}: {response.text[:200]}")
+        return verdict, body
+
+    def pending(self, due_only=False):
+        self.refresh()
+        now = time.time()
+        entries = sorted(self._entries.values(), key=lambda e: e["created"])
+        if due_only:
+            entries = [e for e in entries if e["next_at"] <= now]
+        return entries
+
+    def backlog(self):
+        """Yakunlanmagan yozuvlar soni (oxirgi refresh holati bo‘yicha, diskni o‘qimaydi)."""
+        return len(self._entries)
+
+    def has(self, entry_id):
+        """Yozuv hali yakunlanmaganmi (outbox’da turibdimi)."""
+        self.refresh()
+        return entry_id in self._entries
+
+    @staticmethod
+    def payload_of(entry):
+        return base64.b64decode(entry["payload"])
+
+    def compact(self):
+        """Yakunlanmagan yozuvlarnigina qoldirib, logni atomik qayta yozadi."""
+        with file_lock(self.lock_path), self._mutex:
+            self.refresh()
+            lines = []
+            for e in sorted(self._entries.values(), key=lambda e: e["created"]):
+                lines.append(json.dumps({"op": "put", "id": e["id"], "ts": e["created"], "next_at": e["next_at"],
+                                         "meta": e["meta"], "payload": e["payload"]}, ensure_ascii=False))
+                if e["attempts"]:
+                    lines.append(json.dumps({"op": "retry", "id": e["id"], "ts": e["created"],
+                                             "attempts": e["attempts"], "next_at": e["next_at"],
+                                             "error": e["error"]}, ensure_ascii=False))
+            atomic_write(self.path, "".join(line + "\n" for line in lines))
+            st = os.stat(self.path)
+            self._inode = st.st_ino
+            self._offset = st.st_size
+
+    def maybe_compact(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size > self.compact_after and not self.pending():
+            self.compact()
+
+
+class OutboxWorker(threading.Thread):
+    """Outbox’ni fon rejimida bo‘shatuvchi thread."""
+
+    def __init__(self, outbox, client_for_url, default_url, poll_interval=1.0, on_result=None):
+        super().__init__(name="ofd-outbox", daemon=True)
+        self.outbox = outbox
+        self.client_for_url = client_for_url
+        self.default_url = default_url
+        self.poll_interval = poll_interval
+        self.on_result = on_result
+        self._stop_event = threading.Event()
+
+    def drain_once(self):
+        """Vaqti kelgan barcha yozuvlarni bir marta yuboradi; yuborilganlar sonini qaytaradi."""
+        sent = 0
+        for entry in self.outbox.pending(due_only=True):
+            if self._stop_event.is_set():
+                break
+            if not self.outbox.lease(entry["id"]):
+                continue  # yakunlangan yoki boshqa jarayon / oldingi plan yubormoqda
+            url = entry["meta"].get("url") or self.default_url
+            try:
+                response = self.client_for_url(url).post_receipt(Outbox.payload_of(entry))
+            except CircuitOpenError:
+                # OFD hali tiklanmagan – urinishlar sarflanmaydi, keyingi aylanishda yana
+                self.outbox.release(entry["id"])
+                break
+            except Exception as e:
+                self.outbox.mark_retry(entry["id"], e)
+                continue
+            verdict, body = self.outbox.settle(entry["id"], response)
+            sent += 1
+            if self.on_result is not None:
+                self.on_result(entry, verdict, body, response)
+        self.outbox.maybe_compact()
+        return sent
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.drain_once()
+            except Exception as e:
+                print("❌ Outbox worker xatosi:", e)
+            self._stop_event.wait(self.poll_interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def _print_result(entry, verdict, body, response=None):
+    seq = entry["meta"].get("ReceiptSeq")
+    if verdict == "done":
+        print(f"✅ ReceiptSeq {seq}: FiscalSign {body.get('FiscalSign')}")
+    elif verdict == "fail":
+        print(f"❌ ReceiptSeq {seq} rad etildi: {body}")
+    else:
+        print(f"⚠️ ReceiptSeq {seq}: keyinroq qayta yuboriladi")
+
+
+if __name__ == "__main__":
+    from ofd_client import OFD_URL, get_client
+
+    parser = argparse.ArgumentParser(description="OFD outbox’ni boshqarish")
+    parser.add_argument("--path", default=OUTBOX_FILE)
+    parser.add_argument("--drain", action="store_true", help="fon worker sifatida ishlash")
+    parser.add_argument("--once", action="store_true", help="bir marta bo‘shatib chiqish")
+    parser.add_argument("--status", action="store_true")
+    args = parser.parse_args()
+
+    box = Outbox(args.path)
+    if args.status or not (args.drain or args.once):
+        for e in box.pending():
+            print(f"{e['id']} seq={e['meta'].get('ReceiptSeq')} urinish={e['attempts']} xato={e['error']}")
+        print(f"Kutilayotgan cheklar: {len(box.pending())}")
+    else:
+        from receipt_engine import on_outbox_result
+
+        def on_result(entry, verdict, body, response):
+            # Servis worker’lari bilan bir xil: arxiv, db/receipts.db, idempotentlik, daftar hold’i, QR
+            # (order_stream / skriptlar qoldirgan cheklar ham)
+            on_outbox_result(entry, verdict, body, response)
+            _print_result(entry, verdict, body, response)
+
+        worker = OutboxWorker(box, get_client, OFD_URL, on_result=on_result)
+        if args.once:
+            worker.drain_once()
+        else:
+            print("Outbox worker ishga tushdi...")
+            try:
+                worker.run()
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+product_catalog.py – Mahsulot katalogi keshi (Barcode/SKU -> Name, SPIC, PackageCode)
+
+- Xotirada hajmi cheklangan LRU kesh; to‘ldirilgan yozuvlar eng kam ishlatilganidan chiqariladi.
+- Bulk preload (preload) va versiyali disk snapshot (db/catalog.json, atomik yoziladi).
+- Keshda yo‘q kod uchun ixtiyoriy loader (masalan, upstream API) chaqiriladi va natija keshlanadi.
+- Normalizatsiya (marketplace_receipt.normalize_columns) itemning bo‘sh SPIC / PackageCode /
+  Name maydonlarini katalogdan to‘ldiradi; itemda bor qiymatlar o‘zgarmaydi.
+- Delivery itemi SPIC / PackageCode’ni DELIVERY_SKU yozuvidan oladi (bo‘lmasa standart qiymat).
+
+Foydalanish:
+    python product_catalog.py --import products.json     # preload + snapshot
+    python product_catalog.py --lookup 1234567890123
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from receipt_seq import atomic_write
+
+CATALOG_FILE = "db/catalog.json"
+CAPACITY = 200000
+
+DELIVERY_SKU = "10112006002000000"
+ENRICH_FIELDS = ("Name", "SPIC", "PackageCode")
+
+
+def _entry(row):
+    return {key: row[key] for key in ("Barcode", "Name", "SPIC", "PackageCode", "Labels") if row.get(key)}
+
+
+class ProductCatalog:
+    """Barcode/SKU bo‘yicha LRU kesh + versiyali snapshot."""
+
+    def __init__(self, path=CATALOG_FILE, capacity=CAPACITY, loader=None):
+        self.path = path
+        self.capacity = capacity
+        self.loader = loader
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.load_snapshot()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _put(self, key, entry):
+        entries = self._entries
+        entries[key] = entry
+        entries.move_to_end(key)
+        if len(entries) > self.capacity:
+            entries.popitem(last=False)
+
+    def get(self, key):
+        """Katalog yozuvi yoki None (keshda bo‘lmasa loader orqali)."""
+        if not key:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        if self.loader is None:
+            return None
+        row = self.loader(key)
+        if not row:
+            return None
+        entry = _entry(row)
+        with self._lock:
+            self._put(key, entry)
+        return entry
+
+    def preload(self, rows, key_field="Barcode"):
+        """Ko‘p yozuvni birdaniga yuklaydi (SKU bo‘lsa key_field="SKU")."""
+        n = 0
+        with self._lock:
+            for row in rows:
+                key = row.get(key_field) or row.get("Barcode")
+                if key:
+                    self._put(key, _entry(row))
+                    n += 1
+        return n
+
+    def enrich(self, item):
+        """Bo‘sh Name/SPIC/PackageCode maydonlarini katalogdan to‘ldiradi (yangi dict yoki o‘zi)."""
+        if item.get("SPIC") and item.get("PackageCode") and item.get("Name"):
+            return item
+        entry = self.get(item.get("SKU") or item.get("Barcode"))
+        if entry is None:
+            return item
+        enriched = dict(item)
+        for field in ENRICH_FIELDS:
+            if not enriched.get(field) and field in entry:
+                enriched[field] = entry[field]
+        return enriched
+
+    def load_snapshot(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            return False
+        with self._lock:
+            self._entries.clear()
+            for key, entry in snap.get("items", {}).items():
+                self._put(key, entry)
+            self.version = snap.get("version", 0)
+        return True
+
+    def save_snapshot(self):
+        """Joriy keshni keyingi versiya sifatida atomik yozadi; versiya raqamini qaytaradi."""
+        with self._lock:
+            self.version += 1
+            snap = {"version": self.version, "created": time.time(), "items": dict(self._entries)}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            atomic_write(self.path, json.dumps(snap, ensure_ascii=False, separators=(",", ":")))
+        return self.version
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(path=CATALOG_FILE):
+    with _catalogs_lock:
+        catalog = _catalogs.get(path)
+        if catalog is None:
+            catalog = _catalogs[path] = ProductCatalog(path)
+        return catalog
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mahsulot katalogi keshi")
+    parser.add_argument("--path", default=CATALOG_FILE)
+    parser.add_argument("--import", dest="import_file", help="JSON ro‘yxat: [{Barcode, Name, SPIC, PackageCode}]")
+    parser.add_argument("--key", default="Barcode", help="kalit maydon (Barcode yoki SKU)")
+    parser.add_argument("--lookup")
+    args = parser.parse_args()
+
+    cat = ProductCatalog(args.path)
+    if args.import_file:
+        with open(args.import_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        rows = data.get("items", []) if isinstance(data, dict) else data
+        count = cat.preload(rows, args.key)
+        print(f"✅ {count} mahsulot yuklandi, snapshot v{cat.save_snapshot()}: {args.path}")
+    if args.lookup:
+        print(json.dumps(cat.get(args.lookup), ensure_ascii=False, indent=4))
+    print(f"Katalogda {len(cat)} mahsulot (v{cat.version})")
@@ -7,21 +7,44 @@ send_refund.py
 
 OFD serveriga qaytarish chekini yuborish:
 - ReceiptSeq avtomatik oshib boradi (logs/last_seq.txt orqali).
-- RefundInfo ichida qaytarilayotgan chek ma'lumotlari ko‘rsatiladi.
+- RefundInfo ichida qaytarilayotgan chek ma'lumotlari ko‘rsatiladi
+  (db/receipts.db dan: argument – FiscalSign / ReceiptSeq / order id, bo‘lmasa oxirgi sotuv).
+- Asl sotuv refund_ledger daftarida bo‘lsa itemlar daftardan: ko‘rsatilgan qatorlar
+  (BARCODE[:QTY] yoki #LINE[:QTY]) yoki butun qoldiq; bo‘lmasa quyidagi namuna itemlar.
+- Idempotent: shu qaytuv allaqachon qabul qilingan bo‘lsa qayta fiskallashtirilmaydi (daftar hold’i
+  va db/idempotency.db), javobsiz qolgan bo‘lsa o‘sha imzolangan chek qayta yuboriladi.
+
+    python qaytarish_cheki.py [FiscalSign | ReceiptSeq | order_id] [BARCODE[:QTY] | #LINE[:QTY] ...]
 """
 
-import subprocess
 import requests
 import json
 import os
+import sys
+import time
 from datetime import datetime
 
+from idempotency import get_idempotency, idempotency_key
+from metrics import StageTimer
+from ofd_client import get_client
+from ofd_signer import SigningError, extract_content, get_signer
+from outbox import Outbox
+from receipt_archive import archive_receipt
+from receipt_codec import encode_receipt
+from receipt_seq import next_receipt_seq
+from receipt_store import record_receipt, resolve_link
+from refund_ledger import LedgerError, RefundDone, get_ledger, parse_returns
+
 # ------------------------------
 # 0. Konfiguratsiya
 # ------------------------------
 CERT_FILE = "certificates/EZ000000000931.crt"
 KEY_FILE = "certificates/amaar.key"
 OFD_URL = "https://test.ofd.uz/emp/v3/receipt"  # test endpoint
+signer = get_signer(CERT_FILE, KEY_FILE)  # kalit bir marta o‘qiladi
+ofd_client = get_client(OFD_URL)  # keep-alive ulanishlar pool’i
+outbox = Outbox()  # tasdiqlanmagan cheklar fon worker orqali qayta yuboriladi
+timer = StageTimer("refund", flush_at_exit=True)  # bosqichlar vaqti -> logs/metrics.prom
 
 # Merchant (marketplace)
 merchant = {
@@ -31,8 +54,8 @@ merchant = {
     "ContractNumber": "264"
 }
 
-# Qaytarilayotgan chek ma'lumotlari (sotuv chekidan olinsin!)
-refund_info = {
+# Qaytarilayotgan chek ma'lumotlari – lokal ombordan (topilmasa quyidagi qiymatlar)
+refund_info = resolve_link(("sale", "marketplace_sale"), sys.argv[1] if len(sys.argv) > 1 else None) or {
     "TerminalID": "EZ000000000931",
     "ReceiptSeq": "121",
     "DateTime": "20250924154010",   # YYYYMMDDhhmmss
@@ -40,7 +63,7 @@ refund_info = {
 }
 
 # ------------------------------
-# 1. Qaytarilayotgan itemlar (sotuv chekidan to‘liq ko‘chirildi)
+# 1. Qaytarilayotgan itemlar (asl sotuv daftarda bo‘lmasa – namuna, sotuv chekidan to‘liq ko‘chirildi)
 # ------------------------------
 items = [
     {
@@ -105,27 +128,27 @@ items = [
     }
 ]
 
-# ------------------------------
-# 2. ReceiptSeq ni avtomatik qilish
-# ------------------------------
-os.makedirs("logs", exist_ok=True)
-seq_file = "logs/last_seq.txt"
-if os.path.exists(seq_file):
-    with open(seq_file, "r") as sf:
-        try:
-            last_seq = int(sf.read().strip())
-        except ValueError:
-            last_seq = 0
-else:
-    last_seq = 0
-
-ReceiptSeq = last_seq + 1
-
-with open(seq_file, "w") as sf:
-    sf.write(str(ReceiptSeq))
+# Asl sotuv daftarda bo‘lsa – faqat qaytarilayotgan qatorlar, qoldiq atomar kamayadi
+ledger = get_ledger()
+returns = parse_returns(sys.argv[2:]) or None
+refund_id = None
+if refund_info.get("FiscalSign") and ledger.has_sale(refund_info["FiscalSign"]):
+    refund_id = f"{refund_info['FiscalSign']}:{time.strftime('%Y%m%d')}:{' '.join(sorted(sys.argv[2:])) or '*'}"
+    try:
+        items, refund_info = ledger.reserve(refund_id, refund_info["FiscalSign"], returns)
+    except RefundDone as e:
+        print("♻️ Bu qaytuv allaqachon fiskallashtirilgan, saqlangan javob:")
+        print(json.dumps(e.response, ensure_ascii=False, indent=4))
+        raise SystemExit(0)
+    except LedgerError as e:
+        print("❌ Qaytuv daftar bo‘yicha mumkin emas:", e)
+        raise SystemExit(1)
+elif returns:
+    print("❌ Asl sotuv daftarda yo‘q – qisman qaytuv mumkin emas")
+    raise SystemExit(1)
 
 # ------------------------------
-# 3. Summalarni hisoblash
+# 2-3. Summalarni hisoblash
 # ------------------------------
 total_price = sum(item["Price"] for item in items)
 total_vat = sum(item["VAT"] for item in items)
@@ -140,7 +163,7 @@ ReceivedCard = total_price
 now_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 receipt_data = {
-    "ReceiptSeq": ReceiptSeq,
+    "ReceiptSeq": None,     # idempotentlik kaliti egallangandan keyin ajratiladi
     "IsRefund": 1,          # qaytarish
     "Items": items,
     "ReceivedCash": ReceivedCash,
@@ -156,49 +179,80 @@ receipt_data = {
     "MerchantInfo": merchant
 }
 
-# ------------------------------
-# 5. JSON faylga yozish
-# ------------------------------
-receipt_json_path = os.path.join("logs", "RefundReceipt.json")
-with open(receipt_json_path, "w", encoding="utf-8") as f:
-    json.dump(receipt_data, f, ensure_ascii=False, indent=4)
-
-print(f"✅ RefundReceipt.json yaratildi: {receipt_json_path}")
+# Qayta ishga tushirish: shu qaytuv oldin yuborilganmi? (kalit egallanmaguncha ReceiptSeq olinmaydi)
+idempotency = get_idempotency()
+idem_key = idempotency_key("refund", refund_id or refund_info.get("FiscalSign"), receipt_data)
+previous = idempotency.get(idem_key)
+if previous is not None and previous["state"] == "done":
+    print("♻️ Bu qaytuv allaqachon fiskallashtirilgan, saqlangan javob:")
+    print(json.dumps(previous["response"], ensure_ascii=False, indent=4))
+    ledger.settle(refund_id, "done", previous["response"])
+    raise SystemExit(0)
+if previous is not None and previous["state"] == "claimed":
+    print("❌ Shu qaytuv hozir boshqa jarayonda yuborilmoqda")
+    raise SystemExit(1)
+if previous is not None:
+    # Javobsiz qolgan urinish: o‘sha ReceiptSeq va o‘sha imzolangan chek qayta yuboriladi
+    print(f"♻️ Oldingi urinish javobsiz qolgan, ReceiptSeq {previous['receipt_seq']} qayta yuboriladi")
+    receipt_data = json.loads(extract_content(previous["signed"]))
+elif idem_key and not idempotency.claim(idem_key, "refund", refund_info.get("FiscalSign")):
+    print("❌ Shu qaytuv hozir boshqa jarayonda yuborilmoqda")
+    raise SystemExit(1)
 
 # ------------------------------
-# 6. JSONni imzolash
+# 5-6. ReceiptSeq, JSON faylga yozish va imzolash
 # ------------------------------
+os.makedirs("logs", exist_ok=True)
 os.makedirs("keys", exist_ok=True)
+receipt_json_path = os.path.join("logs", "RefundReceipt.json")
 signed_path = os.path.join("keys", "RefundReceipt.p7b")
-cmd = [
-    "openssl", "cms", "-sign",
-    "-nodetach", "-binary",
-    "-in", receipt_json_path,
-    "-text",
-    "-outform", "der",
-    "-out", signed_path,
-    "-nocerts",
-    "-signer", CERT_FILE,
-    "-inkey", KEY_FILE
-]
-
-print("Qaytarish chekini imzolash...")
+timer.reset()
 try:
-    subprocess.run(cmd, check=True)
+    if previous is None:
+        receipt_data["ReceiptSeq"] = next_receipt_seq()  # qulf ostida, logs/last_seq.txt bilan mos
+    ReceiptSeq = receipt_data["ReceiptSeq"]
+    timer.lap("seq_alloc")
+
+    receipt_bytes = encode_receipt(receipt_data, "refund")  # ixcham, deterministik UTF-8
+    with open(receipt_json_path, "wb") as f:
+        f.write(receipt_bytes)
+    timer.lap("json_dump")
+    print(f"✅ RefundReceipt.json yaratildi: {receipt_json_path} ({len(receipt_bytes)} bayt)")
+
+    print("Qaytarish chekini imzolash...")
+    signed_data = previous["signed"] if previous is not None else signer.sign(receipt_bytes)
+    with open(signed_path, "wb") as f:
+        f.write(signed_data)
+    timer.lap("sign")
     print(f"✅ Imzolangan qaytarish chek: {signed_path}")
-except subprocess.CalledProcessError as e:
-    print("❌ OpenSSL imzolash xatosi:", e)
-    raise SystemExit(1)
+except BaseException as e:
+    if previous is None:
+        idempotency.release(idem_key)  # kalit bo‘shaydi, qayta ishga tushirish yangidan egallaydi
+        ledger.release(refund_id)
+    if isinstance(e, SigningError):
+        print("❌ OpenSSL imzolash xatosi:", e)
+        raise SystemExit(1)
+    raise
+if previous is None:
+    idempotency.fill(idem_key, ReceiptSeq, signed_data)
 
 # ------------------------------
 # 7. OFD serveriga yuborish
 # ------------------------------
-headers = {"Content-Type": "application/octet-stream"}
 print("Qaytarish chekini yuborish...")
 
 try:
-    with open(signed_path, "rb") as f:
-        response = requests.post(OFD_URL, headers=headers, data=f, timeout=60)
+    outbox_id = outbox.put(signed_data, {"type": "refund", "ReceiptSeq": ReceiptSeq, "url": OFD_URL,
+                                         "idem": idem_key, "refund": refund_id})
+    idempotency.attach_outbox(idem_key, outbox_id)
+    response = ofd_client.post_receipt(signed_data)
+    timer.lap("send")
+    verdict, ofd_body = outbox.settle(outbox_id, response)  # FiscalSign kelmasa chek outbox’da qoladi
+    idempotency.settle(idem_key, verdict, ofd_body)
+    ledger.settle(refund_id, verdict, ofd_body)
+    timer.response(ofd_body.get("Code") if ofd_body else None)
+    record_receipt("refund", receipt_data, ofd_body, response.status_code, refund_id=refund_id)  # db/receipts.db
+    archive_receipt("refund", receipt_data, receipt_bytes, signed_data, response.text, ofd_body)  # logs/archive (tarix)
 
     print("✅ Server javobi:")
     print("Status:", response.status_code)
@@ -235,3 +289,5 @@ except requests.exceptions.RequestException as e:
     with open("logs/refund_error.log", "w", encoding="utf-8") as f:
         f.write(str(e))
     raise SystemExit(1)
+
+timer.lap("persist")
@@ -10,13 +10,37 @@ send_refund_receipt.py – Marketplace Refund Cheki
 - Payment type (card | cash | mix) dinamik, summalar musbat (uint64 uchun).
 - OFD javobidagi QRCodeURL ni unescape qilib saqlash.
 - Oxirgi qaytuv logs/last_refund_info.json ga yoziladi.
+- Idempotent: shu order qaytuvi allaqachon qabul qilingan bo‘lsa qayta yuborilmaydi,
+  javobsiz qolgan bo‘lsa o‘sha imzolangan chek qayta yuboriladi (db/idempotency.db).
+- Chek ReceiptSeq olishdan oldin lokal tekshiriladi (receipt_validator.py): xato bo‘lsa yuborilmaydi.
+- Sotuv refund_ledger daftarida bo‘lsa itemlar daftardan olinadi: faqat ko‘rsatilgan qatorlar
+  (qisman qaytuv) yoki butun qoldiq; qoldiq atomar kamayadi, ortiqcha qaytarib bo‘lmaydi.
+  Daftarda bo‘lmagan eski sotuv – butun order db/order_default.json dan qayta yig‘iladi.
+
+    python qaytuv_cheki2.py                          # butun order (qolgan qismi)
+    python qaytuv_cheki2.py 1234567890123:1 #3       # Barcode bo‘yicha 1 dona + 3-qator to‘liq
 """
 
-import subprocess
-import requests
 import json
 import os
-from datetime import datetime
+import sys
+import time
+
+from idempotency import get_idempotency, idempotency_key
+from marketplace_receipt import (build_receipt, load_order_id, load_order_items, load_taxi_info,
+                                 make_delivery_item, normalize_items_batched)
+from metrics import StageTimer
+from ofd_client import get_client
+from ofd_signer import extract_content, get_signer
+from product_catalog import get_catalog
+from outbox import Outbox
+from receipt_archive import archive_receipt
+from receipt_codec import encode_receipt
+from receipt_seq import current_receipt_seq
+from receipt_store import get_store, link_info, record_receipt
+from receipt_validator import format_issues, validate
+from refund_ledger import LedgerError, RefundDone, get_ledger, parse_returns
+from seller_registry import get_registry
 
 # ------------------------------
 # 0. Konfiguratsiya
@@ -24,16 +48,22 @@ from datetime import datetime
 CERT_FILE = "certificates/EZ000000000931.crt"
 KEY_FILE = "certificates/amaar.key"
 OFD_URL = "https://test.ofd.uz/emp/v3/receipt"
+signer = get_signer(CERT_FILE, KEY_FILE)  # kalit bir marta o‘qiladi
+ofd_client = get_client(OFD_URL)  # keep-alive ulanishlar pool’i
+outbox = Outbox()  # tasdiqlanmagan cheklar fon worker orqali qayta yuboriladi
+timer = StageTimer("refund", flush_at_exit=True)  # bosqichlar vaqti -> logs/metrics.prom
 
 payment_type = "card"  # "card" | "cash" | "mix"
 
-# Sellerlar
+# Sellerlar (tashqi reestr bo‘lmasa ishlatiladi)
+SELLERS_FILE = "db/sellers.json"
 sellers = [
     {"id": "s1", "TIN": "", "PINFL": "30747919403056", "HasVAT": True},
     {"id": "s2", "TIN": "302547891", "PINFL": "", "HasVAT": False},
     {"id": "s3", "TIN": "209876543", "PINFL": "", "HasVAT": True},
 ]
-seller_map = {s["id"]: s for s in sellers}
+seller_map = get_registry(SELLERS_FILE, fallback=sellers)  # db/sellers.json bo‘lsa – o‘sha reestr
+catalog = get_catalog()  # db/catalog.json: Barcode -> SPIC / PackageCode
 
 # Marketplace
 marketplace = {
@@ -51,198 +81,153 @@ merchant = {
     "ContractNumber": "264"
 }
 
-amountKop = 1000
-
 # ------------------------------
 # 1. Order default.json dan olish
 # ------------------------------
-order_file = "db/order_default.json"
-items = []
-
-if os.path.exists(order_file):
-    with open(order_file, "r", encoding="utf-8") as of:
-        try:
-            order_data = json.load(of)
-            raw_items = order_data.get("items", [])
-        except Exception as e:
-            print("❌ Order faylni o‘qishda xatolik:", e)
-            raw_items = []
-else:
-    raw_items = []
-
-# Itemlarni normalizatsiya qilib yig‘ish (musbat qiymatlar, IsRefund=1 bilan)
-for it in raw_items:
-    sid = it.get("seller_id")
-    seller_info = seller_map.get(sid)
-
-    if not seller_info:
-        continue
-
-    has_vat = seller_info.get("HasVAT", True)
-    price = it["Price"]
-    vat_percent = 12 if has_vat else 0
-
-    if has_vat:
-        # Price ichida QQS bor, musbat qiymat
-        vat_sum = round(price * vat_percent / (100 + vat_percent))
-        good_price = price
-    else:
-        # QQS yo‘q, musbat qiymat
-        vat_sum = 0
-        good_price = price
-
-    item = {
-        "Name": it["Name"],
-        "Barcode": it.get("Barcode", ""),
-        "Labels": it.get("Labels", []),
-        "SPIC": it.get("SPIC", ""),
-        "PackageCode": it.get("PackageCode", ""),
-        "OwnerType": 0,
-        "GoodPrice": good_price,
-        "Price": price,
-        "VAT": vat_sum,
-        "VATPercent": vat_percent,
-        "Amount": it["Amount"] * amountKop,
-        "Discount": 0,
-        "Other": 0,
-        "Voucher": 0,
-        "CommissionInfo": {
-            "TIN": seller_info["TIN"],
-            "PINFL": seller_info.get("PINFL", "")
-        }
-    }
-
-    items.append(item)
-
-# ------------------------------
-# 2. Delivery default.json dan olish
-# ------------------------------
-delivery_file = "db/delivery_default.json"
-if os.path.exists(delivery_file):
-    with open(delivery_file, "r", encoding="utf-8") as df:
-        try:
-            taxi_info = json.load(df)
-        except Exception:
-            taxi_info = {"TIN": "", "PINFL": "", "CarNumber": ""}
-else:
-    taxi_info = {"TIN": "", "PINFL": "", "CarNumber": ""}
-
-# 🚚 Xizmat bazaviy narxi (musbat qiymat)
-delivery_total_price = 15000
-
-delivery_item = {
-    "Name": "Maxsulotlarni yetkazib berish xizmati",
-    "Barcode": "10112006002000000",
-    "Labels": [],
-    "SPIC": "10112006002000000",
-    "PackageCode": "1209779",
-    "OwnerType": 0,
-    "GoodPrice": delivery_total_price,
-    "Price": delivery_total_price,
-    "VAT": round(delivery_total_price * 12 / 112),  # QQS ichidan ajratiladi
-    "VATPercent": 12,
-    "Amount": 1 * amountKop,
-    "Discount": 0,
-    "Other": 0,
-    "Voucher": 0,
-    "TaxiInfo": taxi_info
-}
-items.append(delivery_item)
-
-# ------------------------------
-# 3. ReceiptSeq (original bilan bir xil)
-# ------------------------------
-os.makedirs("logs", exist_ok=True)
-seq_file = "logs/last_seq.txt"
-if os.path.exists(seq_file):
+order_id = load_order_id("db/order_default.json")
+returns = parse_returns(sys.argv[1:]) or None  # None – butun order
+ledger = get_ledger()
+sale_fiscal_sign = ledger.find_sale(order_id)
+if not sale_fiscal_sign:
+    # Sotuv boshqa order id bilan daftarda bo‘lishi mumkin: ombordagi asl chek FiscalSign’i bo‘yicha
+    original_sale = get_store().by_order(order_id, ("sale", "marketplace_sale"))
+    if original_sale and ledger.has_sale(original_sale["fiscal_sign"]):
+        sale_fiscal_sign = original_sale["fiscal_sign"]
+refund_id = f"{order_id}:{time.strftime('%Y%m%d')}:{' '.join(sorted(sys.argv[1:])) or '*'}"
+refund_info = None
+timer.lap("order_load")
+
+if sale_fiscal_sign:
+    # Daftardan faqat qaytarilayotgan qatorlar (qoldiq shu yerda ushlab qo‘yiladi)
     try:
-        last_seq = int(open(seq_file).read().strip())
-    except ValueError:
-        last_seq = 0
+        items, refund_info = ledger.reserve(refund_id, sale_fiscal_sign, returns)
+    except RefundDone as e:
+        print("♻️ Bu order qaytuvi allaqachon fiskallashtirilgan, saqlangan javob:")
+        print(json.dumps(e.response, ensure_ascii=False, indent=4))
+        sys.exit(0)
+    except LedgerError as e:
+        print("❌ Qaytuv daftar bo‘yicha mumkin emas:", e)
+        sys.exit(1)
+    total_price = sum(i["Price"] for i in items)
+    total_vat = sum(i["VAT"] for i in items)
+    timer.lap("normalize")
+elif returns:
+    print(f"❌ Order {order_id} sotuvi daftarda yo‘q – qisman qaytuv mumkin emas")
+    sys.exit(1)
 else:
-    last_seq = 0
-ReceiptSeq = last_seq  # Qaytuv uchun original seq ishlatiladi
+    raw_items = load_order_items("db/order_default.json")
+    refund_id = None
+
+    # Itemlarni normalizatsiya qilib yig‘ish (musbat qiymatlar, IsRefund=1 bilan)
+    # (VAT butun sonlarda, TotalVAT va total_price shu o‘tishda hisoblanadi)
+    unknown_sellers = {}
+    items, total_price, total_vat = normalize_items_batched(raw_items, seller_map, unknown_sellers, catalog)
+    seller_map.note_unknown(unknown_sellers)
+
+    # ------------------------------
+    # 2. Delivery default.json dan olish
+    # ------------------------------
+    taxi_info = load_taxi_info("db/delivery_default.json")
+    delivery_item = make_delivery_item(taxi_info, catalog=catalog)
+    items.append(delivery_item)
+    total_price += delivery_item["Price"]
+    total_vat += delivery_item["VAT"]
+    timer.lap("normalize")
 
 # ------------------------------
-# 4. Summalar (musbat qiymatlar)
+# 3. ReceiptSeq
 # ------------------------------
-total_price = sum(i["Price"] for i in items)
-total_vat = sum(i["VAT"] for i in items)
-
-ReceivedCash = 0
-ReceivedCard = 0
-if payment_type == "cash":
-    ReceivedCash = total_price
-elif payment_type == "card":
-    ReceivedCard = total_price
-elif payment_type == "mix":
-    ReceivedCash = total_price // 2
-    ReceivedCard = total_price - ReceivedCash
+os.makedirs("logs", exist_ok=True)
+ReceiptSeq = current_receipt_seq()  # Qaytuv uchun original seq ishlatiladi (qulf ostida o‘qiladi)
+timer.lap("seq_alloc")
 
 # ------------------------------
-# 5. Receipt JSON
+# 4-5. Summalar va Receipt JSON
 # ------------------------------
-now_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-request_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-receipt_data = {
-    "ReceiptSeq": ReceiptSeq,
-    "IsRefund": 1,  # Qaytuv ekanligini belgilash
-    "Items": items,
-    "ReceivedCash": ReceivedCash,
-    "ReceivedCard": ReceivedCard,
-    "TotalVAT": total_vat,
-    "Time": now_time,
-    "ReceiptType": 0,
-    "Location": {"Latitude": 41.2967745, "Longitude": 69.2179078},
-    "ExtraInfo": {
-        "PhoneNumber": "998901234567",
-        "MarketplaceName": marketplace["name"],
-        "MarketplaceAddress": marketplace["address"],
-        "EPNumber": marketplace["ep_number"],
-        "ReceiptNumber": marketplace["receipt_number"],
-        "RequestTime": request_time,
-        "CreatedTime": now_time
-    },
-    "MerchantInfo": merchant
-}
+receipt_data = build_receipt(items, ReceiptSeq, is_refund=1, payment_type=payment_type,
+                             marketplace=marketplace, merchant=merchant,
+                             totals=(total_price, total_vat))
+# Shu order bo‘yicha qabul qilingan sotuv cheki lokal omborda bo‘lsa – RefundInfo
+original_sale = None if refund_info else get_store().by_order(order_id, ("sale", "marketplace_sale"))
+if original_sale:
+    refund_info = link_info(original_sale)
+if refund_info:
+    receipt_data["RefundInfo"] = refund_info
+
+# Lokal tekshiruv: OFD rad etadigan chek uchun ReceiptSeq olinmaydi va imzolanmaydi
+issues = validate(receipt_data)
+if issues:
+    ledger.release(refund_id)  # ushlab qo‘yilgan qoldiq qaytadi
+    print("❌ Chek tekshiruvdan o‘tmadi:", format_issues(issues, limit=len(issues)))
+    sys.exit(1)
+
+# Qayta ishga tushirish: shu order qaytuvi oldin yuborilganmi?
+idempotency = get_idempotency()
+idem_key = idempotency_key("refund", refund_id or order_id, receipt_data)
+previous = idempotency.get(idem_key)
+if previous is not None and previous["state"] == "done":
+    print("♻️ Bu order qaytuvi allaqachon fiskallashtirilgan, saqlangan javob:")
+    print(json.dumps(previous["response"], ensure_ascii=False, indent=4))
+    ledger.settle(refund_id, "done", previous["response"])
+    sys.exit(0)
+if previous is not None and previous["state"] == "claimed":
+    print("❌ Shu order qaytuvi hozir boshqa jarayonda yuborilmoqda")
+    sys.exit(1)
+if previous is not None:
+    print(f"♻️ Oldingi urinish javobsiz qolgan, ReceiptSeq {previous['receipt_seq']} qayta yuboriladi")
+    receipt_data = json.loads(extract_content(previous["signed"]))
+    ReceiptSeq = receipt_data["ReceiptSeq"]
+elif idem_key and not idempotency.claim(idem_key, "refund", order_id):
+    print("❌ Shu order qaytuvi hozir boshqa jarayonda yuborilmoqda")
+    sys.exit(1)
 
-# ------------------------------
-# 6. JSON yozish
-# ------------------------------
 receipt_json_path = "logs/RefundReceiptInfo.json"
-with open(receipt_json_path, "w", encoding="utf-8") as f:
-    json.dump(receipt_data, f, ensure_ascii=False, indent=4)
-print(f"✅ RefundReceiptInfo.json yaratildi: {receipt_json_path}")
-
-# ------------------------------
-# 7. Imzolash
-# ------------------------------
 signed_path = "keys/RefundReceiptInfo.p7b"
 os.makedirs("keys", exist_ok=True)
-cmd = [
-    "openssl", "cms", "-sign",
-    "-nodetach", "-binary",
-    "-in", receipt_json_path,
-    "-text",
-    "-outform", "der",
-    "-out", signed_path,
-    "-nocerts",
-    "-signer", CERT_FILE,
-    "-inkey", KEY_FILE
-]
-print("Qaytuv chekini imzolash...")
-subprocess.run(cmd, check=True)
+try:
+    # ------------------------------
+    # 6. JSON yozish
+    # ------------------------------
+    receipt_bytes = encode_receipt(receipt_data, "refund")  # ixcham, deterministik UTF-8
+    with open(receipt_json_path, "wb") as f:
+        f.write(receipt_bytes)
+    timer.lap("json_dump")
+    print(f"✅ RefundReceiptInfo.json yaratildi: {receipt_json_path} ({len(receipt_bytes)} bayt)")
+
+    # ------------------------------
+    # 7. Imzolash
+    # ------------------------------
+    print("Qaytuv chekini imzolash...")
+    signed_data = previous["signed"] if previous is not None else signer.sign(receipt_bytes)
+    with open(signed_path, "wb") as f:
+        f.write(signed_data)
+    timer.lap("sign")
+except BaseException:
+    if previous is None:
+        idempotency.release(idem_key)  # kalit bo‘shaydi, qayta ishga tushirish yangidan egallaydi
+        ledger.release(refund_id)
+    raise
+if previous is None:
+    idempotency.fill(idem_key, ReceiptSeq, signed_data)
 print(f"✅ Imzolangan fayl yaratildi: {signed_path}")
 
 # ------------------------------
 # 8. OFDga yuborish
 # ------------------------------
-headers = {"Content-Type": "application/octet-stream"}
 print("Qaytuv chekini yuborish...")
 
-with open(signed_path, "rb") as f:
-    response = requests.post(OFD_URL, headers=headers, data=f, timeout=60)
+outbox_id = outbox.put(signed_data, {"type": "refund", "ReceiptSeq": ReceiptSeq, "url": OFD_URL, "idem": idem_key,
+                                     "refund": refund_id})
+idempotency.attach_outbox(idem_key, outbox_id)
+response = ofd_client.post_receipt(signed_data)
+timer.lap("send")
+verdict, ofd_body = outbox.settle(outbox_id, response)  # FiscalSign kelmasa chek outbox’da qoladi
+idempotency.settle(idem_key, verdict, ofd_body)
+ledger.settle(refund_id, verdict, ofd_body)  # fail – qoldiq qaytadi, retry – ushlab turiladi
+timer.response(ofd_body.get("Code") if ofd_body else None)
+record_receipt("refund", receipt_data, ofd_body, response.status_code, order_id=order_id,
+               refund_id=refund_id)  # db/receipts.db
+archive_receipt("refund", receipt_data, receipt_bytes, signed_data, response.text, ofd_body)  # logs/archive (tarix)
 
 print("✅ Server javobi:")
 print("Status:", response.status_code)
@@ -265,6 +250,7 @@ try:
 except Exception:
     open("logs/refund_response_raw.txt", "w", encoding="utf-8").write(response.text)
 
+timer.lap("persist")
 print("Natija logs papkasiga saqlandi ✅")
 
 # print("\n📌 Soliq serveriga ketayotgan qaytuv JSON:")
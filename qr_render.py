@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+qr_render.py – OFD QRCodeURL’dan QR rasmlar (SVG / PNG) va FiscalSign bo‘yicha kesh
+
+- Rasm bir marta, chek qabul qilingandan keyin yaratiladi va logs/qr/<NN>/<FiscalSign>.<fmt>
+  ga yoziladi (atomik). Chek sahifasi tayyor faylni beradi – har ko‘rishda chizilmaydi.
+- FiscalSign chekni bir ma’noda aniqlaydi, QR matni undan kelib chiqadi: kesh kaliti –
+  FiscalSign, fayl hech qachon o‘zgarmaydi (immutable).
+- Ko‘p chek bir vaqtda: QrRenderer jarayonlar hovuzida (ProcessPoolExecutor) bo‘laklab chizadi;
+  keshda borlari o‘tkazib yuboriladi.
+- Backend: segno (tavsiya etiladi, PNG+SVG tashqi kutubxonasiz) yoki qrcode
+  (PNG uchun Pillow). Ikkalasi ham bo‘lmasa QrError – chek yuborishga ta’sir qilmaydi.
+
+Foydalanish:
+    python qr_render.py --from-db --date-from 20251001000000 --date-to 20251031235959
+    python qr_render.py --fiscal 749052382347 --url "https://ofd.soliq.uz/check?t=...&s=749052382347"
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import marketplace_receipt as mr
+
+QR_DIR = "logs/qr"
+FORMATS = ("svg", "png")
+SCALE = 4          # PNG: bitta modul necha piksel
+BORDER = 4         # "quiet zone" – modullarda
+ERROR_LEVEL = "M"
+CHUNK_SIZE = 32
+
+CONTENT_TYPES = {"svg": "image/svg+xml", "png": "image/png"}
+
+try:
+    import segno
+except ImportError:  # ixtiyoriy bog‘liqlik
+    segno = None
+
+try:
+    import qrcode
+    import qrcode.image.svg
+except ImportError:  # ixtiyoriy bog‘liqlik
+    qrcode = None
+
+
+class QrError(Exception):
+    """QR rasmni yaratib bo‘lmadi (backend yo‘q yoki noto‘g‘ri ma’lumot)."""
+
+
+def backend():
+    """Mavjud backend nomi yoki None."""
+    if segno is not None:
+        return "segno"
+    if qrcode is not None:
+        return "qrcode"
+    return None
+
+
+def render(url, fmt="svg", scale=SCALE, border=BORDER):
+    """QR rasm baytlari."""
+    if fmt not in CONTENT_TYPES:
+        raise QrError(f"Noma’lum format: {fmt}")
+    if segno is not None:
+        out = BytesIO()
+        segno.make(url, error=ERROR_LEVEL.lower(), micro=False).save(out, kind=fmt, scale=scale, border=border)
+        return out.getvalue()
+    if qrcode is not None:
+        qr = qrcode.QRCode(error_correction=getattr(qrcode.constants, f"ERROR_CORRECT_{ERROR_LEVEL}"),
+                           box_size=scale, border=border)
+        qr.add_data(url)
+        qr.make(fit=True)
+        factory = qrcode.image.svg.SvgPathImage if fmt == "svg" else None
+        try:
+            image = qr.make_image(image_factory=factory)
+        except ImportError as e:
+            raise QrError(f"qrcode PNG uchun Pillow kerak: {e}") from e
+        out = BytesIO()
+        image.save(out)
+        return out.getvalue()
+    raise QrError("QR backend yo‘q: pip install segno (yoki qrcode[pil])")
+
+
+def _write_bytes(path, data):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class QrCache:
+    """FiscalSign -> rasm fayli (logs/qr/<oxirgi 2 raqam>/<FiscalSign>.<fmt>)."""
+
+    def __init__(self, directory=QR_DIR):
+        self.directory = directory
+
+    def path(self, fiscal_sign, fmt):
+        fiscal_sign = str(fiscal_sign)
+        if not fiscal_sign.isalnum():
+            raise QrError(f"FiscalSign noto‘g‘ri: {fiscal_sign!r}")
+        return os.path.join(self.directory, fiscal_sign[-2:], f"{fiscal_sign}.{fmt}")
+
+    def get(self, fiscal_sign, fmt):
+        try:
+            with open(self.path(fiscal_sign, fmt), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def has(self, fiscal_sign, formats=FORMATS):
+        return all(os.path.exists(self.path(fiscal_sign, fmt)) for fmt in formats)
+
+    def put(self, fiscal_sign, fmt, data):
+        path = self.path(fiscal_sign, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_bytes(path, data)
+        return path
+
+    def ensure(self, fiscal_sign, url, formats=FORMATS):
+        """Keshda yo‘q formatlarni chizib yozadi; yangi yozilganlar sonini qaytaradi."""
+        n = 0
+        for fmt in formats:
+            if not os.path.exists(self.path(fiscal_sign, fmt)):
+                self.put(fiscal_sign, fmt, render(url, fmt))
+                n += 1
+        return n
+
+
+def _render_chunk(directory, formats, chunk):
+    """Worker: [(FiscalSign, url)] -> [(FiscalSign, yangi fayllar soni yoki xato matni)]."""
+    cache = QrCache(directory)
+    results = []
+    for fiscal_sign, url in chunk:
+        try:
+            results.append((fiscal_sign, cache.ensure(fiscal_sign, url, formats)))
+        except (QrError, OSError, ValueError) as e:
+            results.append((fiscal_sign, str(e)))
+    return results
+
+
+class QrRenderer:
+    """
+    QR rasmlarni jarayonlar hovuzida chizadi va keshga yozadi.
+    workers=1 bo‘lsa jarayon ochilmaydi – joriy jarayonda chiziladi.
+    """
+
+    def __init__(self, directory=QR_DIR, formats=FORMATS, workers=None, chunk_size=CHUNK_SIZE):
+        self.cache = QrCache(directory)
+        self.formats = tuple(formats)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = max(1, chunk_size)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None and self.workers > 1:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def render_many(self, items):
+        """
+        (FiscalSign, url) oqimi -> (FiscalSign, natija) generatori; keshdagilar o‘tkazib yuboriladi.
+        Bir vaqtda ko‘pi bilan 2 * workers bo‘lak ishlovda.
+        """
+        directory = self.cache.directory
+        pool = self._pool()
+        in_flight = deque()
+        chunk = []
+        for fiscal_sign, url in items:
+            if not fiscal_sign or not url or self.cache.has(fiscal_sign, self.formats):
+                continue
+            chunk.append((str(fiscal_sign), mr.unescape_qr(url)))
+            if len(chunk) < self.chunk_size:
+                continue
+            if pool is None:
+                yield from _render_chunk(directory, self.formats, chunk)
+            else:
+                in_flight.append(pool.submit(_render_chunk, directory, self.formats, chunk))
+                if len(in_flight) >= 2 * self.workers:
+                    yield from in_flight.popleft().result()
+            chunk = []
+        if chunk:
+            if pool is None:
+                yield from _render_chunk(directory, self.formats, chunk)
+            else:
+                in_flight.append(pool.submit(_render_chunk, directory, self.formats, chunk))
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+    def submit(self, fiscal_sign, url):
+        """Bitta chekni fonda chizishga beradi (chek yuborishni kutdirmaydi)."""
+        if backend() is None or not fiscal_sign or not url:
+            return None
+        if self.cache.has(fiscal_sign, self.formats):
+            return None
+        pool = self._pool()
+        item = [(str(fiscal_sign), mr.unescape_qr(url))]
+        if pool is None:
+            thread = threading.Thread(target=_render_chunk, args=(self.cache.directory, self.formats, item),
+                                      daemon=True)
+            thread.start()
+            return thread
+        return pool.submit(_render_chunk, self.cache.directory, self.formats, item)
+
+    def image(self, fiscal_sign, fmt, url=None):
+        """Keshdagi rasm; yo‘q bo‘lsa va url berilsa shu jarayonda chizib keshlaydi."""
+        data = self.cache.get(fiscal_sign, fmt)
+        if data is None and url:
+            data = render(mr.unescape_qr(url), fmt)
+            self.cache.put(fiscal_sign, fmt, data)
+        return data
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def qr_url_of(row):
+    """receipt_store qatoridan QRCodeURL (unescape qilingan) yoki None."""
+    try:
+        body = json.loads(row.get("response") or "null")
+    except ValueError:
+        return None
+    if isinstance(body, dict) and body.get("QRCodeURL"):
+        return mr.unescape_qr(body["QRCodeURL"])
+    return None
+
+
+_renderers = {}
+_renderers_lock = threading.Lock()
+
+
+def get_renderer(directory=QR_DIR):
+    with _renderers_lock:
+        renderer = _renderers.get(directory)
+        if renderer is None:
+            renderer = _renderers[directory] = QrRenderer(directory)
+        return renderer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="QR rasmlar (SVG / PNG) keshi")
+    parser.add_argument("--dir", default=QR_DIR)
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--from-db", action="store_true", help="db/receipts.db dagi cheklar uchun")
+    parser.add_argument("--date-from", default="00000000000000")
+    parser.add_argument("--date-to", default="99999999999999")
+    parser.add_argument("--fiscal")
+    parser.add_argument("--url")
+    args = parser.parse_args()
+
+    if backend() is None:
+        print("❌ QR backend yo‘q: pip install segno (yoki qrcode[pil])", file=sys.stderr)
+        raise SystemExit(1)
+    renderer = QrRenderer(args.dir, args.formats.split(","), args.workers)
+    if args.from_db:
+        from receipt_store import get_store
+
+        rows = get_store().by_date(args.date_from, args.date_to)
+        items = ((row["fiscal_sign"], qr_url_of(row)) for row in rows)
+    elif args.fiscal and args.url:
+        items = [(args.fiscal, args.url)]
+    else:
+        parser.error("--from-db yoki --fiscal va --url kerak")
+    done = failed = 0
+    try:
+        for fiscal_sign, result in renderer.render_many(items):
+            if isinstance(result, int):
+                done += 1
+            else:
+                failed += 1
+                print(f"❌ {fiscal_sign}: {result}", file=sys.stderr)
+    finally:
+        renderer.close()
+    print(f"✅ {done} chek uchun QR yaratildi, {failed} xato ({backend()}): {args.dir}")
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+receipt_archive.py – Chek artefaktlari uchun segmentli, faqat oxiriga yoziladigan arxiv
+
+- Har bir chek uchun: so‘rov JSON (imzolanadigan baytlar), imzolangan DER va OFD javobi
+  bitta yozuv sifatida logs/archive/seg-NNNNNN.rca segmentiga qo‘shiladi – hech narsa
+  ustidan yozilmaydi, tarix saqlanadi (audit).
+- Har bir yozuv alohida zlib bilan siqiladi: bitta chekni olish uchun segmentni to‘liq
+  ochish shart emas – indeksdagi offset bo‘yicha seek + bitta yozuvni ochish.
+- Indeks: har segment yonida seg-NNNNNN.idx (JSON qatorlar: seq, TerminalID, FiscalSign,
+  offset, length); xotirada (TerminalID, ReceiptSeq) va FiscalSign bo‘yicha dict. Indeks
+  birinchi qidiruvda o‘qiladi – faqat yozadigan jarayon (skriptlar) tarixni o‘qimaydi.
+- Yozuvlar guruhlab yoziladi (group commit): GROUP_SIZE ta yozuv yoki GROUP_INTERVAL
+  soniyada bir marta – segment va indeks uchun bitta fsync.
+- Segment SEGMENT_SIZE dan oshsa keyingisi ochiladi. Bir nechta jarayon qulf bilan yozadi.
+
+Yozuv formati: MAGIC | crc32 | uzunlik | zlib(">III" uzunliklar + so‘rov + DER + javob)
+
+Foydalanish:
+    python receipt_archive.py --get 2001              # ReceiptSeq bo‘yicha (--terminal bilan aniq)
+    python receipt_archive.py --fiscal 356484148549 --export /tmp/chek
+    python receipt_archive.py --stats
+    python receipt_archive.py --check                 # yozib-o‘qish va tezlik
+"""
+
+import argparse
+import atexit
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+from ofd_signer import extract_content
+from outbox import Outbox
+from receipt_seq import file_lock
+
+ARCHIVE_DIR = "logs/archive"
+SEGMENT_SIZE = 64 * 1024 * 1024  # bayt
+GROUP_SIZE = 64                  # shuncha yozuv yig‘ilsa darhol yoziladi
+GROUP_INTERVAL = 0.2             # soniya – yozuv diskka tushguncha eng ko‘p kutish
+
+MAGIC = b"RCA1"
+HEADER = struct.Struct(">4sII")  # magic, crc32, siqilgan uzunlik
+LENGTHS = struct.Struct(">III")  # so‘rov, DER, javob
+COMPRESS_LEVEL = 6
+
+
+class ArchiveError(Exception):
+    """Arxiv yozuvi buzilgan yoki topilmadi."""
+
+
+def pack_record(request, signed, response):
+    body = LENGTHS.pack(len(request), len(signed), len(response)) + request + signed + response
+    data = zlib.compress(body, COMPRESS_LEVEL)
+    return HEADER.pack(MAGIC, zlib.crc32(data), len(data)) + data
+
+
+def unpack_record(frame):
+    """Freym -> (so‘rov baytlari, DER, javob baytlari)."""
+    magic, crc, length = HEADER.unpack_from(frame)
+    data = frame[HEADER.size:HEADER.size + length]
+    if magic != MAGIC or len(data) != length or zlib.crc32(data) != crc:
+        raise ArchiveError("arxiv yozuvi buzilgan")
+    body = zlib.decompress(data)
+    n_req, n_sig, n_resp = LENGTHS.unpack_from(body)
+    pos = LENGTHS.size
+    request = body[pos:pos + n_req]
+    signed = body[pos + n_req:pos + n_req + n_sig]
+    response = body[pos + n_req + n_sig:pos + n_req + n_sig + n_resp]
+    return request, signed, response
+
+
+def _as_bytes(value):
+    if value is None:
+        return b""
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return bytes(value)
+
+
+class ReceiptArchive:
+    """Segmentli arxiv: append() guruhlab yozadi, get() indeks bo‘yicha bitta yozuvni o‘qiydi."""
+
+    def __init__(self, directory=ARCHIVE_DIR, segment_size=SEGMENT_SIZE,
+                 group_size=GROUP_SIZE, group_interval=GROUP_INTERVAL):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.lock_path = os.path.join(directory, "archive.lock")
+        self.by_seq = {}             # (TerminalID, ReceiptSeq) -> indeks yozuvi
+        self.by_fiscal = {}
+        self._seq_terminal = {}      # ReceiptSeq -> oxirgi yozilgan TerminalID (terminal berilmasa)
+        self._loaded = False         # indeks birinchi qidiruvgacha o‘qilmaydi
+        self._idx_offsets = {}       # idx fayl -> o‘qilgan baytlar
+        self._pending = []           # (meta, freym) – hali diskka tushmagan
+        self._first_pending = 0.0
+        self._mutex = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._mutex)
+        self._flusher = None
+        self._closed = False
+        os.makedirs(directory, exist_ok=True)
+
+    # --- indeks ---
+
+    def _segments(self):
+        return sorted(name[:-4] for name in os.listdir(self.directory)
+                      if name.startswith("seg-") and name.endswith(".rca"))
+
+    def _path(self, segment, ext):
+        return os.path.join(self.directory, f"{segment}.{ext}")
+
+    def _index(self, entry):
+        seq, tid = str(entry["seq"]), entry.get("tid") or ""
+        self.by_seq[(tid, seq)] = entry
+        self._seq_terminal[seq] = tid
+        if entry.get("fs"):
+            self.by_fiscal[entry["fs"]] = entry
+
+    def refresh(self):
+        """Boshqa jarayonlar yozgan indeks qatorlarini o‘qiydi."""
+        with self._index_lock:
+            self._refresh_index()
+            self._loaded = True
+
+    def _refresh_index(self):
+        for segment in self._segments():
+            idx_path = self._path(segment, "idx")
+            offset = self._idx_offsets.get(idx_path, 0)
+            try:
+                if os.path.getsize(idx_path) == offset:
+                    continue
+                with open(idx_path, "rb") as f:
+                    f.seek(offset)
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            end = data.rfind(b"\n") + 1  # yarim yozilgan oxirgi qator keyinroq o‘qiladi
+            for line in data[:end].splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entry["seg"] = segment
+                self._index(entry)
+            self._idx_offsets[idx_path] = offset + end
+
+    # --- yozish ---
+
+    def append(self, kind, request, signed, response, seq, fiscal_sign=None, terminal_id=None):
+        """
+        Yozuvni navbatga qo‘yadi; GROUP_SIZE ga yetsa darhol, aks holda GROUP_INTERVAL ichida
+        fon oqimi bitta fsync bilan yozadi. Siqish chaqiruvchi oqimida, qulfsiz bajariladi.
+        """
+        frame = pack_record(_as_bytes(request), _as_bytes(signed), _as_bytes(response))
+        meta = {"seq": str(seq), "tid": terminal_id or "", "fs": fiscal_sign or "",
+                "kind": kind, "t": round(time.time(), 3)}
+        with self._mutex:
+            if self._closed:
+                raise ArchiveError("arxiv yopilgan")
+            if not self._pending:
+                self._first_pending = time.monotonic()
+            self._pending.append((meta, frame))
+            if len(self._pending) >= self.group_size:
+                self._flush_locked()
+            else:
+                self._ensure_flusher()
+                self._wakeup.notify()
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="receipt-archive", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        with self._mutex:
+            while not self._closed:
+                if not self._pending:
+                    self._wakeup.wait()
+                    continue
+                wait = self._first_pending + self.group_interval - time.monotonic()
+                if wait > 0:
+                    self._wakeup.wait(wait)
+                    continue
+                self._flush_locked()
+
+    def flush(self):
+        with self._mutex:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        with file_lock(self.lock_path):
+            segments = self._segments()
+            segment = segments[-1] if segments else "seg-000001"
+            seg_path = self._path(segment, "rca")
+            if segments and os.path.getsize(seg_path) >= self.segment_size:
+                segment = f"seg-{int(segment[4:]) + 1:06d}"
+                seg_path = self._path(segment, "rca")
+
+            lines = []
+            with open(seg_path, "ab") as f:
+                offset = f.seek(0, os.SEEK_END)
+                for meta, frame in batch:
+                    f.write(frame)
+                    meta["off"], meta["len"] = offset, len(frame)
+                    offset += len(frame)
+                    lines.append(json.dumps(meta, ensure_ascii=False, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            # Indeks segmentdan keyin: qulash bo‘lsa indeksda yo‘q yozuv qoladi, aksincha emas
+            with open(self._path(segment, "idx"), "ab") as f:
+                f.write("".join(lines).encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+        if self._loaded:
+            self.refresh()
+
+    # --- o‘qish ---
+
+    def _pending_entry(self, seq=None, fiscal_sign=None, terminal_id=None):
+        with self._mutex:
+            for meta, frame in reversed(self._pending):
+                if (seq is not None and meta["seq"] == str(seq)
+                        and (terminal_id is None or meta["tid"] == terminal_id)) or \
+                        (fiscal_sign and meta["fs"] == fiscal_sign):
+                    return meta, frame
+        return None
+
+    def _by_seq(self, seq, terminal_id=None):
+        seq = str(seq)
+        if terminal_id is None:
+            terminal_id = self._seq_terminal.get(seq)
+        return self.by_seq.get((terminal_id, seq))
+
+    def lookup(self, seq=None, fiscal_sign=None, terminal_id=None):
+        """
+        Indeks yozuvi (seg, off, len, ...) yoki None. ReceiptSeq terminallar orasida takrorlanadi:
+        terminal_id berilmasa shu seq bilan oxirgi yozilgan yozuv.
+        """
+        if not self._loaded:
+            self.refresh()
+        for _ in range(2):
+            entry = self.by_fiscal.get(fiscal_sign) if fiscal_sign else self._by_seq(seq, terminal_id)
+            if entry is not None:
+                return entry
+            self.refresh()
+        return None
+
+    def get(self, seq=None, fiscal_sign=None, terminal_id=None):
+        """{"kind", "seq", "TerminalID", "FiscalSign", "request", "signed", "response"} yoki None."""
+        pending = self._pending_entry(seq, fiscal_sign, terminal_id)
+        if pending is not None:
+            meta, frame = pending
+        else:
+            meta = self.lookup(seq, fiscal_sign, terminal_id)
+            if meta is None:
+                return None
+            with open(self._path(meta["seg"], "rca"), "rb") as f:
+                f.seek(meta["off"])
+                frame = f.read(meta["len"])
+        request, signed, response = unpack_record(frame)
+        return {"kind": meta["kind"], "seq": meta["seq"], "TerminalID": meta["tid"],
+                "FiscalSign": meta["fs"], "request": request, "signed": signed, "response": response}
+
+    def stats(self):
+        self.refresh()
+        segments = self._segments()
+        size = sum(os.path.getsize(self._path(s, "rca")) for s in segments)
+        return {"segments": len(segments), "records": len(self.by_seq), "bytes": size}
+
+    def close(self):
+        with self._mutex:
+            self._flush_locked()
+            self._closed = True
+            self._wakeup.notify_all()
+        if self._flusher is not None:
+            self._flusher.join(timeout=1.0)
+
+
+def response_fields(body):
+    """OFD javob dict’idan (FiscalSign, TerminalID)."""
+    if not isinstance(body, dict):
+        return None, None
+    return body.get("FiscalSign"), body.get("TerminalID")
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def get_archive(directory=ARCHIVE_DIR):
+    """Keshlangan arxiv; jarayon tugaganda navbatdagi yozuvlar diskka tushiriladi."""
+    with _archives_lock:
+        archive = _archives.get(directory)
+        if archive is None:
+            archive = _archives[directory] = ReceiptArchive(directory)
+            atexit.register(archive.close)
+        return archive
+
+
+def archive_outbox(entry, response, body=None, archive=None):
+    """Fon worker yuborgan outbox yozuvi: so‘rov baytlari imzolangan payload’dan olinadi."""
+    signed_data = Outbox.payload_of(entry)
+    fiscal_sign, terminal_id = response_fields(body)
+    meta = entry["meta"]
+    (archive or get_archive()).append(meta.get("type") or "sale", extract_content(signed_data), signed_data,
+                                      response.text, meta.get("ReceiptSeq"), fiscal_sign,
+                                      terminal_id or meta.get("terminal"))
+
+
+def archive_receipt(kind, receipt_data, receipt_bytes, signed_data, response_text, body=None):
+    """Skriptlar uchun qisqa yo‘l: bitta chekni standart arxivga qo‘shadi."""
+    fiscal_sign, terminal_id = response_fields(body)
+    get_archive().append(kind, receipt_bytes, signed_data, response_text,
+                         receipt_data["ReceiptSeq"], fiscal_sign, terminal_id)
+
+
+def _check(n=2000):
+    """Vaqtinchalik katalogda yozib, tasodifiy yozuvlarni qayta o‘qish va tezlik."""
+    import random
+    import shutil
+    import tempfile
+
+    tmp = tempfile.mkdtemp(prefix="rca-")
+    try:
+        rng = random.Random(17)
+        records = []
+        for seq in range(1, n + 1):
+            request = json.dumps({"ReceiptSeq": seq, "Items": [{"Name": f"Mahsulot {i}", "Price": rng.randrange(10 ** 6)}
+                                                               for i in range(rng.randrange(1, 20))]}).encode()
+            records.append((seq, request, os.urandom(1500), json.dumps({"FiscalSign": f"{seq:012d}"}).encode()))
+
+        archive = ReceiptArchive(tmp, segment_size=1024 * 1024)
+        started = time.perf_counter()
+        for seq, request, signed, response in records:
+            archive.append("sale", request, signed, response, seq, f"{seq:012d}", "EZ000000000931")
+        archive.close()
+        elapsed = time.perf_counter() - started
+
+        reader = ReceiptArchive(tmp)
+        if reader.by_seq:
+            return False  # indeks birinchi qidiruvgacha o‘qilmaydi
+        for seq, request, signed, response in rng.sample(records, 200):
+            rec = reader.get(seq) if seq % 2 else reader.get(fiscal_sign=f"{seq:012d}")
+            if rec is None or (rec["request"], rec["signed"], rec["response"]) != (request, signed, response):
+                return False
+        # Boshqa terminaldagi xuddi shu ReceiptSeq birinchisini yopmaydi
+        other = ReceiptArchive(tmp)
+        other.append("sale", b"{}", b"", b"{}", 1, "", "EZ000000000932")
+        other.close()
+        if reader.get(1, terminal_id="EZ000000000931")["request"] != records[0][1] or \
+                reader.get(1, terminal_id="EZ000000000932")["request"] != b"{}":
+            return False
+        raw = sum(len(r[1]) + len(r[2]) + len(r[3]) for r in records)
+        st = reader.stats()
+        print(f"{n} yozuv: {n / elapsed:.0f} yozuv/s, {st['segments']} segment, "
+              f"{st['bytes'] / 1024:.0f} KiB (xom {raw / 1024:.0f} KiB), fsync ~{n // GROUP_SIZE + 1} marta")
+        return st["records"] == n + 1
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chek artefaktlari arxivi")
+    parser.add_argument("--dir", default=ARCHIVE_DIR)
+    parser.add_argument("--get", help="ReceiptSeq")
+    parser.add_argument("--terminal", help="TerminalID (--get bilan)")
+    parser.add_argument("--fiscal", help="FiscalSign")
+    parser.add_argument("--export", help="katalog: request.json, signed.p7b, response.json yoziladi")
+    parser.add_argument("--stats", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    if args.check:
+        if _check():
+            print("✅ Arxiv yozuvlari to‘g‘ri o‘qildi")
+        else:
+            print("❌ Arxivdan o‘qilgan yozuv mos emas")
+            raise SystemExit(1)
+    elif args.get or args.fiscal:
+        rec = ReceiptArchive(args.dir).get(args.get, args.fiscal, args.terminal)
+        if rec is None:
+            print("❌ Arxivda topilmadi")
+            raise SystemExit(1)
+        if args.export:
+            os.makedirs(args.export, exist_ok=True)
+            for name, key in (("request.json", "request"), ("signed.p7b", "signed"), ("response.json", "response")):
+                with open(os.path.join(args.export, name), "wb") as f:
+                    f.write(rec[key])
+            print(f"✅ {args.export} ga yozildi")
+        else:
+            print(json.dumps({"kind": rec["kind"], "seq": rec["seq"], "TerminalID": rec["TerminalID"],
+                              "FiscalSign": rec["FiscalSign"], "signed_bytes": len(rec["signed"]),
+                              "request": json.loads(rec["request"] or b"null"),
+                              "response": rec["response"].decode("utf-8", "replace")},
+                             ensure_ascii=False, indent=4))
+    else:
+        print(json.dumps(ReceiptArchive(args.dir).stats(), indent=4))
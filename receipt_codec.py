@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+receipt_codec.py – Receipt JSON uchun ixcham, deterministik UTF-8 serializer
+
+- Natija json.dumps(receipt, ensure_ascii=False, separators=(",", ":")) bilan bayt-ma-bayt bir xil:
+  probellarsiz, kalitlar tartibi – dict’dagi tartib (builder’lar doim bir xil tartibda yig‘adi).
+- Har chekda o‘zgarmaydigan bo‘laklar (MerchantInfo, Location, ExtraInfo’ning marketplace
+  qismi, kalit prefikslari) bir marta kodlanib keshlanadi; har safar faqat Items, summalar,
+  ReceiptSeq va vaqt maydonlari qo‘shiladi.
+- Har bir chek hajmi metrics’ga yoziladi (ofd_payload_bytes_total / ofd_payloads_total).
+- receipt_model.Receipt obyektlari o‘zining encode_text() i bilan kodlanadi.
+- Deterministik baytlar – sha256 (payload_digest) bo‘yicha takrorlarni aniqlash mumkin.
+
+Tekshirish (json.dumps bilan bayt-ma-bayt va tezlik):
+    python receipt_codec.py --check
+"""
+
+import hashlib
+import json
+import sys
+
+from metrics import REGISTRY
+from receipt_model import Receipt
+
+# Qiymati (deyarli) har doim bir xil bo‘lgan tekis dict’lar – kodlangan holda keshlanadi
+STATIC_KEYS = frozenset(("Location", "MerchantInfo"))
+# ExtraInfo ichida har chekda o‘zgaradigan maydonlar
+DYNAMIC_EXTRA = frozenset(("RequestTime", "CreatedTime"))
+
+MAX_CACHE = 4096
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+def _is_flat(value):
+    return isinstance(value, dict) and all(
+        v is None or isinstance(v, (str, int, float, bool)) for v in value.values())
+
+
+class ReceiptEncoder:
+    """Keshlangan statik bo‘laklar bilan Receipt dict -> ixcham UTF-8 baytlar."""
+
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+        self._keys = {}        # "Key" -> '"Key":'
+        self._static = {}      # id(dict) -> (nusxa, kodlangan matn)
+        self._pairs = {}       # (key, value) -> '"key":"value"' (ExtraInfo)
+
+    def _key(self, key):
+        prefix = self._keys.get(key)
+        if prefix is None:
+            prefix = self._keys[key] = _dumps(key) + ":"
+        return prefix
+
+    def _static_fragment(self, value):
+        cached = self._static.get(id(value))
+        # Shu id’dagi dict o‘zgarmagan bo‘lsagina kesh ishlatiladi
+        if cached is not None and cached[0] == value:
+            return cached[1]
+        text = _dumps(value)
+        if _is_flat(value):
+            if len(self._static) >= MAX_CACHE:
+                self._static.clear()
+            # value ham saqlanadi – id boshqa obyektga qayta berilmasin
+            self._static[id(value)] = (dict(value), text, value)
+        return text
+
+    def _extra(self, extra):
+        parts = []
+        pairs = self._pairs
+        for key, value in extra.items():
+            if key in DYNAMIC_EXTRA or not isinstance(value, str):
+                parts.append(self._key(key) + _dumps(value))
+                continue
+            pair = pairs.get((key, value))
+            if pair is None:
+                pair = self._key(key) + _dumps(value)
+                if len(pairs) >= MAX_CACHE:
+                    pairs.clear()
+                pairs[(key, value)] = pair
+            parts.append(pair)
+        return "{" + ",".join(parts) + "}"
+
+    def encode_text(self, receipt):
+        if isinstance(receipt, Receipt):  # receipt_model – o‘zi kodlaydi
+            return receipt.encode_text()
+        parts = []
+        for key, value in receipt.items():
+            if key in STATIC_KEYS and isinstance(value, dict):
+                fragment = self._static_fragment(value)
+            elif key == "ExtraInfo" and isinstance(value, dict):
+                fragment = self._extra(value)
+            else:
+                fragment = _dumps(value)
+            parts.append(self._key(key) + fragment)
+        return "{" + ",".join(parts) + "}"
+
+    def encode(self, receipt, receipt_type=None):
+        """Imzolash va yuborish uchun baytlar; receipt_type berilsa hajm metrics’ga yoziladi."""
+        data = self.encode_text(receipt).encode("utf-8")
+        if receipt_type is not None:
+            record_payload_size(receipt_type, len(data), self.registry)
+        return data
+
+
+def record_payload_size(receipt_type, size, registry=REGISTRY):
+    registry.inc("ofd_payload_bytes_total", size, type=receipt_type)
+    registry.inc("ofd_payloads_total", type=receipt_type)
+
+
+def payload_digest(data):
+    """Deterministik payload uchun sha256 (hex)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+_encoder = ReceiptEncoder()
+
+
+def get_encoder():
+    return _encoder
+
+
+def encode_receipt(receipt, receipt_type=None):
+    return _encoder.encode(receipt, receipt_type)
+
+
+def _check(rounds=2000):
+    """Tasodifiy cheklarda json.dumps bilan bayt-ma-bayt solishtirish va tezlik."""
+    import random
+    import time
+
+    import marketplace_receipt as mr
+
+    rng = random.Random(13)
+    sids = list(mr.seller_map)
+    receipts = []
+    for seq in range(rounds):
+        raw = [{"Name": f"Mahsulot “{i}” ’ñ", "Barcode": str(rng.randrange(10 ** 12)), "SPIC": "08471012005000000",
+                "PackageCode": "1503256", "Price": rng.randrange(1, 10 ** 7), "Amount": rng.randrange(1, 9),
+                "seller_id": rng.choice(sids)} for i in range(rng.randrange(1, 30))]
+        items, total_price, total_vat = mr.normalize_items_batched(raw)
+        receipt = mr.build_receipt(items, seq, totals=(total_price, total_vat),
+                                   payment_type=rng.choice(["card", "cash", "mix"]))
+        if seq % 3 == 0:
+            receipt["RefundInfo"] = {"TerminalID": "EZ000000000931", "ReceiptSeq": str(seq),
+                                     "DateTime": "20251021102349", "FiscalSign": "749052382347"}
+        receipts.append(receipt)
+
+    encoder = ReceiptEncoder()
+    for receipt in receipts:
+        expected = json.dumps(receipt, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if encoder.encode(receipt) != expected:
+            return False
+
+    def timeit(fn):
+        started = time.perf_counter()
+        for r in receipts:
+            fn(r)
+        return (time.perf_counter() - started) / len(receipts) * 1e6
+
+    old = timeit(lambda r: json.dumps(r, ensure_ascii=False, indent=4).encode("utf-8"))
+    new = timeit(encoder.encode)
+    old_size = sum(len(json.dumps(r, ensure_ascii=False, indent=4).encode("utf-8")) for r in receipts)
+    new_size = sum(len(encoder.encode(r)) for r in receipts)
+    print(f"indent=4: {old:7.1f} µs, {old_size / len(receipts):8.0f} bayt/chek")
+    print(f"ixcham:   {new:7.1f} µs, {new_size / len(receipts):8.0f} bayt/chek")
+    return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--check":
+        if _check():
+            print("✅ Ixcham serializer json.dumps bilan bir xil")
+        else:
+            print("❌ Farq bor")
+            raise SystemExit(1)
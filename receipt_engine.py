@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+"""
+receipt_engine.py – Barcha chek turlari uchun yagona yig‘ish / yuborish dvigateli
+
+- Turlar: sale, marketplace_sale, refund, marketplace_refund, advance, advance_refund,
+  credit, credit_refund (ReceiptType 0/1/2, IsRefund, RefundInfo / SaleReceiptInfo,
+  AdvanceContractID shu yerda bir marta ta’riflangan).
+- build(kind, order, link_info) – Receipt JSON; submit(kind, receipt_data) – imzolash,
+  outbox, yuborish, db/receipts.db, logs/archive va logs/last_*_info.json.
+- Sertifikat/kalit, HTTP pool, ReceiptSeq lease’i, seller reestri, katalog, outbox va
+  metrikalar bitta jarayonda umumiy – aralash partiyalar skript ishga tushirmasdan o‘tadi.
+- Terminallar: db/terminals.json bo‘lsa cheklar bir nechta fiskal modulga taqsimlanadi
+  (terminal_pool – yangi chek eng bo‘sh terminalga, qaytuv / kredit asl chek terminaliga);
+  ReceiptSeq yuborishda, tanlangan terminal hisoblagichidan olinadi.
+- Bog‘lanish (RefundInfo / SaleReceiptInfo) berilmasa lokal ombordan olinadi:
+  order["link"] (FiscalSign / ReceiptSeq) > order_id > shu turdagi oxirgi chek.
+- Qaytuv (refund / marketplace_refund) orderida "returns" bo‘lsa itemlar refund_ledger
+  daftaridan olinadi: faqat qaytarilayotgan qatorlar, qoldiq atomar ushlab qo‘yiladi va OFD
+  natijasi bo‘yicha yakunlanadi (rad etilsa – qaytariladi). "returns"siz qaytuv ham, asl
+  sotuv daftarda bo‘lsa, daftar orqali – sotuvning butun qoldig‘i ("all" bilan bir xil).
+- Yig‘ilgan chek ReceiptSeq olishdan oldin receipt_validator bilan tekshiriladi; xatoli chek
+  400 va xatolar ro‘yxati bilan qaytadi (seq, imzo va OFD so‘rovi sarflanmaydi).
+
+Order ko‘rinishi:
+    marketplace_*:  {"order_id", "items": [{..., "seller_id"}], "payment_type", "taxi_info"}
+    boshqalar:      {"order_id", "items": [OFD itemlari], "payment_type",
+                     "received_cash", "received_card", "advance_contract_id", "link", "terminal_id"?}
+    qisman qaytuv:  {"order_id", "returns": [{"barcode" | "line", "amount"?}] | "all",
+                     "refund_id"?, "link"?}   # amount – dona, berilmasa qatorning butun qoldig‘i
+
+Foydalanish:
+    python receipt_engine.py credit --order db/credit_order.json
+    python receipt_engine.py --batch mixed.ndjson      # har qator: {"type", "order", "link_info"}
+    python receipt_engine.py --batch mixed.ndjson --validate   # faqat yig‘ish va tekshirish
+"""
+
+import argparse
+import json
+import sys
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+import requests
+
+import marketplace_receipt as mr
+from idempotency import get_idempotency, idempotency_key
+from metrics import REGISTRY, StageTimer
+from outbox import IN_FLIGHT_LEASE
+from ofd_client import CircuitOpenError
+from ofd_signer import SigningError, extract_content
+from product_catalog import get_catalog
+from qr_render import get_renderer
+from receipt_archive import archive_outbox, get_archive, response_fields
+from receipt_codec import encode_receipt
+from receipt_store import get_store, link_info as store_link_info, link_row
+from receipt_validator import validate
+from refund_ledger import LedgerError, RefundDone, get_ledger, order_returns, refund_key
+from seller_registry import get_registry
+from terminal_pool import TERMINALS_FILE, TerminalError, load_terminals
+
+CERT_FILE = "certificates/EP000000000589.crt"
+KEY_FILE = "certificates/amaar.key"
+OFD_URL = "https://txkm.soliq.uz/emp/v3/receipt"
+
+ReceiptKind = namedtuple("ReceiptKind", "receipt_type is_refund marketplace link_field sources with_sign advance")
+
+KINDS = {
+    "sale":               ReceiptKind(0, 0, False, None, (), True, False),
+    "marketplace_sale":   ReceiptKind(0, 0, True, None, (), True, False),
+    "refund":             ReceiptKind(0, 1, False, "RefundInfo", ("sale", "marketplace_sale"), True, False),
+    "marketplace_refund": ReceiptKind(0, 1, True, "RefundInfo", ("marketplace_sale", "sale"), True, False),
+    "advance":            ReceiptKind(1, 0, False, None, (), True, True),
+    "advance_refund":     ReceiptKind(1, 1, False, "RefundInfo", ("advance",), False, True),
+    "credit":             ReceiptKind(2, 0, False, "SaleReceiptInfo", ("sale", "marketplace_sale"), True, False),
+    "credit_refund":      ReceiptKind(2, 1, False, "SaleReceiptInfo", ("credit",), True, False),
+}
+
+# Oxirgi javob saqlanadigan fayllar (eski skriptlar bilan bir xil)
+LAST_INFO_FILES = {
+    "sale": "logs/last_sale_info.json",
+    "marketplace_sale": "logs/last_sale_info.json",
+    "refund": "logs/last_refund_info.json",
+    "marketplace_refund": "logs/last_refund_info.json",
+    "credit": "logs/last_credit_info.json",
+}
+
+
+# order.items ning majburiy maydonlari: marketplace – xom order itemi, qolganlar – tayyor OFD itemi
+ITEM_FIELDS = ("Price", "VAT")
+MARKETPLACE_ITEM_FIELDS = ("Name", "Price", "Amount")
+NUMERIC_FIELDS = frozenset(("Price", "VAT", "Amount"))
+
+
+class ReceiptError(ValueError):
+    """Chekni yig‘ib bo‘lmaydi (noma’lum tur, asl chek topilmadi, AdvanceContractID yo‘q...)."""
+
+
+def _check_items(items, fields):
+    """Yig‘ishdan oldin: har item dict va majburiy maydonlari bor (sonlilari son) – aks holda ReceiptError."""
+    for n, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ReceiptError(f"items[{n}] obyekt bo‘lishi kerak")
+        missing = [f for f in fields if item.get(f) is None]
+        if missing:
+            raise ReceiptError(f"items[{n}]: {', '.join(missing)} maydoni kerak")
+        for f in fields:
+            if f in NUMERIC_FIELDS and (isinstance(item[f], bool) or not isinstance(item[f], (int, float))):
+                raise ReceiptError(f"items[{n}].{f} son bo‘lishi kerak")
+
+
+class ReceiptEngine:
+    """Issiq holatda turadigan chek yig‘uvchi + imzolovchi + yuboruvchi (barcha turlar)."""
+
+    def __init__(self, cert_file=CERT_FILE, key_file=KEY_FILE, url=OFD_URL, seq_block=10,
+                 seller_map=None, marketplace=None, merchant=None, seq=None, catalog=None,
+                 terminals=None, terminals_file=TERMINALS_FILE):
+        # terminals_file bo‘lmasa – cert_file / key_file bilan bitta terminal (seq – uning hisoblagichi)
+        self.terminals = terminals or load_terminals(terminals_file, cert_file, key_file, url, seq_block, seq)
+        self.client = self.terminals.primary.client
+        self.url = url
+        self.idempotency = get_idempotency()
+        self.store = get_store()
+        self.ledger = get_ledger()
+        self.archive = get_archive()
+        self.qr = get_renderer()
+        self.seller_map = seller_map or get_registry(fallback=mr.sellers)
+        self.catalog = catalog or get_catalog()
+        self.marketplace = marketplace or mr.marketplace
+        self.merchant = merchant or mr.merchant
+        self.taxi_info = mr.load_taxi_info()
+        self._persist_lock = threading.Lock()
+
+    # --- bog‘lanish ---
+
+    def resolve_link(self, kind, order_id=None, ref=None, terminal_id=None):
+        """
+        Asl chekning RefundInfo / SaleReceiptInfo ma’lumoti yoki None – faqat shu tur manbalaridan
+        (spec.sources); ReceiptSeq bo‘yicha – terminal_id (order["terminal_id"]) terminalidan.
+        """
+        spec = KINDS[kind]
+        if ref:
+            row = link_row(self.store, spec.sources, str(ref), terminal_id)
+        elif order_id:
+            row = self.store.by_order(order_id, spec.sources)
+        else:
+            row = self.store.latest(spec.sources)
+        return store_link_info(row, spec.with_sign) if row else None
+
+    # --- qisman qaytuv ---
+
+    @staticmethod
+    def refund_id(order, order_id):
+        """Daftar hold’i kaliti: order["refund_id"] yoki order id + returns (bir xil so‘rov – o‘sha qaytuv)."""
+        return refund_key(order, order_id)
+
+    def _ledger_sale(self, kind, order, order_id, link_info=None):
+        """returns’siz qaytuvning asl sotuvi daftarda bo‘lsa uning FiscalSign’i, aks holda None."""
+        if link_info is None and order.get("link"):
+            link_info = self.resolve_link(kind, ref=order["link"], terminal_id=order.get("terminal_id"))
+        fiscal_sign = (link_info or {}).get("FiscalSign") or (self.ledger.find_sale(order_id) if order_id else None)
+        return fiscal_sign if fiscal_sign and self.ledger.has_sale(fiscal_sign) else None
+
+    def reserve_returns(self, kind, order, dry_run=False, link_info=None):
+        """
+        Qaytuv uchun daftardan (refund_id, itemlar, RefundInfo): order["returns"] bo‘yicha, returns
+        bo‘lmasa – asl sotuv daftarda bo‘lsa uning butun qoldig‘i. Tur qaytuv bo‘lmasa yoki eski
+        (daftarsiz) sotuv qaytuvi bo‘lsa None. dry_run – qoldiq o‘zgarmaydi.
+        """
+        spec = KINDS.get(kind)
+        if not isinstance(order, dict) or spec is None or spec.receipt_type != 0 or not spec.is_refund:
+            return None
+        order_id = order.get("order_id") or order.get("id")
+        if "returns" not in order:
+            fiscal_sign = self._ledger_sale(kind, order, order_id, link_info)
+            if fiscal_sign is None:
+                return None  # daftarda yo‘q eski sotuv – order itemlari bilan
+        else:
+            fiscal_sign = order.get("link") or (self.ledger.find_sale(order_id) if order_id else None)
+        if not fiscal_sign:
+            raise ReceiptError(f"{kind}: asl sotuv daftarda topilmadi (order_id yoki link kerak)")
+        refund_id = self.refund_id(order, order_id or fiscal_sign)
+        try:
+            items, link = self.ledger.reserve(refund_id, fiscal_sign, order_returns(order.get("returns", "all")),
+                                              dry_run)
+        except RefundDone:
+            raise  # process() saqlangan javobni qaytaradi
+        except LedgerError as e:
+            raise ReceiptError(str(e)) from None
+        return refund_id, items, link
+
+    # --- yig‘ish ---
+
+    def _marketplace_items(self, order, order_id):
+        unknown_sellers = {}
+        if hasattr(self.seller_map, "refresh"):
+            self.seller_map.refresh()
+        items, total_price, total_vat = mr.normalize_items_batched(order.get("items", []), self.seller_map,
+                                                                   unknown_sellers, self.catalog)
+        if unknown_sellers and hasattr(self.seller_map, "note_unknown"):
+            self.seller_map.note_unknown(unknown_sellers, f"(order {order_id})")
+        delivery_item = mr.make_delivery_item(order.get("taxi_info") or self.taxi_info, catalog=self.catalog)
+        items.append(delivery_item)
+        return items, total_price + delivery_item["Price"], total_vat + delivery_item["VAT"]
+
+    def build(self, kind, order, link_info=None, timer=None, now=None, refund_items=None):
+        """
+        Receipt JSON (dict), ReceiptSeq None bilan: seq submit() da, chek yo‘naltirilgan
+        terminal hisoblagichidan olinadi (tekshiruv va idempotentlikdan keyin).
+        refund_items – daftardan olingan qaytuv itemlari (reserve_returns); order.items o‘rniga.
+        """
+        spec = KINDS.get(kind)
+        if spec is None:
+            raise ReceiptError(f"Noma’lum chek turi: {kind}")
+        if not isinstance(order, dict) or (refund_items is None and not isinstance(order.get("items"), list)):
+            raise ReceiptError("order.items ro‘yxati kerak")
+        timer = timer or StageTimer(kind)
+        order_id = order.get("order_id") or order.get("id")
+
+        if refund_items is not None:
+            items = refund_items
+            total_price = sum(i["Price"] for i in items)
+            total_vat = sum(i["VAT"] for i in items)
+        elif spec.marketplace:
+            _check_items(order["items"], MARKETPLACE_ITEM_FIELDS)
+            items, total_price, total_vat = self._marketplace_items(order, order_id)
+        else:
+            items = order["items"]
+            _check_items(items, ITEM_FIELDS)
+            total_price = sum(i["Price"] for i in items)
+            total_vat = sum(i["VAT"] for i in items)
+        timer.lap("normalize")
+
+        if spec.link_field and link_info is None:
+            link_info = self.resolve_link(kind, order_id, order.get("link"), order.get("terminal_id"))
+            if link_info is None:
+                raise ReceiptError(f"{kind}: asl chek topilmadi ({spec.link_field})")
+        contract_id = order.get("advance_contract_id")
+        if spec.advance and not contract_id:
+            raise ReceiptError(f"{kind}: advance_contract_id kerak")
+
+        receipt_seq = None
+        payment_type = order.get("payment_type", "card")
+        if spec.marketplace:
+            receipt_data = mr.build_receipt(items, receipt_seq, is_refund=spec.is_refund,
+                                            payment_type=payment_type,
+                                            marketplace=self.marketplace, merchant=self.merchant,
+                                            now=now, totals=(total_price, total_vat))
+        else:
+            if spec.receipt_type == 2:
+                received = (0, 0)  # kredit chekda to‘lov qabul qilinmaydi
+            else:
+                # To‘lanadigan summa: Price dan Discount va Other (avans bo‘yicha to‘langan qism) ayiriladi
+                payable = sum(i["Price"] - i.get("Discount", 0) - i.get("Other", 0) for i in items)
+                received = mr.split_payment(payable, payment_type)
+            now_time = (now or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
+            receipt_data = {
+                "ReceiptSeq": receipt_seq,
+                "IsRefund": spec.is_refund,
+                "Items": items,
+                "ReceivedCash": order.get("received_cash", received[0]),
+                "ReceivedCard": order.get("received_card", received[1]),
+                "TotalVAT": total_vat,
+                "Time": now_time,
+                "ReceiptType": spec.receipt_type,
+                "Location": mr.LOCATION,
+                "ExtraInfo": {"PhoneNumber": mr.PHONE_NUMBER, "RequestTime": now_time, "CreatedTime": now_time},
+                "MerchantInfo": self.merchant,
+            }
+        if spec.advance:
+            receipt_data["AdvanceContractID"] = contract_id
+        if spec.link_field:
+            receipt_data[spec.link_field] = link_info
+        return receipt_data
+
+    # --- yuborish ---
+
+    def submit(self, kind, receipt_data, queue=False, timer=None, order_id=None, idem_key=None, reuse=None,
+               terminal=None, refund_id=None):
+        """
+        Terminal tanlaydi (berilmasa), ReceiptSeq ajratadi (None bo‘lsa), imzolaydi, outbox’ga yozadi,
+        yuboradi va (status, javob dict) qaytaradi.
+        reuse – idempotentlik keshidagi "pending" yozuv: o‘sha imzolangan chek o‘sha terminal
+        orqali qayta yuboriladi (terminal_id yo‘q eski yozuvlar – asosiy terminal).
+        refund_id – daftar hold’i: OFD natijasi bo‘yicha yakunlanadi (outbox meta’da ham saqlanadi).
+        """
+        if terminal is None:
+            pinned = (reuse.get("terminal_id") or self.terminals.primary.id) if reuse is not None else None
+            with self.terminals.routed(receipt_data, pinned) as terminal:
+                return self.submit(kind, receipt_data, queue, timer, order_id, idem_key, reuse, terminal, refund_id)
+        timer = timer or StageTimer(kind)
+        outbox_id = None
+        if reuse is not None:
+            signed_data = reuse["signed"]
+            receipt_bytes = extract_content(signed_data)
+            receipt_data = json.loads(receipt_bytes)
+            if reuse["outbox_id"] and terminal.outbox.has(reuse["outbox_id"]):
+                outbox_id = reuse["outbox_id"]
+                if not queue and not terminal.outbox.lease(outbox_id):
+                    # Fon worker (yoki boshqa so‘rov) hozir aynan shu chekni yubormoqda
+                    return 202, {"queued": True, "outbox_id": outbox_id, "ReceiptSeq": receipt_data["ReceiptSeq"],
+                                 "terminal": terminal.id}
+        else:
+            if idem_key and not self.idempotency.claim(idem_key, kind, order_id, terminal_id=terminal.id):
+                # Xuddi shu chek parallel so‘rovda birinchi bo‘lib egallandi – bu nusxa seq olmaydi
+                return 409, {"error": "Shu chek hozir yuborilmoqda", "order_id": order_id}
+            try:
+                if receipt_data["ReceiptSeq"] is None:
+                    receipt_data["ReceiptSeq"] = terminal.seq.next()
+                    timer.lap("seq_alloc")
+                receipt_bytes = encode_receipt(receipt_data, kind)
+                timer.lap("json_dump")
+                signed_data = terminal.signer.sign(receipt_bytes)
+                timer.lap("sign")
+            except BaseException:
+                self.idempotency.release(idem_key)
+                raise
+            self.idempotency.fill(idem_key, receipt_data["ReceiptSeq"], signed_data)
+        if outbox_id is None:
+            outbox_id = terminal.outbox.put(signed_data, {"type": kind, "url": terminal.url, "order_id": order_id,
+                                                          "ReceiptSeq": receipt_data["ReceiptSeq"], "idem": idem_key,
+                                                          "terminal": terminal.id, "refund": refund_id},
+                                            lease=0 if queue else IN_FLIGHT_LEASE)
+            self.idempotency.attach_outbox(idem_key, outbox_id)
+        if queue:
+            return 202, {"queued": True, "outbox_id": outbox_id, "ReceiptSeq": receipt_data["ReceiptSeq"],
+                         "terminal": terminal.id}
+
+        try:
+            response = terminal.client.post_receipt(signed_data)
+        except CircuitOpenError:
+            # OFD ishlamayapti: chek outbox’da, endpoint tiklanganda fon worker yuboradi
+            terminal.outbox.release(outbox_id)
+            return 202, {"queued": True, "outbox_id": outbox_id, "ReceiptSeq": receipt_data["ReceiptSeq"],
+                         "terminal": terminal.id, "circuit": "open"}
+        timer.lap("send")
+        verdict, ofd_body = terminal.outbox.settle(outbox_id, response)
+        self.ledger.settle(refund_id, verdict, _client_body(ofd_body))
+        timer.response(ofd_body.get("Code") if ofd_body else None)
+        self.store.record(kind, receipt_data, ofd_body, response.status_code, order_id, refund_id)
+        fiscal_sign, terminal_id = response_fields(ofd_body)
+        self.archive.append(kind, receipt_bytes, signed_data, response.text, receipt_data["ReceiptSeq"],
+                            fiscal_sign, terminal_id or terminal.id)
+        try:
+            body = response.json()
+        except ValueError:
+            return 502, {"error": "OFD javobi JSON emas", "raw": response.text,
+                         "ReceiptSeq": receipt_data["ReceiptSeq"]}
+
+        if body.get("QRCodeURL"):
+            body["QRCodeURL"] = mr.unescape_qr(body["QRCodeURL"])
+        self.idempotency.settle(idem_key, verdict, body)
+        if body.get("FiscalSign"):
+            self._persist(kind, body)
+            self.qr.submit(body["FiscalSign"], body.get("QRCodeURL"))  # fonda, logs/qr
+        timer.lap("persist")
+        return response.status_code, body
+
+    def _persist(self, kind, body):
+        info_file = LAST_INFO_FILES.get(kind)
+        if info_file is None:
+            return
+        with self._persist_lock:
+            with open(info_file, "w", encoding="utf-8") as f:
+                json.dump(body, f, ensure_ascii=False, indent=4)
+
+    def process(self, kind, order, link_info=None, queue=False):
+        """
+        build + submit; xatolar HTTP uslubidagi (status, dict) ko‘rinishida qaytadi.
+        Order id bo‘lsa idempotent: qabul qilingan chek uchun saqlangan javob qaytadi,
+        javobsiz qolgan chek o‘sha ReceiptSeq va imzo bilan qayta yuboriladi.
+        """
+        timer = StageTimer(kind)
+        order_id = (order.get("order_id") or order.get("id")) if isinstance(order, dict) else None
+        refund_id = refund_items = None
+        try:
+            reserved = self.reserve_returns(kind, order, link_info=link_info)
+            if reserved is not None:
+                refund_id, refund_items, link_info = reserved
+            receipt_data = self.build(kind, order, link_info, timer, refund_items=refund_items)
+        except RefundDone as e:
+            # Qaytuv allaqachon fiskallashtirilgan: idempotentlik yozuvi o‘chgan bo‘lsa ham qayta berilmaydi
+            REGISTRY.inc("ofd_idempotent_hits_total", kind=kind, state="done")
+            if e.response is not None:
+                return 200, e.response
+            return 409, {"error": str(e), "order_id": order_id}
+        except ReceiptError as e:
+            self.ledger.release(refund_id)
+            return 400, {"error": str(e)}
+        except BaseException:
+            self.ledger.release(refund_id)  # kutilmagan yig‘ish xatosi ham hold’ni ushlab qolmaydi
+            raise
+        issues = validate(receipt_data)
+        if issues:
+            self.ledger.release(refund_id)
+            REGISTRY.inc("ofd_local_rejects_total", kind=kind)
+            return 400, {"error": "Chek tekshiruvdan o‘tmadi", "issues": [i._asdict() for i in issues]}
+        # Daftar qaytuvlari refund_id bo‘yicha: bir xil mazmunli ikki alohida qaytuv – ikki chek
+        idem_key = idempotency_key(kind, refund_id or order_id, receipt_data)
+        previous = self.idempotency.get(idem_key)
+        if previous is not None:
+            REGISTRY.inc("ofd_idempotent_hits_total", kind=kind, state=previous["state"])
+            if previous["state"] == "claimed":
+                # Parallel so‘rov hozir seq ajratib imzolamoqda
+                return 409, {"error": "Shu chek hozir yuborilmoqda", "order_id": order_id}
+            if previous["state"] == "done":
+                self.ledger.settle(refund_id, "done", previous["response"])
+                return 200, previous["response"]
+            receipt_data["ReceiptSeq"] = previous["receipt_seq"]
+        try:
+            return self.submit(kind, receipt_data, queue, timer, order_id, idem_key, previous, refund_id=refund_id)
+        except TerminalError as e:
+            self.ledger.release(refund_id)
+            return 400, {"error": str(e)}
+        except SigningError as e:
+            self.ledger.release(refund_id)
+            return 500, {"error": f"Imzolash xatosi: {e}", "ReceiptSeq": receipt_data["ReceiptSeq"]}
+        except requests.exceptions.RequestException as e:
+            timer.response(None)
+            return 504, {"error": f"So‘rov xatoligi: {e}", "ReceiptSeq": receipt_data["ReceiptSeq"]}
+
+    def validate_batch(self, requests_iter):
+        """Partiyani yubormasdan tekshiradi: (so‘rov, Issue ro‘yxati yoki ReceiptError matni) generatori."""
+        for request in requests_iter:
+            kind, order, link_info = request.get("type", "sale"), request.get("order"), request.get("link_info")
+            refund_items = None
+            try:
+                reserved = self.reserve_returns(kind, order, dry_run=True, link_info=link_info)
+                if reserved is not None:
+                    _, refund_items, link_info = reserved
+                receipt_data = self.build(kind, order, link_info, refund_items=refund_items)
+            except (ReceiptError, RefundDone) as e:
+                yield request, str(e)
+                continue
+            yield request, validate(receipt_data)
+
+    def run_batch(self, requests_iter):
+        """Aralash partiya: har element {"type", "order", "link_info"?} – (so‘rov, status, javob) generatori."""
+        for request in requests_iter:
+            status, body = self.process(request.get("type", "sale"), request.get("order"),
+                                        request.get("link_info"), bool(request.get("queue")))
+            yield request, status, body
+
+    def start_workers(self):
+        """Har bir terminal outbox’ining fon worker’ini ishga tushiradi (servis rejimi)."""
+        self.terminals.start_workers(on_outbox_result)
+
+    def close(self):
+        self.terminals.close()
+        self.archive.flush()
+
+
+def on_outbox_result(entry, verdict, body, response=None):
+    """
+    Fon worker yuborgan chek natijasi (servis worker’lari va outbox.py --drain uchun bitta):
+    har urinish logs/archive ga, yakunlangan (done / fail) chek db/receipts.db ga (sotuv bo‘lsa
+    daftar qatorlari bilan), so‘ng idempotentlik keshi, daftar hold’i va QR rasmi (sinxron yo‘l bilan bir xil).
+    """
+    if response is not None:
+        archive_outbox(entry, response, body, get_archive())
+    if verdict != "retry":
+        get_store().record_outbox(entry, body, response.status_code if response is not None else None)
+    body = _client_body(body)
+    get_idempotency().settle(entry["meta"].get("idem"), verdict, body)
+    get_ledger().settle(entry["meta"].get("refund"), verdict, body)
+    if verdict == "done" and body.get("FiscalSign"):
+        get_renderer().submit(body["FiscalSign"], body.get("QRCodeURL"))  # fonda, logs/qr
+
+
+def _client_body(body):
+    """OFD javobi mijozga qaytadigan ko‘rinishda (QRCodeURL escape’siz)."""
+    if body and body.get("QRCodeURL"):
+        return dict(body, QRCodeURL=mr.unescape_qr(body["QRCodeURL"]))
+    return body
+
+
+def _iter_ndjson(lines):
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            print(f"❌ {line_no}-qator JSON emas: {e}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Yagona chek dvigateli")
+    parser.add_argument("kind", nargs="?", choices=sorted(KINDS))
+    parser.add_argument("--order", help="order JSON fayli")
+    parser.add_argument("--link", help="asl chek: FiscalSign yoki ReceiptSeq")
+    parser.add_argument("--batch", help="NDJSON: har qator {type, order, link_info}; '-' – stdin")
+    parser.add_argument("--cert", default=CERT_FILE)
+    parser.add_argument("--key", default=KEY_FILE)
+    parser.add_argument("--url", default=OFD_URL)
+    parser.add_argument("--seq-block", type=int, default=10)
+    parser.add_argument("--terminals", default=TERMINALS_FILE, help="terminallar konfiguratsiyasi")
+    parser.add_argument("--validate", action="store_true", help="--batch ni yubormasdan faqat tekshirish")
+    args = parser.parse_args()
+
+    engine = ReceiptEngine(args.cert, args.key, args.url, seq_block=args.seq_block, terminals_file=args.terminals)
+    try:
+        if args.batch and args.validate:
+            src = sys.stdin if args.batch == "-" else open(args.batch, "r", encoding="utf-8")
+            rejected = 0
+            for req, issues in engine.validate_batch(_iter_ndjson(src)):
+                rejected += bool(issues)
+                print(json.dumps({"type": req.get("type"), "ok": not issues,
+                                  "issues": [i._asdict() for i in issues] if isinstance(issues, list)
+                                  else [{"path": "", "code": "build", "message": issues}]},
+                                 ensure_ascii=False))
+            if rejected:
+                raise SystemExit(1)
+        elif args.batch:
+            src = sys.stdin if args.batch == "-" else open(args.batch, "r", encoding="utf-8")
+            for req, status, payload in engine.run_batch(_iter_ndjson(src)):
+                print(json.dumps({"type": req.get("type"), "status": status, "response": payload},
+                                 ensure_ascii=False))
+        elif args.kind and args.order:
+            with open(args.order, "r", encoding="utf-8") as f:
+                order_data = json.load(f)
+            if args.link:
+                order_data["link"] = args.link
+            status, payload = engine.process(args.kind, order_data)
+            print("Status:", status)
+            print(json.dumps(payload, ensure_ascii=False, indent=4))
+        else:
+            parser.error("kind va --order yoki --batch kerak")
+    finally:
+        engine.close()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+receipt_model.py – Ixcham chek modeli: __slots__ li Item / Receipt (dict’lar o‘rniga)
+
+- Item – 16 kalitli dict o‘rniga slotlar: pul maydonlari butun son (int), Labels – tuple,
+  CommissionInfo / TaxiInfo – umumiy, o‘zgarmas Info obyekti (bitta seller itemlari bitta
+  obyektni bo‘lishadi).
+- Info – o‘zgarmas tekis obyekt (MerchantInfo, Location, ExtraInfo’ning doimiy qismi,
+  CommissionInfo, TaxiInfo): JSON matni yaratilganda bir marta kodlanadi, bir xil
+  mazmunlilari info() orqali bitta nusxaga keltiriladi.
+- Receipt.encode() – OFD maydon nomlari bilan to‘g‘ridan-to‘g‘ri UTF-8 JSON, builder’lar yig‘gan
+  dict’ning json.dumps(..., separators=(",", ":")) natijasi bilan bayt-ma-bayt bir xil.
+- Item va Receipt faqat o‘qiladigan Mapping: receipt["Items"], item.get("VAT") kabi dict
+  kodi (receipt_validator, receipt_store, order_stream) o‘zgarmasdan ishlaydi; receipt["ReceiptSeq"]
+  va bog‘lanish maydonlari (RefundInfo ...) yozilishi mumkin.
+- Katta partiyalar (order_stream) navbatlarida shu obyektlar turadi.
+
+Tekshirish (json.dumps bilan bayt-ma-bayt, xotira va tezlik):
+    python receipt_model.py --check
+"""
+
+import json
+import sys
+from collections.abc import Mapping
+from datetime import datetime
+from json.encoder import encode_basestring
+
+import marketplace_receipt as mr
+
+MAX_INTERNED = 4096
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+# (OFD nomi, slot) – JSON’dagi tartib normalize_items() dagi dict tartibi bilan bir xil
+ITEM_FIELDS = (
+    ("Name", "name"), ("Barcode", "barcode"), ("Labels", "labels"), ("SPIC", "spic"),
+    ("PackageCode", "package_code"), ("OwnerType", "owner_type"), ("GoodPrice", "good_price"),
+    ("Price", "price"), ("VAT", "vat"), ("VATPercent", "vat_percent"), ("Amount", "amount"),
+    ("Discount", "discount"), ("Other", "other"), ("Voucher", "voucher"),
+)
+ITEM_INFO_KEYS = ("CommissionInfo", "TaxiInfo")
+_ITEM_SLOTS = dict(ITEM_FIELDS)
+
+RECEIPT_FIELDS = (
+    ("ReceiptSeq", "seq"), ("IsRefund", "is_refund"), ("Items", "items"), ("ReceivedCash", "received_cash"),
+    ("ReceivedCard", "received_card"), ("TotalVAT", "total_vat"), ("Time", "time"),
+    ("ReceiptType", "receipt_type"), ("Location", "location"), ("ExtraInfo", "extra"),
+    ("MerchantInfo", "merchant"),
+)
+_RECEIPT_SLOTS = dict(RECEIPT_FIELDS)
+WRITABLE = frozenset(("ReceiptSeq",))
+# ExtraInfo oxiridagi, chek vaqtiga teng maydonlar (build_receipt bilan bir xil)
+EXTRA_TIMES = ("RequestTime", "CreatedTime")
+
+
+class Info(Mapping):
+    """O‘zgarmas tekis obyekt; json – oldindan kodlangan matn."""
+
+    __slots__ = ("_data", "json")
+
+    def __init__(self, data):
+        self._data = dict(data)
+        self.json = _dumps(self._data)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"Info({self._data!r})"
+
+
+_interned = {}
+
+
+def info(data):
+    """Bir xil mazmunli Info’lar bitta obyekt (MAX_INTERNED tagacha keshlanadi)."""
+    if isinstance(data, Info):
+        return data
+    try:
+        key = tuple(data.items())
+        cached = _interned.get(key)
+    except TypeError:  # ichida ro‘yxat / dict – keshlanmaydi
+        return Info(data)
+    if cached is None:
+        if len(_interned) >= MAX_INTERNED:
+            _interned.clear()
+        cached = _interned[key] = Info(data)
+    return cached
+
+
+class Item(Mapping):
+    """Chek qatori; pul maydonlari int, info – umumiy CommissionInfo yoki TaxiInfo."""
+
+    __slots__ = tuple(slot for _, slot in ITEM_FIELDS) + ("info_key", "info")
+
+    def __init__(self, name, price, vat, vat_percent, amount, barcode="", labels=(), spic="", package_code="",
+                 owner_type=0, good_price=None, discount=0, other=0, voucher=0, info_key=None, info=None):
+        self.name = name
+        self.barcode = barcode
+        self.labels = tuple(labels)
+        self.spic = spic
+        self.package_code = package_code
+        self.owner_type = int(owner_type)
+        self.good_price = int(price if good_price is None else good_price)
+        self.price = int(price)
+        self.vat = int(vat)
+        self.vat_percent = int(vat_percent)
+        self.amount = int(amount)
+        self.discount = int(discount)
+        self.other = int(other)
+        self.voucher = int(voucher)
+        self.info_key = info_key
+        self.info = info
+
+    @classmethod
+    def _row(cls, name, barcode, labels, spic, package_code, price, vat, vat_percent, amount, info_key, info):
+        """from_columns uchun tez yo‘l: qiymatlar array’dan – allaqachon int."""
+        self = cls.__new__(cls)
+        self.name, self.barcode, self.labels, self.spic, self.package_code = name, barcode, labels, spic, package_code
+        self.owner_type = self.discount = self.other = self.voucher = 0
+        self.good_price = self.price = price
+        self.vat, self.vat_percent, self.amount = vat, vat_percent, amount
+        self.info_key, self.info = info_key, info
+        return self
+
+    @classmethod
+    def from_dict(cls, item):
+        """OFD item dict’idan; noma’lum kalit bo‘lsa ValueError (JSON’dan tushib qolmasin)."""
+        kwargs = {}
+        info_key = None
+        for key, value in item.items():
+            if key in _ITEM_SLOTS:
+                kwargs[_ITEM_SLOTS[key]] = value
+            elif key in ITEM_INFO_KEYS and info_key is None:
+                info_key = key
+                kwargs["info_key"], kwargs["info"] = key, info(value)
+            else:
+                raise ValueError(f"Item modelida {key} maydoni yo‘q")
+        return cls(**kwargs)
+
+    # --- Mapping ---
+
+    def __getitem__(self, key):
+        slot = _ITEM_SLOTS.get(key)
+        if slot is not None:
+            value = getattr(self, slot)
+            return list(value) if slot == "labels" else value
+        if key == self.info_key:
+            return self.info
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from _ITEM_SLOTS
+        if self.info_key:
+            yield self.info_key
+
+    def __len__(self):
+        return len(ITEM_FIELDS) + bool(self.info_key)
+
+    def __repr__(self):
+        return f"Item({self.name!r}, price={self.price}, amount={self.amount})"
+
+    # --- JSON ---
+
+    def encode_text(self):
+        text = (f'{{"Name":{encode_basestring(self.name)},"Barcode":{encode_basestring(self.barcode)},'
+                f'"Labels":{_dumps(list(self.labels)) if self.labels else "[]"},'
+                f'"SPIC":{encode_basestring(self.spic)},"PackageCode":{encode_basestring(self.package_code)},'
+                f'"OwnerType":{self.owner_type},"GoodPrice":{self.good_price},"Price":{self.price},'
+                f'"VAT":{self.vat},"VATPercent":{self.vat_percent},"Amount":{self.amount},'
+                f'"Discount":{self.discount},"Other":{self.other},"Voucher":{self.voucher}')
+        if self.info_key:
+            return f'{text},"{self.info_key}":{self.info.json}}}'
+        return text + "}"
+
+
+class Receipt(Mapping):
+    """
+    Receipt JSON modeli. extra – ExtraInfo’ning doimiy qismi (Info), RequestTime / CreatedTime
+    chek vaqtidan qo‘shiladi; tail – oxiridagi qo‘shimcha maydonlar (AdvanceContractID, RefundInfo ...).
+    """
+
+    __slots__ = tuple(slot for _, slot in RECEIPT_FIELDS) + ("tail",)
+
+    def __init__(self, seq, items, received_cash, received_card, total_vat, time, is_refund=0, receipt_type=0,
+                 location=None, extra=None, merchant=None, tail=None):
+        self.seq = seq
+        self.is_refund = is_refund
+        self.items = items
+        self.received_cash = int(received_cash)
+        self.received_card = int(received_card)
+        self.total_vat = int(total_vat)
+        self.time = time
+        self.receipt_type = receipt_type
+        self.location = info(location or mr.LOCATION)
+        self.extra = info(extra or {})
+        self.merchant = info(merchant or mr.merchant)
+        self.tail = dict(tail) if tail else None
+
+    @classmethod
+    def build(cls, items, receipt_seq, is_refund=0, payment_type="card", marketplace=mr.marketplace,
+              merchant=mr.merchant, now=None, totals=None):
+        """marketplace_receipt.build_receipt() bilan bir xil chek, Item ro‘yxatidan."""
+        if totals is not None:
+            total_price, total_vat = totals
+        else:
+            total_price = total_vat = 0
+            for item in items:
+                total_price += item.price
+                total_vat += item.vat
+        received_cash, received_card = mr.split_payment(total_price, payment_type)
+        extra = {"PhoneNumber": mr.PHONE_NUMBER, "MarketplaceName": marketplace["name"],
+                 "MarketplaceAddress": marketplace["address"], "EPNumber": marketplace["ep_number"],
+                 "ReceiptNumber": marketplace["receipt_number"]}
+        return cls(receipt_seq, items, received_cash, received_card, total_vat,
+                   (now or datetime.now()).strftime("%Y-%m-%d %H:%M:%S"), is_refund, 0,
+                   mr.LOCATION, extra, merchant)
+
+    @classmethod
+    def from_columns(cls, cols, receipt_seq, extra_items=(), **kwargs):
+        """
+        marketplace_receipt.ItemColumns dan (dict’lar yaratmasdan) – build() ga qolgan parametrlar.
+        Bitta seller itemlari bitta CommissionInfo Info’sini bo‘lishadi.
+        """
+        shared = {}
+        items = []
+        row = Item._row
+        for it, commission, price, vat_sum, vat_percent, amount in zip(
+                cols.raw, cols.commission, cols.price, cols.vat, cols.vat_percent, cols.amount):
+            commission_info = shared.get(id(commission))
+            if commission_info is None:
+                commission_info = shared[id(commission)] = info(commission)
+            labels = it.get("Labels")
+            items.append(row(it["Name"], it.get("Barcode", ""), tuple(labels) if labels else (), it.get("SPIC", ""),
+                             it.get("PackageCode", ""), price, vat_sum, vat_percent, amount,
+                             "CommissionInfo", commission_info))
+        items.extend(extra_items)
+        return cls.build(items, receipt_seq, **kwargs)
+
+    # --- Mapping ---
+
+    def __getitem__(self, key):
+        slot = _RECEIPT_SLOTS.get(key)
+        if slot == "extra":
+            return self.extra_info()
+        if slot is not None:
+            return getattr(self, slot)
+        if self.tail and key in self.tail:
+            return self.tail[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in WRITABLE:
+            setattr(self, _RECEIPT_SLOTS[key], value)
+        elif key not in _RECEIPT_SLOTS:
+            if self.tail is None:
+                self.tail = {}
+            self.tail[key] = value
+        else:
+            raise KeyError(f"{key} o‘zgartirilmaydi")
+
+    def __iter__(self):
+        yield from _RECEIPT_SLOTS
+        if self.tail:
+            yield from self.tail
+
+    def __len__(self):
+        return len(RECEIPT_FIELDS) + len(self.tail or ())
+
+    def __repr__(self):
+        return f"Receipt(seq={self.seq}, items={len(self.items)}, total_vat={self.total_vat})"
+
+    def extra_info(self):
+        extra = dict(self.extra)
+        for key in EXTRA_TIMES:
+            extra[key] = self.time
+        return extra
+
+    def to_dict(self):
+        """To‘liq ichma-ich dict (json.loads(encode()) bilan bir xil)."""
+        return json.loads(self.encode_text())
+
+    # --- JSON ---
+
+    def encode_text(self):
+        time = encode_basestring(self.time)
+        extra = self.extra.json[:-1]
+        extra = (extra + "," if len(extra) > 1 else extra) + ",".join(f'"{k}":{time}' for k in EXTRA_TIMES) + "}"
+        parts = [
+            f'{{"ReceiptSeq":{_dumps(self.seq)},"IsRefund":{self.is_refund},"Items":[',
+            ",".join([item.encode_text() for item in self.items]),
+            f'],"ReceivedCash":{self.received_cash},"ReceivedCard":{self.received_card},'
+            f'"TotalVAT":{self.total_vat},"Time":{time},"ReceiptType":{self.receipt_type},'
+            f'"Location":{self.location.json},"ExtraInfo":{extra},"MerchantInfo":{self.merchant.json}',
+        ]
+        if self.tail:
+            for key, value in self.tail.items():
+                parts.append(f",{encode_basestring(key)}:{value.json if isinstance(value, Info) else _dumps(value)}")
+        parts.append("}")
+        return "".join(parts)
+
+    def encode(self):
+        return self.encode_text().encode("utf-8")
+
+
+def _check(orders=2000, size=20):
+    """Tasodifiy orderlarda: dict yo‘li bilan bayt-ma-bayt, navbatdagi xotira va kodlash tezligi."""
+    import random
+    import time
+    import tracemalloc
+
+    from receipt_codec import ReceiptEncoder
+
+    rng = random.Random(24)
+    sids = list(mr.seller_map)
+    raws = [[{"Name": f"Mahsulot “{i}”", "Barcode": str(rng.randrange(10 ** 12)), "SPIC": "08471012005000000",
+              "PackageCode": "1503256", "Price": rng.randrange(1, 10 ** 7), "Amount": rng.randrange(1, 9),
+              "seller_id": rng.choice(sids)} for i in range(rng.randrange(1, 2 * size))] for _ in range(orders)]
+    taxi = {"TIN": "434493549", "PINFL": "05180224957283", "CarNumber": "34U389LE"}
+    now = datetime(2025, 10, 21, 10, 23, 49)
+
+    def as_dicts():
+        out = []
+        for seq, raw in enumerate(raws, 1):
+            items, total_price, total_vat = mr.normalize_items_batched(raw)
+            delivery = mr.make_delivery_item(taxi)
+            items.append(delivery)
+            receipt = mr.build_receipt(items, seq, now=now, totals=(total_price + delivery["Price"],
+                                                                    total_vat + delivery["VAT"]))
+            if seq % 3 == 0:
+                receipt["RefundInfo"] = {"TerminalID": "EZ000000000931", "ReceiptSeq": str(seq),
+                                         "DateTime": "20251021102349", "FiscalSign": "749052382347"}
+            out.append(receipt)
+        return out
+
+    def as_models():
+        out = []
+        for seq, raw in enumerate(raws, 1):
+            cols, total_price, total_vat = mr.normalize_columns(raw)
+            delivery = Item.from_dict(mr.make_delivery_item(taxi))
+            receipt = Receipt.from_columns(cols, seq, (delivery,), now=now,
+                                           totals=(total_price + delivery.price, total_vat + delivery.vat))
+            if seq % 3 == 0:
+                receipt["RefundInfo"] = {"TerminalID": "EZ000000000931", "ReceiptSeq": str(seq),
+                                         "DateTime": "20251021102349", "FiscalSign": "749052382347"}
+            out.append(receipt)
+        return out
+
+    def measure(fn):
+        tracemalloc.start()
+        started = time.perf_counter()
+        value = fn()
+        elapsed = time.perf_counter() - started
+        size_now = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return value, size_now, elapsed
+
+    dicts, dict_bytes, dict_build = measure(as_dicts)
+    models, model_bytes, model_build = measure(as_models)
+    for d, m in zip(dicts, models):
+        if json.dumps(d, ensure_ascii=False, separators=(",", ":")).encode("utf-8") != m.encode():
+            return False
+        if m.to_dict() != d or dict(m["Items"][0]) != d["Items"][0]:
+            return False
+
+    encoder = ReceiptEncoder()
+
+    def timeit(fn, receipts):
+        started = time.perf_counter()
+        for r in receipts:
+            fn(r)
+        return (time.perf_counter() - started) / len(receipts) * 1e6
+
+    n_items = sum(len(d["Items"]) for d in dicts)
+    print(f"{orders} chek, {n_items} item:")
+    print(f"  dict:    {dict_bytes / orders:8.0f} bayt/chek, yig‘ish {dict_build * 1e6 / orders:6.1f} µs, "
+          f"kodlash {timeit(encoder.encode, dicts):6.1f} µs")
+    print(f"  model:   {model_bytes / orders:8.0f} bayt/chek, yig‘ish {model_build * 1e6 / orders:6.1f} µs, "
+          f"kodlash {timeit(Receipt.encode, models):6.1f} µs")
+    return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--check":
+        if _check():
+            print("✅ Model dict yo‘li bilan bayt-ma-bayt bir xil")
+        else:
+            print("❌ Farq bor")
+            raise SystemExit(1)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+receipt_seq.py – ReceiptSeq ni poygasiz (race-free) ajratish
+
+- logs/last_seq.txt eski skriptlar bilan mos qoladi: unda berilgan eng katta ReceiptSeq turadi.
+- O‘qish/oshirish/yozish fayl qulfi (logs/last_seq.txt.lock) ostida bajariladi,
+  yangi qiymat vaqtinchalik fayl + fsync + os.replace orqali atomik yoziladi.
+- Worker bir marta qulf olib bir blok raqam (lease) oladi va keyin ularni
+  qulfsiz, fsync’siz tarqatadi.
+- Ishlatilgan oxirgi raqam logs/seq_leases/<lease_id>.pos fayliga vaqtinchalik fayl +
+  os.replace bilan yoziladi (fayl hech qachon bo‘sh ko‘rinmaydi); jarayon yiqilsa, keyingi
+  lease paytida ishlatilmagan qoldiq qaytarib olinadi (reclaim). .pos fayli yo‘q yoki
+  o‘qib bo‘lmasa – lease to‘liq ishlatilgan deb hisoblanadi (takror seq o‘rniga bo‘shliq).
+- .pos fsync’siz yoziladi, shuning uchun unga faqat o‘sha yuklanish (boot) ichida ishoniladi:
+  jarayon yiqilsa ham sahifa keshi saqlanadi. Lease olingandan keyin tizim qayta yuklangan
+  bo‘lsa (elektr uzilishi) yoki boot id noma’lum bo‘lsa – .pos eskirgan bo‘lishi mumkin,
+  blok to‘liq ishlatilgan deb hisoblanadi.
+- Qaytarib olingan raqamlar keyingi lease’da birinchi beriladi – ya’ni undan kattaroq
+  raqamlar allaqachon berilgan bo‘ladi: ReceiptSeq umumiy tartibda o‘smasligi mumkin.
+- Toza yopilishda (atexit) ishlatilmagan qoldiq darhol qaytariladi.
+"""
+
+import atexit
+import json
+import os
+import socket
+import threading
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+SEQ_FILE = "logs/last_seq.txt"
+
+
+@contextmanager
+def file_lock(path):
+    """Jarayonlararo eksklyuziv qulf (POSIX flock yoki Windows msvcrt.locking)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a+b") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        else:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_write(path, text):
+    """Faylni vaqtinchalik nusxa + fsync + os.replace orqali almashtiradi."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if fcntl is not None:  # POSIX: os.replace ning o‘zi ham elektr uzilishidan keyin saqlanib qolsin
+        fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _boot_id():
+    """Joriy yuklanish identifikatori (Linux) yoki None."""
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "r", encoding="ascii") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _read_int(path, default=0):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or default)
+    except (OSError, ValueError):
+        return default
+
+
+def _read_pos(path):
+    """.pos faylidagi oxirgi berilgan raqam yoki None (fayl yo‘q, bo‘sh yoki buzilgan)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        # Windows’da os.kill(pid, 0) jarayonni to‘xtatadi, shuning uchun kernel32 orqali
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class SeqAllocator:
+    """Bitta ReceiptSeq hisoblagichi (odatda bitta terminal) uchun ajratuvchi."""
+
+    def __init__(self, seq_file=SEQ_FILE, block_size=1):
+        self.seq_file = seq_file
+        self.block_size = max(1, int(block_size))
+        base = os.path.dirname(seq_file) or "."
+        self.lock_path = seq_file + ".lock"
+        self.lease_file = os.path.join(base, "seq_leases.json")
+        self.pos_dir = os.path.join(base, "seq_leases")
+        self._mutex = threading.Lock()
+        self._lease = None  # {"id", "next", "end"}
+        atexit.register(self.release)
+
+    # --- holat fayli (qulf ostida) ---
+
+    def _load_state(self):
+        try:
+            with open(self.lease_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("leases", {})
+        state.setdefault("free", [])
+        return state
+
+    def _save_state(self, state):
+        atomic_write(self.lease_file, json.dumps(state, ensure_ascii=False, indent=4))
+
+    def _pos_path(self, lease_id):
+        return os.path.join(self.pos_dir, lease_id + ".pos")
+
+    def _reclaim(self, state):
+        """O‘lgan jarayonlarning ishlatilmagan raqamlarini free ro‘yxatiga qaytaradi."""
+        host, boot = socket.gethostname(), _boot_id()
+        for lease_id, lease in list(state["leases"].items()):
+            if lease.get("host") != host or _pid_alive(lease["pid"]):
+                continue
+            # .pos fsync’siz: boshqa yuklanishdan qolgan bo‘lsa eskirgan bo‘lishi mumkin – blok ishlatilgan
+            durable = boot is not None and lease.get("boot") == boot
+            used = _read_pos(self._pos_path(lease_id)) if durable else None
+            if used is not None and used < lease["end"]:
+                state["free"].append([max(used + 1, lease["start"]), lease["end"]])
+            del state["leases"][lease_id]
+            self._remove_pos(lease_id)
+        state["free"].sort()
+
+    def lease(self, count=None):
+        """
+        Yangi blok oladi: (lease_id, start, end) – end ham kiradi. Avval qaytarib olingan
+        (free) raqamlar beriladi – ular allaqachon berilgan raqamlardan kichik bo‘ladi.
+        """
+        count = count or self.block_size
+        with file_lock(self.lock_path):
+            state = self._load_state()
+            self._reclaim(state)
+
+            if state["free"]:
+                start, end = state["free"].pop(0)
+                if end - start + 1 > count:
+                    state["free"].insert(0, [start + count, end])
+                    end = start + count - 1
+            else:
+                last = _read_int(self.seq_file)
+                start, end = last + 1, last + count
+                atomic_write(self.seq_file, str(end))
+
+            lease_id = uuid.uuid4().hex
+            state["leases"][lease_id] = {
+                "pid": os.getpid(), "host": socket.gethostname(), "boot": _boot_id(),
+                "start": start, "end": end,
+            }
+            self._save_state(state)
+        os.makedirs(self.pos_dir, exist_ok=True)
+        return lease_id, start, end
+
+    def next(self):
+        """Navbatdagi ReceiptSeq. Blok tugaganda yangisi olinadi."""
+        with self._mutex:
+            if self._lease is None or self._lease["next"] > self._lease["end"]:
+                if self._lease is not None:
+                    self._forget(self._lease["id"])
+                lease_id, start, end = self.lease()
+                self._lease = {"id": lease_id, "next": start, "end": end}
+            seq = self._lease["next"]
+            self._lease["next"] += 1
+            # fsync’siz, lekin atomik: faqat yiqilganda qoldiqni aniqlash uchun (shu boot ichida)
+            pos_path = self._pos_path(self._lease["id"])
+            with open(pos_path + ".tmp", "w") as f:
+                f.write(str(seq))
+            os.replace(pos_path + ".tmp", pos_path)
+            return seq
+
+    def _forget(self, lease_id, unused=None):
+        with file_lock(self.lock_path):
+            state = self._load_state()
+            state["leases"].pop(lease_id, None)
+            if unused:
+                state["free"].append(list(unused))
+                state["free"].sort()
+            self._save_state(state)
+        self._remove_pos(lease_id)
+
+    def _remove_pos(self, lease_id):
+        for path in (self._pos_path(lease_id), self._pos_path(lease_id) + ".tmp"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def release(self):
+        """Ishlatilmagan qoldiqni qaytarib beradi (toza yopilishda)."""
+        with self._mutex:
+            lease, self._lease = self._lease, None
+        if lease is None:
+            return
+        unused = (lease["next"], lease["end"]) if lease["next"] <= lease["end"] else None
+        self._forget(lease["id"], unused)
+
+    def current(self):
+        """Berilgan eng katta ReceiptSeq (qulf ostida o‘qiladi)."""
+        with file_lock(self.lock_path):
+            return _read_int(self.seq_file)
+
+
+_default_allocators = {}
+_default_lock = threading.Lock()
+
+
+def get_allocator(seq_file=SEQ_FILE, block_size=1):
+    with _default_lock:
+        alloc = _default_allocators.get(seq_file)
+        if alloc is None:
+            alloc = SeqAllocator(seq_file, block_size)
+            _default_allocators[seq_file] = alloc
+        return alloc
+
+
+def next_receipt_seq(seq_file=SEQ_FILE):
+    """Bir martalik skriptlar uchun: bitta ReceiptSeq ajratadi."""
+    return get_allocator(seq_file).next()
+
+
+def current_receipt_seq(seq_file=SEQ_FILE):
+    return get_allocator(seq_file).current()
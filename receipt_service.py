@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+receipt_service.py – Doimiy ishlaydigan (resident) chek servisi
+
+- Har bir chek uchun Python’ni qayta ishga tushirish o‘rniga bitta jarayon ishlaydi.
+- Sertifikat/kalit (ofd_signer), HTTP pool (ofd_client), seller reestri (db/sellers.json,
+  o‘zgarsa qayta o‘qiladi), mahsulot katalogi, marketplace,
+  merchant va ReceiptSeq lease’i (receipt_seq) so‘rovlar orasida xotirada qoladi.
+- Lokal TCP (127.0.0.1) yoki Unix socket orqali tinglaydi.
+- Chek yig‘ish va yuborish receipt_engine.ReceiptEngine’da (barcha chek turlari).
+- Har bir chek va OFD javobi db/receipts.db ga (order id bilan) yoziladi.
+- Har bir imzolangan chek yuborishdan oldin outbox’ga yoziladi; "queue": true bo‘lsa
+  servis OFD’ni kutmasdan 202 qaytaradi, chekni fon worker yuboradi.
+
+So‘rov:
+    POST /receipt
+    {"type": "sale" | "refund", "order": {"order_id": "...", "items": [...]}, "payment_type": "card", "queue": false}
+    "sale" / "refund" – marketplace cheklari; receipt_engine’dagi boshqa turlar ham
+    (credit, advance, credit_refund ...) xuddi shu yo‘l bilan, order ko‘rinishi o‘sha yerda.
+Javob: OFD javobi (QRCodeURL unescape qilingan), HTTP status OFD’nikidek.
+    GET /health – servis tirikligi va OFD holati (parallellik chegarasi, p95, circuit),
+                  har bir terminal bo‘yicha: ReceiptSeq, outbox navbati, yuk.
+    GET /metrics – bosqichlar vaqti va OFD javob kodlari (Prometheus text format).
+    GET /metrics.json – xuddi shu, count / mean / p50 / p95 ko‘rinishida.
+    GET /qr/<FiscalSign>.svg | .png – oldindan chizilgan QR rasm (qr_render keshi).
+
+Ishga tushirish:
+    python receipt_service.py --port 8765
+    python receipt_service.py --unix /tmp/receipt.sock
+"""
+
+import argparse
+import json
+import os
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics import REGISTRY
+from qr_render import CONTENT_TYPES, QrError, qr_url_of
+from receipt_engine import CERT_FILE, KEY_FILE, KINDS, OFD_URL, ReceiptEngine
+from terminal_pool import TERMINALS_FILE
+
+# Servisning eski turlari marketplace cheklari (receipt_engine turlari ham qabul qilinadi)
+SERVICE_TYPES = {"sale": "marketplace_sale", "refund": "marketplace_refund"}
+
+
+class ReceiptService(ReceiptEngine):
+    """HTTP so‘rovlarini receipt_engine’ga uzatuvchi issiq servis."""
+
+    def handle(self, request):
+        receipt_type = request.get("type", "sale")
+        kind = SERVICE_TYPES.get(receipt_type, receipt_type)
+        if kind not in KINDS:
+            return 400, {"error": f"Noma’lum chek turi: {receipt_type}"}
+        order = request.get("order")
+        if not isinstance(order, dict):
+            return 400, {"error": "order maydoni kerak"}
+        # payment_type / taxi_info so‘rovning yuqori darajasida ham berilishi mumkin
+        order = dict(order)
+        for key in ("payment_type", "taxi_info"):
+            if request.get(key) is not None:
+                order.setdefault(key, request[key])
+        return self.process(kind, order, request.get("link_info"), bool(request.get("queue")))
+
+    def qr_image(self, name):
+        """"<FiscalSign>.<fmt>" -> (status, baytlar yoki xato dict, content type)."""
+        fiscal_sign, _, fmt = name.rpartition(".")
+        if fmt not in CONTENT_TYPES or not fiscal_sign.isalnum():
+            return 404, {"error": "topilmadi"}, None
+        try:
+            data = self.qr.image(fiscal_sign, fmt)
+            if data is None:
+                # Kesh bo‘sh (masalan, backend keyin o‘rnatilgan) – bir marta chizib qo‘yamiz
+                row = self.store.by_fiscal_sign(fiscal_sign)
+                url = qr_url_of(row) if row else None
+                if url is None:
+                    return 404, {"error": "topilmadi"}, None
+                data = self.qr.image(fiscal_sign, fmt, url)
+        except QrError as e:
+            return 503, {"error": str(e)}, None
+        return 200, data, CONTENT_TYPES[fmt]
+
+
+class ReceiptHandler(BaseHTTPRequestHandler):
+    service = None  # make_server() tomonidan o‘rnatiladi
+    protocol_version = "HTTP/1.1"
+    # Sarlavha va tana bitta segmentda ketsin (Nagle + delayed ACK ~40 ms kechikish bermasin)
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def address_string(self):
+        # Unix socket’da client_address bo‘sh satr bo‘ladi
+        return self.client_address[0] if self.client_address else "unix"
+
+    def _reply(self, status, payload, content_type="application/json; charset=utf-8", headers=()):
+        if isinstance(payload, bytes):
+            data = payload
+        elif isinstance(payload, str):
+            data = payload.encode("utf-8")
+        else:
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"status": "ok", "ofd": self.service.client.status(),
+                              "terminals": self.service.terminals.status()})
+        elif self.path == "/metrics":
+            self._reply(200, REGISTRY.render_prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+        elif self.path == "/metrics.json":
+            self._reply(200, REGISTRY.to_json())
+        elif self.path.startswith("/qr/"):
+            status, payload, content_type = self.service.qr_image(self.path[4:])
+            if status == 200:
+                # FiscalSign bo‘yicha rasm hech qachon o‘zgarmaydi
+                self._reply(status, payload, content_type,
+                            (("Cache-Control", "public, max-age=31536000, immutable"),))
+            else:
+                self._reply(status, payload)
+        else:
+            self._reply(404, {"error": "topilmadi"})
+
+    def do_POST(self):
+        if self.path != "/receipt":
+            self._reply(404, {"error": "topilmadi"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._reply(400, {"error": "So‘rov JSON emas"})
+            return
+        status, payload = self.service.handle(request)
+        self._reply(status, payload)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+
+
+def make_server(service, host="127.0.0.1", port=8765, unix_path=None):
+    handler = type("BoundReceiptHandler", (ReceiptHandler,), {"service": service})
+    if unix_path:
+        return ThreadingUnixHTTPServer(unix_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Doimiy chek servisi")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="Unix socket yo‘li (berilsa TCP o‘rniga)")
+    parser.add_argument("--cert", default=CERT_FILE)
+    parser.add_argument("--key", default=KEY_FILE)
+    parser.add_argument("--url", default=OFD_URL)
+    parser.add_argument("--seq-block", type=int, default=10)
+    parser.add_argument("--terminals", default=TERMINALS_FILE, help="terminallar konfiguratsiyasi")
+    args = parser.parse_args()
+
+    os.makedirs("logs", exist_ok=True)
+    svc = ReceiptService(args.cert, args.key, args.url, seq_block=args.seq_block, terminals_file=args.terminals)
+    svc.start_workers()
+    server = make_server(svc, args.host, args.port, args.unix)
+    print(f"✅ Chek servisi ishga tushdi: {args.unix or f'{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        svc.close()
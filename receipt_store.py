@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+receipt_store.py – Yuborilgan barcha cheklar uchun lokal indekslangan ombor (SQLite, WAL)
+
+- Har bir chek: so‘rov JSON, OFD javobi, tur (sale / refund / credit / ...), order id.
+- Indekslar: order_id, (TerminalID, ReceiptSeq), FiscalSign, DateTime.
+- Qaytarish / kredit / avans qaytarish skriptlari RefundInfo va SaleReceiptInfo’ni
+  shu yerdan indeks bo‘yicha oladi (logs/last_*_info.json faqat oxirgi chekni saqlaydi).
+- Qabul qilingan sotuv cheklarining qatorlari shu tranzaksiyada refund_ledger daftariga
+  yoziladi (qisman qaytuvlar uchun qoldiq); daftar hold’isiz qaytuv – qoldiqni kamaytiradi.
+- Fon worker (outbox) yetkazgan cheklar record_outbox() bilan – so‘rov imzolangan payload’dan.
+- WAL rejimi: bir nechta jarayon bir vaqtda yozishi mumkin, o‘quvchilar bloklanmaydi.
+
+Qidirish:
+    python receipt_store.py --kind sale
+    python receipt_store.py --seq 194
+    python receipt_store.py --fiscal-sign 749052382347
+    python receipt_store.py --order ORD-1
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from ofd_signer import extract_content
+from outbox import Outbox
+from receipt_model import Receipt
+from refund_ledger import INSERT_LINE, SCHEMA as LEDGER_SCHEMA, apply_refund, sale_lines, untracked_refund
+
+STORE_FILE = "db/receipts.db"
+BUSY_TIMEOUT = 30.0  # soniya – boshqa yozuvchi qulfni bo‘shatishini kutish
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind         TEXT    NOT NULL,
+    receipt_type INTEGER,
+    is_refund    INTEGER,
+    order_id     TEXT,
+    terminal_id  TEXT,
+    receipt_seq  TEXT,
+    date_time    TEXT,
+    fiscal_sign  TEXT,
+    code         INTEGER,
+    status       INTEGER,
+    request      TEXT    NOT NULL,
+    response     TEXT,
+    created      REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS receipts_order ON receipts (order_id, kind);
+CREATE INDEX IF NOT EXISTS receipts_seq ON receipts (receipt_seq, terminal_id);
+CREATE INDEX IF NOT EXISTS receipts_fiscal_sign ON receipts (fiscal_sign);
+CREATE INDEX IF NOT EXISTS receipts_date ON receipts (date_time);
+CREATE INDEX IF NOT EXISTS receipts_kind ON receipts (kind, fiscal_sign, id);
+"""
+
+COLUMNS = ("id", "kind", "receipt_type", "is_refund", "order_id", "terminal_id", "receipt_seq",
+           "date_time", "fiscal_sign", "code", "status", "request", "response", "created")
+
+
+class ReceiptStore:
+    """Thread-safe ombor: har bir thread o‘z sqlite ulanishini ishlatadi."""
+
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        conn.executescript(LEDGER_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, kind, receipt_data, response=None, status=None, order_id=None, refund_id=None):
+        """
+        Chek va OFD javobini yozadi; yozuv id’sini qaytaradi.
+        response – OFD javobi (dict); JSON bo‘lmagan javob uchun None.
+        refund_id – qaytuv daftar hold’i orqali o‘tgan (qoldiq allaqachon kamaygan); berilmasa
+        qabul qilingan qaytuv RefundInfo’dagi sotuv qatorlaridan shu yerda ayiriladi.
+        """
+        response = response if isinstance(response, dict) else None
+        body = response or {}
+        seq = body.get("ReceiptSeq", receipt_data.get("ReceiptSeq"))
+        row = (
+            kind,
+            receipt_data.get("ReceiptType"),
+            receipt_data.get("IsRefund"),
+            None if order_id is None else str(order_id),
+            body.get("TerminalID"),
+            None if seq is None else str(seq),
+            body.get("DateTime"),
+            body.get("FiscalSign") or None,
+            body.get("Code"),
+            status,
+            receipt_data.encode_text() if isinstance(receipt_data, Receipt)
+            else json.dumps(receipt_data, ensure_ascii=False),
+            None if response is None else json.dumps(response, ensure_ascii=False),
+            time.time(),
+        )
+        lines = sale_lines(kind, receipt_data, response, order_id)
+        refund = None if refund_id else untracked_refund(receipt_data, response)
+        in_tx = bool(lines or refund)
+        conn = self._conn()
+        if in_tx:
+            conn.execute("BEGIN IMMEDIATE")  # chek va uning daftar qatorlari birga
+        try:
+            cur = conn.execute(
+                "INSERT INTO receipts (kind, receipt_type, is_refund, order_id, terminal_id, receipt_seq,"
+                " date_time, fiscal_sign, code, status, request, response, created)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            if lines:
+                conn.executemany(INSERT_LINE, lines)
+            if refund:
+                apply_refund(conn, *refund)
+            if in_tx:
+                conn.execute("COMMIT")
+        except BaseException:
+            if in_tx:
+                conn.execute("ROLLBACK")
+            raise
+        return cur.lastrowid
+
+    def record_outbox(self, entry, response=None, status=None):
+        """
+        Fon worker yuborgan outbox yozuvi natijasini yozadi: so‘rov JSON imzolangan payload’dan
+        tiklanadi, tur va order id – yozuv meta’sidan (queue, circuit ochiq, timeout holatlari).
+        """
+        meta = entry["meta"]
+        receipt_data = json.loads(extract_content(Outbox.payload_of(entry)))
+        return self.record(meta.get("type") or "sale", receipt_data, response, status, meta.get("order_id"),
+                           meta.get("refund"))
+
+    def _one(self, where, params):
+        # Faqat OFD qabul qilgan (FiscalSign bor) cheklar bog‘lash uchun yaroqli
+        cur = self._conn().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM receipts WHERE fiscal_sign IS NOT NULL AND {where}"
+            " ORDER BY id DESC LIMIT 1", params)
+        row = cur.fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    @staticmethod
+    def _kinds(kind):
+        """kind – bitta tur yoki turlar ro‘yxati: (SQL sharti, parametrlar)."""
+        kinds = (kind,) if isinstance(kind, str) else tuple(kind)
+        return f"kind IN ({', '.join('?' * len(kinds))})", kinds
+
+    def latest(self, kind):
+        where, params = self._kinds(kind)
+        return self._one(where, params)
+
+    def by_order(self, order_id, kind=None):
+        if kind is None:
+            return self._one("order_id = ?", (str(order_id),))
+        where, params = self._kinds(kind)
+        return self._one(f"order_id = ? AND {where}", (str(order_id),) + params)
+
+    def by_seq(self, receipt_seq, terminal_id=None, kind=None):
+        where, params = "receipt_seq = ?", (str(receipt_seq),)
+        if terminal_id is not None:
+            where, params = where + " AND terminal_id = ?", params + (terminal_id,)
+        if kind is not None:
+            kinds, kind_params = self._kinds(kind)
+            where, params = f"{where} AND {kinds}", params + kind_params
+        return self._one(where, params)
+
+    def seq_terminals(self, receipt_seq, kind=None):
+        """Shu ReceiptSeq’li qabul qilingan cheklar terminallari (ReceiptSeq terminallar orasida takrorlanadi)."""
+        where, params = "receipt_seq = ?", (str(receipt_seq),)
+        if kind is not None:
+            kinds, kind_params = self._kinds(kind)
+            where, params = f"{where} AND {kinds}", params + kind_params
+        cur = self._conn().execute(
+            f"SELECT DISTINCT terminal_id FROM receipts WHERE fiscal_sign IS NOT NULL AND {where}", params)
+        return [row[0] for row in cur.fetchall()]
+
+    def by_fiscal_sign(self, fiscal_sign, kind=None):
+        if kind is None:
+            return self._one("fiscal_sign = ?", (str(fiscal_sign),))
+        where, params = self._kinds(kind)
+        return self._one(f"fiscal_sign = ? AND {where}", (str(fiscal_sign),) + params)
+
+    def by_date(self, date_from, date_to):
+        """DateTime (YYYYMMDDhhmmss) oralig‘idagi qabul qilingan cheklar."""
+        cur = self._conn().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM receipts WHERE date_time BETWEEN ? AND ? ORDER BY date_time",
+            (date_from, date_to))
+        return [dict(zip(COLUMNS, row)) for row in cur.fetchall()]
+
+    def find(self, kind=None, order_id=None, receipt_seq=None, fiscal_sign=None, terminal_id=None):
+        """Eng aniq kalit bo‘yicha qidiradi: fiscal_sign > receipt_seq > order_id > kind (oxirgisi)."""
+        if fiscal_sign:
+            return self.by_fiscal_sign(fiscal_sign)
+        if receipt_seq:
+            return self.by_seq(receipt_seq, terminal_id)
+        if order_id:
+            return self.by_order(order_id, kind)
+        if kind:
+            return self.latest(kind)
+        return None
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def link_info(row, with_sign=True):
+    """Ombordagi yozuvdan RefundInfo / SaleReceiptInfo dict’i."""
+    info = {
+        "TerminalID": row["terminal_id"],
+        "ReceiptSeq": row["receipt_seq"],
+        "DateTime": row["date_time"],
+    }
+    if with_sign:
+        info["FiscalSign"] = row["fiscal_sign"]
+    return info
+
+
+def link_row(store, kind, ref, terminal_id=None):
+    """
+    kind (turlar) dagi asl chek yozuvi: FiscalSign, bo‘lmasa ReceiptSeq bo‘yicha. ReceiptSeq
+    terminal_id’siz bir nechta terminalda uchrasa – None (boshqa terminal chekiga bog‘lanmaydi).
+    """
+    row = store.by_fiscal_sign(ref, kind)
+    if row is None and str(ref).isdigit():
+        if terminal_id is None and len(store.seq_terminals(ref, kind)) > 1:
+            return None
+        row = store.by_seq(ref, terminal_id, kind)
+    return row
+
+
+def resolve_link(kind, ref=None, with_sign=True, store=None, terminal_id=None):
+    """
+    kind (yoki turlar ro‘yxati) dagi asl chekning bog‘lash ma’lumoti yoki None.
+    ref – FiscalSign, ReceiptSeq yoki order id (berilmasa – shu turdagi oxirgi chek).
+    terminal_id – ReceiptSeq qaysi terminalniki (bir nechta terminal bo‘lsa kerak).
+    """
+    store = store or get_store()
+    if ref:
+        ref = str(ref)
+        row = link_row(store, kind, ref, terminal_id) or store.by_order(ref, kind)
+    else:
+        row = store.latest(kind)
+    return link_info(row, with_sign) if row else None
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path=STORE_FILE):
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = ReceiptStore(path)
+        return store
+
+
+def record_receipt(kind, receipt_data, response=None, status=None, order_id=None, refund_id=None):
+    return get_store().record(kind, receipt_data, response, status, order_id, refund_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lokal chek omboridan qidirish")
+    parser.add_argument("--path", default=STORE_FILE)
+    parser.add_argument("--kind")
+    parser.add_argument("--order")
+    parser.add_argument("--seq")
+    parser.add_argument("--terminal")
+    parser.add_argument("--fiscal-sign")
+    args = parser.parse_args()
+
+    found = ReceiptStore(args.path).find(args.kind, args.order, args.seq, args.fiscal_sign, args.terminal)
+    if not found:
+        print("❌ Chek topilmadi")
+        raise SystemExit(1)
+    print(json.dumps(link_info(found), ensure_ascii=False, indent=4))
+    print(json.dumps({k: v for k, v in found.items() if k not in ("request", "response")},
+                     ensure_ascii=False, indent=4))
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+receipt_validator.py – Chekni imzolash va ReceiptSeq olishdan oldin lokal tekshirish
+
+- OFD faqat yuborilgandan keyin rad etadigan xatolar shu yerda ushlanadi: ReceiptSeq sarflanmaydi,
+  imzo qo‘yilmaydi, 60 soniyagacha cho‘zilishi mumkin bo‘lgan so‘rov yuborilmaydi.
+- Qoidalar to‘plami har bir (ReceiptType, IsRefund) juftligi uchun import paytida bir marta
+  yig‘iladi (RULE_SETS); itemlar bitta o‘tishda tekshiriladi, summalar shu o‘tishda hisoblanadi.
+- Tekshiruvlar:
+    ReceivedCash + ReceivedCard = Σ(Price − Discount − Other), TotalVAT = Σ VAT;
+    VAT – VATPercent bo‘yicha Price ichidan yoki Price ustidan (OFD ikkalasini qabul qilgan –
+    logs/RefundReceipt.json va logs/AdvanceReceipt.json), ±VAT_TOLERANCE; VATPercent – VAT_PERCENTS dan;
+    Amount – mingliklarda (1 dona = amountKop), MIN_AMOUNT dan kam emas;
+    CommissionInfo – TIN (9 raqam) yoki PINFL (14 raqam) bo‘sh emas;
+    RefundInfo / SaleReceiptInfo – TerminalID, ReceiptSeq, DateTime (YYYYMMDDhhmmss), FiscalSign;
+    AdvanceContractID (avans cheklari), Time formati, SPIC / PackageCode.
+- Partiya rejimi: Receipt JSON fayllari yoki NDJSON (Receipt JSON yoki order_stream orderlari).
+
+Foydalanish:
+    python receipt_validator.py logs/SaleReceipt.json logs/CreditReceipt.json
+    python receipt_validator.py orders.ndjson            # order_stream formatidagi orderlar
+    python receipt_validator.py receipts.ndjson --json   # har qator uchun natija
+"""
+
+import argparse
+import json
+import re
+import sys
+from collections import Counter, namedtuple
+from collections.abc import Mapping
+from datetime import datetime
+
+from marketplace_receipt import amountKop, vat_from_gross
+
+VAT_PERCENTS = frozenset((0, 12, 15))
+VAT_TOLERANCE = 1          # so‘m – boshqa yaxlitlash usuli bilan hisoblangan VAT uchun
+MIN_AMOUNT = amountKop     # 1 dona; vazn bo‘yicha (0.5 kg = 500) sotilsa kamaytiriladi
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+LINK_TIME_FORMAT = "%Y%m%d%H%M%S"
+
+TIN_RE = re.compile(r"\d{9}")
+PINFL_RE = re.compile(r"\d{14}")
+SPIC_RE = re.compile(r"\d{17}")
+PACKAGE_CODE_RE = re.compile(r"\d+")
+FISCAL_SIGN_RE = re.compile(r"\d{12}")
+
+LINK_FIELDS = ("RefundInfo", "SaleReceiptInfo")
+
+Issue = namedtuple("Issue", "path code message")
+
+
+class ValidationError(ValueError):
+    """Chek lokal tekshiruvdan o‘tmadi; issues – Issue ro‘yxati."""
+
+    def __init__(self, issues):
+        self.issues = list(issues)
+        super().__init__(format_issues(self.issues))
+
+
+def format_issues(issues, limit=5):
+    text = "; ".join(f"{i.path}: {i.message}" for i in issues[:limit])
+    if len(issues) > limit:
+        text += f" (yana {len(issues) - limit} ta)"
+    return text
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _parses(value, fmt):
+    try:
+        datetime.strptime(value, fmt)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+# --- item qoidalari: (path, item, issues) ---
+
+def check_item_identity(path, item, issues):
+    if not isinstance(item.get("Name"), str) or not item["Name"].strip():
+        issues.append(Issue(f"{path}.Name", "name_empty", "Name bo‘sh"))
+    if not SPIC_RE.fullmatch(str(item.get("SPIC") or "")):
+        issues.append(Issue(f"{path}.SPIC", "spic_format", f"SPIC 17 raqam bo‘lishi kerak: {item.get('SPIC')!r}"))
+    if not PACKAGE_CODE_RE.fullmatch(str(item.get("PackageCode") or "")):
+        issues.append(Issue(f"{path}.PackageCode", "package_code", "PackageCode bo‘sh yoki raqam emas"))
+    if not isinstance(item.get("Labels", []), list):
+        issues.append(Issue(f"{path}.Labels", "labels_type", "Labels ro‘yxat bo‘lishi kerak"))
+
+
+def check_item_money(path, item, issues):
+    for field in ("Price", "Discount", "Other", "Voucher"):
+        value = item.get(field, 0)
+        if not _is_int(value) or value < 0:
+            issues.append(Issue(f"{path}.{field}", "money_type",
+                                f"{field} manfiy bo‘lmagan butun son bo‘lishi kerak: {value!r}"))
+            return
+    if item.get("Discount", 0) + item.get("Other", 0) > item["Price"]:
+        issues.append(Issue(f"{path}.Discount", "discount_exceeds", "Discount + Other Price dan katta"))
+
+
+def check_item_vat(path, item, issues):
+    percent, vat, price = item.get("VATPercent"), item.get("VAT"), item.get("Price")
+    if percent not in VAT_PERCENTS:
+        issues.append(Issue(f"{path}.VATPercent", "vat_percent",
+                            f"VATPercent {percent!r} ruxsat etilmagan ({', '.join(map(str, sorted(VAT_PERCENTS)))})"))
+        return
+    if not _is_int(vat) or not _is_int(price):
+        issues.append(Issue(f"{path}.VAT", "vat_type", f"VAT butun son bo‘lishi kerak: {vat!r}"))
+        return
+    included = vat_from_gross(price, percent)   # QQS Price ichida
+    on_top = round(price * percent / 100)       # QQS Price ustidan
+    if abs(vat - included) > VAT_TOLERANCE and abs(vat - on_top) > VAT_TOLERANCE:
+        issues.append(Issue(f"{path}.VAT", "vat_mismatch",
+                            f"VAT {vat}, VATPercent {percent}% bo‘yicha {included} (yoki {on_top}) bo‘lishi kerak"))
+
+
+def check_item_amount(path, item, issues):
+    amount = item.get("Amount")
+    if not _is_int(amount) or amount < MIN_AMOUNT:
+        issues.append(Issue(f"{path}.Amount", "amount_units",
+                            f"Amount mingliklarda bo‘lishi kerak (1 dona = {amountKop}): {amount!r}"))
+
+
+def check_item_commission(path, item, issues):
+    info = item.get("CommissionInfo")
+    if info is None:
+        return
+    if not isinstance(info, Mapping):
+        issues.append(Issue(f"{path}.CommissionInfo", "commission_type", "CommissionInfo obyekt bo‘lishi kerak"))
+        return
+    tin, pinfl = str(info.get("TIN") or ""), str(info.get("PINFL") or "")
+    if not tin and not pinfl:
+        issues.append(Issue(f"{path}.CommissionInfo", "commission_empty", "CommissionInfo TIN ham, PINFL ham bo‘sh"))
+    if tin and not TIN_RE.fullmatch(tin):
+        issues.append(Issue(f"{path}.CommissionInfo.TIN", "tin_format", f"TIN 9 raqam bo‘lishi kerak: {tin!r}"))
+    if pinfl and not PINFL_RE.fullmatch(pinfl):
+        issues.append(Issue(f"{path}.CommissionInfo.PINFL", "pinfl_format", f"PINFL 14 raqam bo‘lishi kerak: {pinfl!r}"))
+
+
+ITEM_RULES = (check_item_identity, check_item_money, check_item_vat, check_item_amount, check_item_commission)
+
+
+# --- chek qoidalari: (receipt, totals, issues); totals = (Σ to‘lanadigan, Σ VAT) ---
+
+def check_header(receipt, totals, issues):
+    seq = receipt.get("ReceiptSeq")
+    if seq is not None and not (_is_int(seq) and seq > 0):  # None – hali ajratilmagan
+        issues.append(Issue("ReceiptSeq", "seq", f"ReceiptSeq musbat butun son bo‘lishi kerak: {seq!r}"))
+    if not _parses(receipt.get("Time"), TIME_FORMAT):
+        issues.append(Issue("Time", "time_format", f"Time '{TIME_FORMAT}' formatida emas: {receipt.get('Time')!r}"))
+
+
+def check_payment(receipt, totals, issues):
+    cash, card = receipt.get("ReceivedCash", 0), receipt.get("ReceivedCard", 0)
+    for field, value in (("ReceivedCash", cash), ("ReceivedCard", card)):
+        if not _is_int(value) or value < 0:
+            issues.append(Issue(field, "money_type", f"{field} manfiy bo‘lmagan butun son bo‘lishi kerak: {value!r}"))
+            return
+    if totals is not None and cash + card != totals[0]:
+        issues.append(Issue("ReceivedCash", "payment_mismatch",
+                            f"ReceivedCash + ReceivedCard = {cash + card}, itemlar bo‘yicha {totals[0]}"))
+
+
+def check_total_vat(receipt, totals, issues):
+    if totals is not None and receipt.get("TotalVAT") != totals[1]:
+        issues.append(Issue("TotalVAT", "total_vat", f"TotalVAT {receipt.get('TotalVAT')!r}, VAT yig‘indisi {totals[1]}"))
+
+
+def check_advance(receipt, totals, issues):
+    contract_id = receipt.get("AdvanceContractID")
+    if not isinstance(contract_id, str) or not contract_id.strip():
+        issues.append(Issue("AdvanceContractID", "advance_contract", "AdvanceContractID bo‘sh"))
+
+
+def link_rule(field, require_sign=True):
+    """RefundInfo / SaleReceiptInfo tekshiruvchisi (asl chekka bog‘lanish)."""
+
+    def check_link(receipt, totals, issues):
+        info = receipt.get(field)
+        if not isinstance(info, Mapping):
+            issues.append(Issue(field, "link_missing", f"{field} yo‘q – asl chek ko‘rsatilmagan"))
+            return
+        if not info.get("TerminalID"):
+            issues.append(Issue(f"{field}.TerminalID", "link_terminal", "TerminalID bo‘sh"))
+        if not str(info.get("ReceiptSeq") or "").isdigit():
+            issues.append(Issue(f"{field}.ReceiptSeq", "link_seq", f"ReceiptSeq noto‘g‘ri: {info.get('ReceiptSeq')!r}"))
+        if not (isinstance(info.get("DateTime"), str) and len(info["DateTime"]) == 14
+                and _parses(info["DateTime"], LINK_TIME_FORMAT)):
+            issues.append(Issue(f"{field}.DateTime", "link_datetime",
+                                f"DateTime YYYYMMDDhhmmss formatida emas: {info.get('DateTime')!r}"))
+        fiscal_sign = info.get("FiscalSign")
+        if (require_sign or fiscal_sign) and not FISCAL_SIGN_RE.fullmatch(str(fiscal_sign or "")):
+            issues.append(Issue(f"{field}.FiscalSign", "link_fiscal_sign",
+                                f"FiscalSign 12 raqam bo‘lishi kerak: {fiscal_sign!r}"))
+
+    check_link.__name__ = f"check_{field}"
+    return check_link
+
+
+def forbid_links(*allowed):
+    """Shu turga tegishli bo‘lmagan bog‘lanish maydoni (masalan sotuvda RefundInfo)."""
+    extra = tuple(f for f in LINK_FIELDS if f not in allowed)
+
+    def check_no_link(receipt, totals, issues):
+        for field in extra:
+            if receipt.get(field):
+                issues.append(Issue(field, "link_unexpected", f"{field} bu chek turida bo‘lmaydi"))
+
+    return check_no_link
+
+
+BASE_RULES = (check_header, check_payment, check_total_vat)
+
+RuleSet = namedtuple("RuleSet", "name receipt_rules item_rules")
+
+# (ReceiptType, IsRefund) -> qoidalar; receipt_engine.KINDS bilan mos
+RULE_SETS = {
+    (0, 0): RuleSet("sale", BASE_RULES + (forbid_links(),), ITEM_RULES),
+    (0, 1): RuleSet("refund", BASE_RULES + (link_rule("RefundInfo"), forbid_links("RefundInfo")), ITEM_RULES),
+    (1, 0): RuleSet("advance", BASE_RULES + (check_advance, forbid_links()), ITEM_RULES),
+    (1, 1): RuleSet("advance_refund", BASE_RULES + (check_advance, link_rule("RefundInfo", require_sign=False),
+                                                    forbid_links("RefundInfo")), ITEM_RULES),
+    (2, 0): RuleSet("credit", BASE_RULES + (link_rule("SaleReceiptInfo"), forbid_links("SaleReceiptInfo")),
+                    ITEM_RULES),
+    (2, 1): RuleSet("credit_refund", BASE_RULES + (link_rule("SaleReceiptInfo"), forbid_links("SaleReceiptInfo")),
+                    ITEM_RULES),
+}
+
+
+def validate(receipt_data):
+    """Receipt JSON (dict yoki receipt_model.Receipt) -> Issue ro‘yxati; bo‘sh ro‘yxat – chek yuborishga tayyor."""
+    if not isinstance(receipt_data, Mapping):
+        return [Issue("", "not_object", "Receipt JSON obyekt emas")]
+    rule_set = RULE_SETS.get((receipt_data.get("ReceiptType"), receipt_data.get("IsRefund")))
+    if rule_set is None:
+        return [Issue("ReceiptType", "receipt_type",
+                      f"Noma’lum ReceiptType/IsRefund: {receipt_data.get('ReceiptType')!r}/"
+                      f"{receipt_data.get('IsRefund')!r}")]
+    issues = []
+    items = receipt_data.get("Items")
+    totals = None
+    if not isinstance(items, list) or not items:
+        issues.append(Issue("Items", "items_empty", "Items bo‘sh"))
+    else:
+        payable = total_vat = 0
+        for n, item in enumerate(items):
+            path = f"Items[{n}]"
+            if not isinstance(item, Mapping):
+                issues.append(Issue(path, "item_type", "item obyekt emas"))
+                continue
+            before = len(issues)
+            for rule in rule_set.item_rules:
+                rule(path, item, issues)
+            if len(issues) == before:
+                payable += item["Price"] - item.get("Discount", 0) - item.get("Other", 0)
+                total_vat += item["VAT"]
+        if not issues:  # item xato bo‘lsa summa solishtirish ma’nosiz – xato ikki marta chiqmasin
+            totals = (payable, total_vat)
+    for rule in rule_set.receipt_rules:
+        rule(receipt_data, totals, issues)
+    return issues
+
+
+def check(receipt_data):
+    """Xato bo‘lsa ValidationError."""
+    issues = validate(receipt_data)
+    if issues:
+        raise ValidationError(issues)
+
+
+def validate_many(receipts):
+    """Partiya: receipt dict’lari oqimi -> (tartib raqami, Issue ro‘yxati) generatori."""
+    for n, receipt_data in enumerate(receipts):
+        yield n, validate(receipt_data)
+
+
+def _iter_inputs(paths):
+    """(manba, receipt dict) – .json fayl bitta chek, .ndjson qatorlari chek yoki order_stream orderi."""
+    from order_stream import iter_orders, iter_receipts
+
+    for path in paths:
+        src = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+        try:
+            if path.endswith(".json"):
+                yield path, json.load(src)
+                continue
+            lines = [line for line in src if line.strip()]
+        finally:
+            if src is not sys.stdin:
+                src.close()
+        receipts = [json.loads(line) for line in lines if '"Items"' in line]
+        orders = [line for line in lines if '"Items"' not in line]
+        for n, receipt_data in enumerate(receipts, 1):
+            yield f"{path}#{n}", receipt_data
+        for order_id, _, receipt_data, _ in iter_receipts(iter_orders(orders), None):
+            yield f"{path}:{order_id}", receipt_data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chekni yuborishdan oldin lokal tekshirish")
+    parser.add_argument("inputs", nargs="+", help="Receipt JSON (.json) yoki NDJSON; '-' – stdin")
+    parser.add_argument("--json", action="store_true", help="har chek uchun NDJSON natija")
+    args = parser.parse_args()
+
+    total = rejected = 0
+    codes = Counter()
+    for source, receipt_data in _iter_inputs(args.inputs):
+        issues = validate(receipt_data)
+        total += 1
+        rejected += bool(issues)
+        codes.update(i.code for i in issues)
+        if args.json:
+            print(json.dumps({"source": source, "ok": not issues, "issues": [i._asdict() for i in issues]},
+                             ensure_ascii=False))
+        elif issues:
+            print(f"❌ {source}: {format_issues(issues)}")
+    print(f"{total} chek: {total - rejected} to‘g‘ri, {rejected} rad etildi"
+          + (f" ({', '.join(f'{c}={n}' for c, n in codes.most_common())})" if codes else ""), file=sys.stderr)
+    if rejected:
+        raise SystemExit(1)
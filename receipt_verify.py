@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+receipt_verify.py – Arxivdagi imzolangan cheklarni oflayn tekshirish (tungi audit)
+
+- Har bir DER SignedData uchun: imzo certificates/ dagi EP/EZ sertifikatlaridan biriga mos
+  keladimi (CMS_verify, libcrypto ichida – har chek uchun openssl jarayoni ochilmaydi) va
+  ichidagi mazmun saqlangan so‘rov JSON bilan bir xilmi.
+- Mazmun avval bayt-baytga solishtiriladi; mos kelmasa JSON sifatida (eski cheklar \\r\\n bilan
+  saqlangan – imzolashda CMS_TEXT qator oxirlarini o‘zgartiradi).
+- Manbalar: logs/archive segmentlari (har segment – bitta vazifa, worker .rca va .idx ni
+  o‘zi o‘qiydi, asosiy jarayon orqali baytlar uzatilmaydi) va keys/<nom>.p7b + logs/<nom>.json juftlari.
+- Vazifalar ProcessPoolExecutor da – har yadroda bitta worker, sertifikatlar worker
+  ishga tushganda bir marta yuklanadi.
+- Imzo zanjiri (CA) tekshirilmaydi: cheklar -nocerts bilan imzolangan, imzolovchi sertifikat
+  certificates/ dan olinadi – tekshiruv "shu chekni bizning kalitimiz imzolaganmi" degani.
+
+Natija holatlari: ok, bad_signature, content_mismatch, corrupt, unpaired.
+
+Foydalanish:
+    python receipt_verify.py                            # logs/archive + keys/
+    python receipt_verify.py --archive /mnt/archive --no-keys --workers 8
+    python receipt_verify.py --report logs/verify_report.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from ofd_signer import CmsVerifier, SigningError
+from receipt_archive import ARCHIVE_DIR, HEADER, ArchiveError, unpack_record
+
+CERT_GLOBS = ("certificates/*.crt", "certificates/*.cer", "certificates/*.pem")
+KEYS_DIR = "keys"
+LOGS_DIR = "logs"
+MAX_FAILURES = 1000   # hisobotdagi batafsil xatolar soni (jami son cheklanmaydi)
+
+STATUSES = ("ok", "bad_signature", "content_mismatch", "corrupt", "unpaired")
+
+
+def certificate_files(patterns=CERT_GLOBS):
+    files = sorted({path for pattern in patterns for path in glob.glob(pattern)})
+    if not files:
+        raise SigningError(f"Sertifikat topilmadi: {', '.join(patterns)}")
+    return files
+
+
+def content_matches(content, request):
+    """Imzo ichidagi mazmun saqlangan so‘rov bilan bir xilmi (bayt yoki JSON bo‘yicha)."""
+    if content == request:
+        return True
+    try:
+        return json.loads(content) == json.loads(request)
+    except ValueError:
+        return False
+
+
+def check_one(verifier, signed, request):
+    """(holat, sabab) – bitta chek uchun."""
+    if not signed:
+        return "corrupt", "imzolangan DER yo‘q"
+    ok, reason, content = verifier.verify(signed)
+    if not ok:
+        return "bad_signature", reason
+    if not content_matches(content, request):
+        return "content_mismatch", f"imzodagi mazmun ({len(content)} bayt) so‘rovdan ({len(request)} bayt) farq qiladi"
+    return "ok", None
+
+
+# --- worker ---
+
+_verifier = None  # worker jarayon ichidagi tekshiruvchi
+
+
+def _init_worker(cert_files):
+    global _verifier
+    _verifier = CmsVerifier(cert_files)
+
+
+def _result(counts, failures, source, status, reason, **ids):
+    counts[status] += 1
+    if status != "ok" and len(failures) < MAX_FAILURES:
+        failures.append(dict(source=source, status=status, reason=reason, **ids))
+
+
+def verify_segment(rca_path):
+    """Worker: bitta arxiv segmenti -> (holatlar soni, xatolar ro‘yxati)."""
+    counts, failures = Counter(), []
+    idx_path = rca_path[:-4] + ".idx"
+    try:
+        with open(idx_path, "rb") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        lines = []
+    source = os.path.basename(rca_path)
+    with open(rca_path, "rb") as seg:
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # yarim yozilgan oxirgi qator
+            ids = {"seq": entry.get("seq"), "fs": entry.get("fs"), "kind": entry.get("kind")}
+            seg.seek(entry["off"])
+            frame = seg.read(entry["len"])
+            try:
+                if len(frame) < HEADER.size:
+                    raise ArchiveError("yozuv segment oxiridan chiqib ketgan")
+                request, signed, _ = unpack_record(frame)
+            except (ArchiveError, struct.error, zlib.error) as e:
+                _result(counts, failures, source, "corrupt", str(e), **ids)
+                continue
+            _result(counts, failures, source, *check_one(_verifier, signed, request), **ids)
+    return counts, failures
+
+
+def verify_pairs(pairs):
+    """Worker: [(p7b, json yoki None)] -> (holatlar soni, xatolar ro‘yxati)."""
+    counts, failures = Counter(), []
+    for p7b_path, json_path in pairs:
+        source = p7b_path
+        if json_path is None:
+            _result(counts, failures, source, "unpaired", "mos .json topilmadi")
+            continue
+        with open(p7b_path, "rb") as f:
+            signed = f.read()
+        with open(json_path, "rb") as f:
+            request = f.read()
+        _result(counts, failures, source, *check_one(_verifier, signed, request))
+    return counts, failures
+
+
+# --- vazifalar ---
+
+def archive_tasks(directory=ARCHIVE_DIR):
+    """Katta segmentlar birinchi – oxirida bitta uzun vazifa kutib qolmasin."""
+    paths = glob.glob(os.path.join(directory, "seg-*.rca"))
+    return [(verify_segment, path) for path in sorted(paths, key=os.path.getsize, reverse=True)]
+
+
+def key_pairs(keys_dir=KEYS_DIR, logs_dir=LOGS_DIR):
+    pairs = []
+    for p7b_path in sorted(glob.glob(os.path.join(keys_dir, "*.p7b"))):
+        json_path = os.path.join(logs_dir, os.path.basename(p7b_path)[:-4] + ".json")
+        pairs.append((p7b_path, json_path if os.path.exists(json_path) else None))
+    return pairs
+
+
+def key_tasks(keys_dir=KEYS_DIR, logs_dir=LOGS_DIR, chunk_size=256):
+    pairs = key_pairs(keys_dir, logs_dir)
+    return [(verify_pairs, pairs[i:i + chunk_size]) for i in range(0, len(pairs), chunk_size)]
+
+
+def run(tasks, cert_files, workers=None):
+    """Vazifalarni bajaradi; (holatlar soni, xatolar ro‘yxati) – xatolar MAX_FAILURES gacha."""
+    workers = workers or os.cpu_count() or 1
+    counts, failures = Counter(), []
+
+    def merge(result):
+        part_counts, part_failures = result
+        counts.update(part_counts)
+        failures.extend(part_failures[:MAX_FAILURES - len(failures)])
+
+    if workers == 1 or len(tasks) <= 1:
+        _init_worker(cert_files)
+        for fn, arg in tasks:
+            merge(fn(arg))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker,
+                                 initargs=(cert_files,)) as pool:
+            for result in pool.map(_call, tasks):
+                merge(result)
+    return counts, failures
+
+
+def _call(task):
+    fn, arg = task
+    return fn(arg)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Imzolangan cheklarni oflayn tekshirish")
+    parser.add_argument("--archive", default=ARCHIVE_DIR)
+    parser.add_argument("--no-archive", action="store_true")
+    parser.add_argument("--keys", default=KEYS_DIR, help=".p7b katalogi (juftlari --logs da)")
+    parser.add_argument("--logs", default=LOGS_DIR)
+    parser.add_argument("--no-keys", action="store_true")
+    parser.add_argument("--certs", action="append", help="sertifikat fayl(lar)i yoki glob")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--report", help="JSON hisobot fayli")
+    args = parser.parse_args()
+
+    try:
+        cert_files = certificate_files(args.certs or CERT_GLOBS)
+    except SigningError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        raise SystemExit(2)
+    tasks = []
+    if not args.no_archive and os.path.isdir(args.archive):
+        tasks += archive_tasks(args.archive)
+    if not args.no_keys:
+        tasks += key_tasks(args.keys, args.logs)
+
+    started = time.perf_counter()
+    counts, failures = run(tasks, cert_files, args.workers)
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    for failure in failures:
+        print(f"❌ {failure['status']}: {failure['source']} "
+              f"{failure.get('seq') or ''} {failure['reason']}", file=sys.stderr)
+    summary = {status: counts[status] for status in STATUSES}
+    print(f"{total} chek, {elapsed:.1f} s ({total / elapsed if elapsed else 0:.0f} chek/s), "
+          f"{len(cert_files)} sertifikat: " + ", ".join(f"{k}={v}" for k, v in summary.items()))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "total": total, "seconds": round(elapsed, 2),
+                       "counts": summary, "failures": failures}, f, ensure_ascii=False, indent=4)
+    if total - counts["ok"]:
+        raise SystemExit(1)
+    print("✅ Barcha imzolar va mazmunlar mos")
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+"""
+refund_ledger.py – Sotuv qatorlari bo‘yicha qaytarish daftari (qisman qaytuvlar uchun)
+
+- OFD qabul qilgan har bir sotuv chekining har bir qatori (sale / marketplace_sale) uchun:
+  sotilgan Amount, Price, VAT va shulardan allaqachon qaytarilgani. Qatorlar
+  receipt_store.record() da chek yozuvi bilan bitta tranzaksiyada yoziladi (db/receipts.db).
+- Qisman qaytuv faqat qaytarilayotgan qatorlarni o‘qiydi (FiscalSign + qator raqami yoki
+  Barcode indeksi) – orderdagi qatorlar soniga bog‘liq emas, butun order qayta yig‘ilmaydi.
+- reserve(): qoldiq tekshiriladi va kamaytiriladi (BEGIN IMMEDIATE ostida) – parallel
+  qaytuvlar ham sotilganidan ko‘p qaytara olmaydi. Natija – qaytuv itemlari va RefundInfo.
+- Ushlab qo‘yish (hold) refund_id bo‘yicha: o‘sha refund_id bilan qayta chaqiruv yangi
+  qoldiq olmaydi, o‘sha itemlarni qaytaradi (skript qayta ishga tushsa ikki marta kamaymaydi).
+  Yakunlangan ("done") refund_id qayta berilmaydi – RefundDone (saqlangan OFD javobi bilan).
+- Hold’siz qabul qilingan qaytuv (eski skriptlar, daftarsiz sotuv qaytuvlari) ham receipt_store.record() da
+  hisobga olinadi: RefundInfo’dagi sotuv qatorlari qaytuv itemlari bo‘yicha kamayadi
+  (kalit – qaytuvning o‘z FiscalSign’i, bir chek ikki marta hisoblanmaydi).
+- settle(): done – qaytuv yakunlandi; fail (OFD rad etdi yoki lokal tekshiruvdan o‘tmadi) –
+  qoldiq qaytariladi; retry – hold qoladi.
+- Price, VAT: qaytarilgan miqdorga mutanosib; qatorning oxirgi qoldig‘i aniq qolgan summa
+  bilan yopiladi (yaxlitlash xatosi yig‘ilmaydi). VAT sotuvdagi asosda (ichida / ustidan)
+  qayta hisoblanadi. Labels faqat qator birdaniga to‘liq qaytarilganda ko‘chiriladi.
+
+Foydalanish:
+    python refund_ledger.py 749052382347          # FiscalSign yoki order id: qatorlar qoldig‘i
+    python refund_ledger.py --backfill            # db/receipts.db dagi eski sotuvlar qatorlari
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from marketplace_receipt import amountKop, vat_from_gross
+from receipt_model import Item
+
+LEDGER_FILE = "db/receipts.db"  # receipt_store bilan bitta baza
+BUSY_TIMEOUT = 30.0
+SALE_KINDS = ("sale", "marketplace_sale")
+VAT_TOLERANCE = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sale_lines (
+    fiscal_sign     TEXT    NOT NULL,
+    line            INTEGER NOT NULL,
+    terminal_id     TEXT,
+    receipt_seq     TEXT,
+    date_time       TEXT,
+    order_id        TEXT,
+    barcode         TEXT,
+    item            TEXT    NOT NULL,
+    amount          INTEGER NOT NULL,
+    price           INTEGER NOT NULL,
+    vat             INTEGER NOT NULL,
+    refunded_amount INTEGER NOT NULL DEFAULT 0,
+    refunded_price  INTEGER NOT NULL DEFAULT 0,
+    refunded_vat    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (fiscal_sign, line)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sale_lines_barcode ON sale_lines (fiscal_sign, barcode);
+CREATE INDEX IF NOT EXISTS sale_lines_order ON sale_lines (order_id);
+CREATE TABLE IF NOT EXISTS refund_holds (
+    refund_id   TEXT    NOT NULL,
+    fiscal_sign TEXT    NOT NULL,
+    line        INTEGER NOT NULL,
+    amount      INTEGER NOT NULL,
+    price       INTEGER NOT NULL,
+    vat         INTEGER NOT NULL,
+    state       TEXT    NOT NULL,
+    created     REAL    NOT NULL,
+    PRIMARY KEY (refund_id, fiscal_sign, line)
+);
+CREATE TABLE IF NOT EXISTS refund_results (
+    refund_id   TEXT PRIMARY KEY,
+    response    TEXT,
+    created     REAL    NOT NULL
+);
+"""
+
+INSERT_LINE = ("INSERT OR IGNORE INTO sale_lines (fiscal_sign, line, terminal_id, receipt_seq, date_time,"
+               " order_id, barcode, item, amount, price, vat) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+LINE_COLUMNS = ("fiscal_sign", "line", "terminal_id", "receipt_seq", "date_time", "item", "amount", "price", "vat",
+                "refunded_amount", "refunded_price", "refunded_vat")
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+class LedgerError(ValueError):
+    """Qaytuvni daftardan yig‘ib bo‘lmaydi (sotuv topilmadi, qator yo‘q yoki qoldiq yetmaydi)."""
+
+
+class RefundDone(LedgerError):
+    """refund_id allaqachon fiskallashtirilgan; response – saqlangan OFD javobi (dict) yoki None."""
+
+    def __init__(self, refund_id, response=None):
+        super().__init__(f"Qaytuv {refund_id} allaqachon fiskallashtirilgan")
+        self.refund_id = refund_id
+        self.response = response
+
+
+def sale_lines(kind, receipt_data, response, order_id=None):
+    """OFD qabul qilgan sotuv chekining daftar qatorlari (INSERT_LINE uchun); boshqa hollarda []."""
+    if kind not in SALE_KINDS or not isinstance(response, dict) or not response.get("FiscalSign"):
+        return []
+    fiscal_sign = str(response["FiscalSign"])
+    seq = response.get("ReceiptSeq", receipt_data.get("ReceiptSeq"))
+    head = (response.get("TerminalID"), None if seq is None else str(seq), response.get("DateTime"),
+            None if order_id is None else str(order_id))
+    return [(fiscal_sign, n) + head + (item.get("Barcode") or None,
+                                       item.encode_text() if isinstance(item, Item) else _dumps(item),
+                                       item["Amount"], item["Price"], item["VAT"])
+            for n, item in enumerate(receipt_data["Items"])]
+
+
+def untracked_refund(receipt_data, response):
+    """
+    Daftar hold’isiz (refund_id’siz) yozilayotgan, OFD qabul qilgan qaytuv:
+    (hold kaliti, sotuv FiscalSign’i, itemlar) yoki None.
+    """
+    if receipt_data.get("ReceiptType") != 0 or not receipt_data.get("IsRefund") \
+            or not isinstance(response, dict) or not response.get("FiscalSign"):
+        return None
+    link = receipt_data.get("RefundInfo") or {}
+    if not link.get("FiscalSign"):
+        return None
+    return f"receipt:{response['FiscalSign']}", str(link["FiscalSign"]), receipt_data["Items"]
+
+
+def apply_refund(conn, refund_key, fiscal_sign, items):
+    """
+    untracked_refund() natijasini conn tranzaksiyasida qo‘llaydi: har item Barcode (bo‘lmasa Name)
+    bo‘yicha qoldig‘i bor qatorlarga tartib bilan, qoldiqdan ortiq emas; "done" hold sifatida yoziladi.
+    Sotuv daftarda bo‘lmasa yoki kalit allaqachon yozilgan bo‘lsa hech narsa qilmaydi.
+    """
+    if conn.execute("SELECT 1 FROM refund_holds WHERE refund_id = ? LIMIT 1", (refund_key,)).fetchone():
+        return 0
+    cur = conn.execute(f"SELECT {', '.join(LINE_COLUMNS)} FROM sale_lines WHERE fiscal_sign = ? ORDER BY line",
+                       (fiscal_sign,))
+    rows = [dict(zip(LINE_COLUMNS, row)) for row in cur.fetchall()]
+    if not rows:
+        return 0
+    for row in rows:
+        sold = json.loads(row["item"])
+        row["key"] = sold.get("Barcode") or sold.get("Name")
+    holds, now = {}, time.time()
+    for item in items:
+        key = item.get("Barcode") or item.get("Name")
+        amount, price, vat = item["Amount"], item["Price"], item["VAT"]
+        for row in rows:
+            left = row["amount"] - row["refunded_amount"]
+            if not amount or row["key"] != key or left <= 0:
+                continue
+            take = min(amount, left)
+            part_price = price if take == amount else (price * take + amount // 2) // amount
+            part_vat = vat if take == amount else (vat * take + amount // 2) // amount
+            part_price = min(part_price, row["price"] - row["refunded_price"])
+            part_vat = min(part_vat, row["vat"] - row["refunded_vat"])
+            row["refunded_amount"] += take
+            row["refunded_price"] += part_price
+            row["refunded_vat"] += part_vat
+            held = holds.setdefault(row["line"], [row, 0, 0, 0])
+            held[1] += take
+            held[2] += part_price
+            held[3] += part_vat
+            amount, price, vat = amount - take, price - part_price, vat - part_vat
+    conn.executemany("UPDATE sale_lines SET refunded_amount = ?, refunded_price = ?, refunded_vat = ?"
+                     " WHERE fiscal_sign = ? AND line = ?",
+                     [(row["refunded_amount"], row["refunded_price"], row["refunded_vat"], fiscal_sign, line)
+                      for line, (row, *_) in holds.items()])
+    conn.executemany("INSERT INTO refund_holds (refund_id, fiscal_sign, line, amount, price, vat, state, created)"
+                     " VALUES (?, ?, ?, ?, ?, ?, 'done', ?)",
+                     [(refund_key, fiscal_sign, line, amount, price, vat, now)
+                      for line, (_, amount, price, vat) in holds.items()])
+    return len(holds)
+
+
+def _share(total, refunded, part, amount, refunded_amount):
+    """part miqdorga to‘g‘ri keladigan summa; qoldiq yopilsa – aniq qolgan summa."""
+    if refunded_amount + part >= amount:
+        return total - refunded
+    return min((total * part + amount // 2) // amount, total - refunded)
+
+
+def _vat_for(price, sold_price, sold_vat, percent):
+    """VAT sotuv qatoridagi asosda: QQS Price ichida yoki ustidan."""
+    if abs(sold_vat - vat_from_gross(sold_price, percent)) <= VAT_TOLERANCE:
+        return vat_from_gross(price, percent)
+    return round(price * percent / 100)
+
+
+def refund_item(item_text, amount, price, vat, whole_line=False):
+    """Sotuv itemidan qaytuv itemi (dict): Amount / Price / VAT qaytarilgan qism bo‘yicha."""
+    item = json.loads(item_text)
+    sold_amount, sold_price = item["Amount"], item["Price"]
+    if item.get("GoodPrice") == sold_price:
+        item["GoodPrice"] = price
+    for field in ("Discount", "Other"):
+        if item.get(field):
+            item[field] = (item[field] * amount + sold_amount // 2) // sold_amount
+    if not whole_line and item.get("Labels"):
+        item["Labels"] = []
+    item["Amount"], item["Price"], item["VAT"] = amount, price, vat
+    return item
+
+
+def link_of(row):
+    """Daftar qatoridan RefundInfo (receipt_store.link_info bilan bir xil shakl)."""
+    return {"TerminalID": row["terminal_id"], "ReceiptSeq": row["receipt_seq"], "DateTime": row["date_time"],
+            "FiscalSign": row["fiscal_sign"]}
+
+
+def parse_returns(args):
+    """CLI: BARCODE, BARCODE:QTY, #LINE, #LINE:QTY (QTY – dona, kasr bo‘lishi mumkin) -> reserve() uchun."""
+    returns = []
+    for arg in args:
+        ref, _, qty = arg.partition(":")
+        ref = int(ref[1:]) if ref.startswith("#") else ref
+        returns.append((ref, round(float(qty) * amountKop) if qty else None))
+    return returns
+
+
+def order_returns(returns):
+    """order["returns"] ([{"line" | "barcode", "amount"?}] yoki "all") -> reserve() uchun; "all" -> None."""
+    if returns == "all":
+        return None
+    if not isinstance(returns, list) or not returns:
+        raise LedgerError("returns – ro‘yxat yoki \"all\" bo‘lishi kerak")
+    return [(r.get("line") if r.get("line") is not None else r.get("barcode"),
+             round(r["amount"] * amountKop) if r.get("amount") is not None else None)
+            for r in returns]
+
+
+def refund_key(order, order_id):
+    """Hold kaliti: order["refund_id"] yoki order id + returns (bir xil so‘rov – o‘sha qaytuv)."""
+    if order.get("refund_id"):
+        return str(order["refund_id"])
+    digest = hashlib.sha256(json.dumps(order.get("returns", "all"), sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{order_id}:{digest[:16]}"
+
+
+class RefundLedger:
+    """Thread-safe daftar: har bir thread o‘z sqlite ulanishini ishlatadi."""
+
+    def __init__(self, path=LEDGER_FILE):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record_sale(self, kind, receipt_data, response, order_id=None):
+        """Sotuv qatorlarini yozadi (receipt_store.record buni o‘zi qiladi); yozilgan qatorlar soni."""
+        lines = sale_lines(kind, receipt_data, response, order_id)
+        if lines:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(INSERT_LINE, lines)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return len(lines)
+
+    def find_sale(self, order_id):
+        """Order bo‘yicha oxirgi qabul qilingan sotuvning FiscalSign’i yoki None."""
+        row = self._conn().execute("SELECT fiscal_sign FROM sale_lines WHERE order_id = ? ORDER BY date_time DESC"
+                                   " LIMIT 1", (str(order_id),)).fetchone()
+        return row[0] if row else None
+
+    def has_sale(self, fiscal_sign):
+        return self._conn().execute("SELECT 1 FROM sale_lines WHERE fiscal_sign = ? LIMIT 1",
+                                    (str(fiscal_sign),)).fetchone() is not None
+
+    def lines(self, fiscal_sign):
+        cur = self._conn().execute(f"SELECT {', '.join(LINE_COLUMNS)} FROM sale_lines WHERE fiscal_sign = ?"
+                                   " ORDER BY line", (str(fiscal_sign),))
+        return [dict(zip(LINE_COLUMNS, row)) for row in cur.fetchall()]
+
+    def _select(self, conn, fiscal_sign, ref):
+        where = "line = ?" if isinstance(ref, int) else "barcode = ?"
+        cur = conn.execute(f"SELECT {', '.join(LINE_COLUMNS)} FROM sale_lines WHERE fiscal_sign = ? AND {where}"
+                           " ORDER BY line", (fiscal_sign, ref))
+        return [dict(zip(LINE_COLUMNS, row)) for row in cur.fetchall()]
+
+    def _held(self, conn, refund_id):
+        """Ushlab turilgan qaytuv: (itemlar, RefundInfo) yoki None; yakunlangan bo‘lsa RefundDone."""
+        cur = conn.execute(
+            "SELECT h.amount, h.price, h.vat, l.item, l.amount, l.terminal_id, l.receipt_seq, l.date_time,"
+            " l.fiscal_sign, h.state FROM refund_holds h JOIN sale_lines l ON l.fiscal_sign = h.fiscal_sign"
+            " AND l.line = h.line WHERE h.refund_id = ? ORDER BY h.line", (refund_id,))
+        rows = cur.fetchall()
+        if not rows:
+            return None
+        if any(row[9] == "done" for row in rows):
+            result = conn.execute("SELECT response FROM refund_results WHERE refund_id = ?", (refund_id,)).fetchone()
+            raise RefundDone(refund_id, json.loads(result[0]) if result and result[0] else None)
+        items = [refund_item(item_text, amount, price, vat, amount == sold)
+                 for amount, price, vat, item_text, sold, *_ in rows]
+        tid, seq, dt, fs = rows[0][5:9]
+        return items, link_of({"terminal_id": tid, "receipt_seq": seq, "date_time": dt, "fiscal_sign": fs})
+
+    def reserve(self, refund_id, fiscal_sign, returns=None, dry_run=False):
+        """
+        Qaytuv uchun qoldiqni ushlab qo‘yadi: (qaytuv itemlari, RefundInfo).
+        returns – [(qator raqami yoki Barcode, Amount mingliklarda yoki None – butun qoldiq)];
+        None – sotuvning barcha qoldig‘i. Qoldiq yetmasa LedgerError (hech narsa o‘zgarmaydi);
+        refund_id allaqachon yakunlangan bo‘lsa RefundDone – o‘sha qaytuv ikkinchi marta berilmaydi.
+        dry_run – o‘sha itemlar, lekin tranzaksiya bekor qilinadi (faqat tekshiruv uchun).
+        """
+        fiscal_sign = str(fiscal_sign)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            held = self._held(conn, refund_id)
+            if held is not None:
+                conn.execute("COMMIT")
+                return held
+            if returns is None:
+                wanted = [(row, None) for row in self.lines(fiscal_sign)]
+                if not wanted:
+                    raise LedgerError(f"Sotuv {fiscal_sign} daftarda yo‘q")
+            else:
+                wanted = []
+                for ref, amount in returns:
+                    rows = self._select(conn, fiscal_sign, ref)
+                    if not rows:
+                        raise LedgerError(f"Sotuv {fiscal_sign} da {ref!r} qatori yo‘q")
+                    wanted.extend(self._spread(rows, ref, amount))
+            items, link, now = [], None, time.time()
+            for row, amount in wanted:
+                left = row["amount"] - row["refunded_amount"]
+                if amount is None:  # butun qoldiq – yopilgan qatorlar o‘tkazib yuboriladi
+                    if left <= 0:
+                        continue
+                    amount = left
+                if amount <= 0:
+                    raise LedgerError(f"{row['line']}-qator: qaytariladigan miqdor musbat bo‘lishi kerak")
+                if amount > left:
+                    raise LedgerError(f"{row['line']}-qatordan {amount / amountKop:g} dona qaytarib bo‘lmaydi, "
+                                      f"qoldiq {left / amountKop:g}")
+                price = _share(row["price"], row["refunded_price"], amount, row["amount"], row["refunded_amount"])
+                sold = json.loads(row["item"])
+                vat = _vat_for(price, row["price"], row["vat"], sold.get("VATPercent", 0))
+                if amount == left and abs(row["vat"] - row["refunded_vat"] - vat) <= VAT_TOLERANCE:
+                    vat = row["vat"] - row["refunded_vat"]
+                conn.execute("UPDATE sale_lines SET refunded_amount = refunded_amount + ?,"
+                             " refunded_price = refunded_price + ?, refunded_vat = refunded_vat + ?"
+                             " WHERE fiscal_sign = ? AND line = ?", (amount, price, vat, fiscal_sign, row["line"]))
+                conn.execute("INSERT INTO refund_holds (refund_id, fiscal_sign, line, amount, price, vat, state,"
+                             " created) VALUES (?, ?, ?, ?, ?, ?, 'held', ?)",
+                             (refund_id, fiscal_sign, row["line"], amount, price, vat, now))
+                items.append(refund_item(row["item"], amount, price, vat, amount == row["amount"]))
+                link = link or link_of(row)
+            if not items:
+                raise LedgerError(f"Sotuv {fiscal_sign} to‘liq qaytarilgan")
+            conn.execute("ROLLBACK" if dry_run else "COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return items, link
+
+    @staticmethod
+    def _spread(rows, ref, amount):
+        """Bir xil Barcode’li bir nechta qator: so‘ralgan miqdor qoldig‘i bor qatorlarga tartib bilan."""
+        if amount is None:
+            return [(row, None) for row in rows]
+        if len(rows) == 1:
+            return [(rows[0], amount)]
+        out = []
+        for row in rows:
+            take = min(amount, row["amount"] - row["refunded_amount"])
+            if take > 0:
+                out.append((row, take))
+                amount -= take
+            if not amount:
+                return out
+        raise LedgerError(f"{ref!r} bo‘yicha qoldiq yetmaydi ({amount} ortiqcha)")
+
+    def settle(self, refund_id, verdict, response=None):
+        """
+        outbox.classify_response natijasi: done – yakunlanadi (OFD javobi refund_results ga),
+        fail – qoldiq qaytariladi, retry – hold qoladi.
+        """
+        if not refund_id or verdict == "retry":
+            return
+        conn = self._conn()
+        if verdict == "done":
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("UPDATE refund_holds SET state = 'done' WHERE refund_id = ?", (refund_id,))
+                if response is not None:
+                    conn.execute("INSERT OR REPLACE INTO refund_results (refund_id, response, created)"
+                                 " VALUES (?, ?, ?)", (refund_id, _dumps(response), time.time()))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            holds = conn.execute("SELECT fiscal_sign, line, amount, price, vat FROM refund_holds"
+                                 " WHERE refund_id = ? AND state = 'held'", (refund_id,)).fetchall()
+            conn.executemany("UPDATE sale_lines SET refunded_amount = refunded_amount - ?,"
+                             " refunded_price = refunded_price - ?, refunded_vat = refunded_vat - ?"
+                             " WHERE fiscal_sign = ? AND line = ?",
+                             [(amount, price, vat, fs, line) for fs, line, amount, price, vat in holds])
+            conn.execute("DELETE FROM refund_holds WHERE refund_id = ? AND state = 'held'", (refund_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self, refund_id):
+        """Yuborilmagan qaytuv (masalan, lokal tekshiruvdan o‘tmadi) – qoldiq qaytariladi."""
+        self.settle(refund_id, "fail")
+
+    def backfill(self, store_path=None):
+        """receipt_store dagi qatorlari yo‘q eski sotuvlar uchun daftar qatorlari; yozilgan cheklar soni."""
+        conn = sqlite3.connect(store_path or self.path, timeout=BUSY_TIMEOUT)
+        try:
+            rows = conn.execute(
+                f"SELECT kind, order_id, request, response FROM receipts WHERE fiscal_sign IS NOT NULL"
+                f" AND kind IN ({', '.join('?' * len(SALE_KINDS))}) AND fiscal_sign NOT IN"
+                f" (SELECT fiscal_sign FROM sale_lines)", SALE_KINDS).fetchall()
+        except sqlite3.OperationalError:  # store_path boshqa baza – sale_lines u yerda yo‘q
+            rows = conn.execute(
+                f"SELECT kind, order_id, request, response FROM receipts WHERE fiscal_sign IS NOT NULL"
+                f" AND kind IN ({', '.join('?' * len(SALE_KINDS))})", SALE_KINDS).fetchall()
+        finally:
+            conn.close()
+        done = 0
+        for kind, order_id, request, response in rows:
+            done += bool(self.record_sale(kind, json.loads(request), json.loads(response) if response else None,
+                                          order_id))
+        return done
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_ledgers = {}
+_ledgers_lock = threading.Lock()
+
+
+def get_ledger(path=LEDGER_FILE):
+    with _ledgers_lock:
+        ledger = _ledgers.get(path)
+        if ledger is None:
+            ledger = _ledgers[path] = RefundLedger(path)
+        return ledger
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sotuv qatorlari bo‘yicha qaytarish daftari")
+    parser.add_argument("sale", nargs="?", help="FiscalSign yoki order id")
+    parser.add_argument("--path", default=LEDGER_FILE)
+    parser.add_argument("--backfill", action="store_true", help="eski sotuvlar qatorlarini yozish")
+    args = parser.parse_args()
+
+    ledger = RefundLedger(args.path)
+    if args.backfill:
+        print(f"✅ {ledger.backfill()} ta sotuv cheki daftarga yozildi")
+    if args.sale:
+        fiscal_sign = args.sale if ledger.lines(args.sale) else ledger.find_sale(args.sale)
+        lines = ledger.lines(fiscal_sign) if fiscal_sign else []
+        if not lines:
+            print("❌ Sotuv daftarda topilmadi")
+            raise SystemExit(1)
+        for row in lines:
+            item = json.loads(row["item"])
+            print(f"#{row['line']:<4} {row['fiscal_sign']} {item.get('Barcode', ''):<14} {item['Name'][:40]:<40} "
+                  f"qoldiq {(row['amount'] - row['refunded_amount']) / amountKop:g}/{row['amount'] / amountKop:g} "
+                  f"dona, {row['price'] - row['refunded_price']}/{row['price']}")
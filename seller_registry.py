@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+seller_registry.py – Tashqi seller reestri (JSON yoki SQLite) va xotiradagi indeks
+
+- Manba: db/sellers.json ([{"id", "TIN", "PINFL", "HasVAT"}, ...]) yoki SQLite fayl
+  (sellers jadvali). Xotirada seller_id bo‘yicha dict – item siklida O(1) qidiruv.
+- SellerRegistry seller_map o‘rnida ishlatiladi (get / [] / in), normalize_* o‘zgarmaydi.
+- refresh(): manba o‘zgargan bo‘lsagina qayta o‘qiydi (JSON – mtime, SQLite – data_version);
+  SQLite’da faqat updated > oxirgi o‘qilgan qatorlar olinadi (inkremental).
+- Yarim yozilgan / buzilgan sellers.json refresh() ni yiqitmaydi: xato logga yoziladi,
+  oldingi indeks saqlanib qoladi va fayl keyingi tekshiruvda qayta o‘qiladi.
+- Topilmagan sellerlar jim tashlab ketilmaydi: note_unknown() ogohlantiradi va
+  ofd_unknown_sellers_total metrikasini oshiradi.
+
+Foydalanish:
+    python seller_registry.py --import sellers.json --db db/sellers.db
+    python seller_registry.py --source db/sellers.db --lookup s1
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+
+from metrics import REGISTRY
+
+SELLERS_FILE = "db/sellers.json"
+CHECK_INTERVAL = 1.0  # soniya – manba shundan tez-tez tekshirilmaydi
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sellers (
+    id      TEXT PRIMARY KEY,
+    TIN     TEXT NOT NULL DEFAULT '',
+    PINFL   TEXT NOT NULL DEFAULT '',
+    HasVAT  INTEGER NOT NULL DEFAULT 1,
+    active  INTEGER NOT NULL DEFAULT 1,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sellers_updated ON sellers (updated);
+"""
+
+
+def _seller(row):
+    return {"id": row["id"], "TIN": row.get("TIN") or "", "PINFL": row.get("PINFL") or "",
+            "HasVAT": bool(row.get("HasVAT", True))}
+
+
+class SellerRegistry:
+    """seller_id -> {"id", "TIN", "PINFL", "HasVAT"} (seller_map bilan bir xil interfeys)."""
+
+    def __init__(self, source=SELLERS_FILE, fallback=None, check_interval=CHECK_INTERVAL):
+        self.source = source
+        self.check_interval = check_interval
+        self.unknown = Counter()
+        self._fallback = {s["id"]: s for s in (fallback or [])}
+        self._index = {}
+        self._stamp = None
+        self._bad_error = None       # oxirgi logga yozilgan o‘qish xatosi (takrorlanmaydi)
+        self._checked = 0.0
+        self._updated = 0.0
+        self._conn = None
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    # --- seller_map interfeysi (issiq sikl uchun) ---
+
+    def get(self, seller_id, default=None):
+        return self._index.get(seller_id, default)
+
+    def __getitem__(self, seller_id):
+        return self._index[seller_id]
+
+    def __contains__(self, seller_id):
+        return seller_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self._index)
+
+    # --- qayta yuklash ---
+
+    @property
+    def is_sqlite(self):
+        return self.source.endswith(SQLITE_SUFFIXES)
+
+    def refresh(self, force=False):
+        """Manba o‘zgargan bo‘lsa indeksni yangilaydi; yangilangan bo‘lsa True."""
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return False
+        with self._lock:
+            self._checked = now
+            if not os.path.exists(self.source):
+                if self._stamp is not None or not self._index:
+                    self._index = dict(self._fallback)
+                    self._stamp = None
+                    return True
+                return False
+            if self.is_sqlite:
+                return self._refresh_sqlite()
+            return self._refresh_json()
+
+    def _refresh_json(self):
+        try:
+            st = os.stat(self.source)
+            stamp = (st.st_mtime_ns, st.st_size)
+            if stamp == self._stamp:
+                return False
+            with open(self.source, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            rows = data.get("sellers", []) if isinstance(data, dict) else data
+            # Yangi indeks to‘liq yig‘ilib, keyin bitta almashtirish bilan o‘rnatiladi
+            index = {row["id"]: _seller(row) for row in rows}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            # Fayl hozir yozilmoqda yoki buzilgan: oldingi indeks va _stamp qoladi (keyinroq qayta o‘qiladi)
+            if self._bad_error != repr(e):
+                self._bad_error = repr(e)
+                print(f"❌ {self.source} o‘qilmadi, oldingi seller indeksi ishlatiladi: {e!r}", file=sys.stderr)
+            if not self._index:
+                self._index = dict(self._fallback)
+            return False
+        self._index = index
+        self._stamp = stamp
+        self._bad_error = None
+        return True
+
+    def _refresh_sqlite(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.source, check_same_thread=False)
+            self._conn.executescript(SCHEMA)
+        stamp = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if stamp == self._stamp:
+            return False
+        rows = self._conn.execute(
+            "SELECT id, TIN, PINFL, HasVAT, active, updated FROM sellers WHERE updated > ?",
+            (self._updated,)).fetchall()
+        index = dict(self._index) if self._stamp is not None else {}
+        for seller_id, tin, pinfl, has_vat, active, updated in rows:
+            if active:
+                index[seller_id] = _seller({"id": seller_id, "TIN": tin, "PINFL": pinfl, "HasVAT": has_vat})
+            else:
+                index.pop(seller_id, None)
+            self._updated = max(self._updated, updated)
+        self._index = index
+        self._stamp = stamp
+        return bool(rows)
+
+    def note_unknown(self, counts, context=""):
+        """counts: {seller_id: tashlangan itemlar soni} – ogohlantirish va metrika."""
+        for seller_id, n in counts.items():
+            self.unknown[seller_id] += n
+            REGISTRY.inc("ofd_unknown_sellers_total", n, seller_id=str(seller_id))
+            print(f"⚠️ Noma’lum seller {seller_id!r}: {n} ta item chekka kirmadi {context}".rstrip(),
+                  file=sys.stderr)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def import_sellers(rows, db_path):
+    """Sellerlarni SQLite reestrga yozadi (mavjudlari yangilanadi)."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(SCHEMA)
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT INTO sellers (id, TIN, PINFL, HasVAT, active, updated) VALUES (?, ?, ?, ?, 1, ?)"
+                " ON CONFLICT(id) DO UPDATE SET TIN = excluded.TIN, PINFL = excluded.PINFL,"
+                " HasVAT = excluded.HasVAT, active = 1, updated = excluded.updated",
+                ((s["id"], s["TIN"], s["PINFL"], int(s["HasVAT"]), now) for s in map(_seller, rows)))
+    finally:
+        conn.close()
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(source=SELLERS_FILE, fallback=None):
+    """Manba bo‘yicha keshlangan reestr; fayl yo‘q bo‘lsa fallback ro‘yxat ishlatiladi."""
+    with _registries_lock:
+        registry = _registries.get(source)
+        if registry is None:
+            registry = _registries[source] = SellerRegistry(source, fallback)
+        return registry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seller reestri")
+    parser.add_argument("--source", default=SELLERS_FILE, help="JSON yoki SQLite fayl")
+    parser.add_argument("--import", dest="import_file", help="JSON ro‘yxatni --db ga yozish")
+    parser.add_argument("--db", default="db/sellers.db")
+    parser.add_argument("--lookup")
+    args = parser.parse_args()
+
+    if args.import_file:
+        with open(args.import_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        rows = data.get("sellers", []) if isinstance(data, dict) else data
+        import_sellers(rows, args.db)
+        print(f"✅ {len(rows)} seller {args.db} ga yozildi")
+    else:
+        reg = SellerRegistry(args.source)
+        if args.lookup:
+            print(json.dumps(reg.get(args.lookup), ensure_ascii=False, indent=4))
+        print(f"Reestrda {len(reg)} seller")
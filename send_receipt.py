@@ -7,23 +7,36 @@ send_receipt.py – Sotuv chekini yuborish
 - Server javobidan SaleReceiptInfo ni logs/last_sale_info.json ga yozadi
 """
 
-import subprocess
-import requests
 import json
 import os
 from datetime import datetime
 
+from metrics import StageTimer
+from ofd_client import get_client
+from ofd_signer import get_signer
+from outbox import Outbox
+from receipt_archive import archive_receipt
+from receipt_codec import encode_receipt
+from receipt_seq import next_receipt_seq
+from receipt_store import record_receipt
+from seller_registry import get_registry
+
 CERT_FILE = "certificates/EZ000000000931.crt"
 KEY_FILE = "certificates/amaar.key"
 OFD_URL = "https://test.ofd.uz/emp/v3/receipt"
+signer = get_signer(CERT_FILE, KEY_FILE)  # kalit bir marta o‘qiladi
+ofd_client = get_client(OFD_URL)  # keep-alive ulanishlar pool’i
+outbox = Outbox()  # tasdiqlanmagan cheklar fon worker orqali qayta yuboriladi
+timer = StageTimer("sale", flush_at_exit=True)  # bosqichlar vaqti -> logs/metrics.prom
 
-# Sellerlar
+# Sellerlar (tashqi reestr bo‘lmasa ishlatiladi)
+SELLERS_FILE = "db/sellers.json"
 sellers = [
     {"id": "s1", "TIN": "311439965", "PINFL": ""},
     {"id": "s2", "TIN": "302547891", "PINFL": ""},
     {"id": "s3", "TIN": "209876543", "PINFL": ""}
 ]
-seller_map = {s["id"]: s for s in sellers}
+seller_map = get_registry(SELLERS_FILE, fallback=sellers)  # db/sellers.json bo‘lsa – o‘sha reestr
 
 # Marketplace
 marketplace = {
@@ -74,25 +87,27 @@ items = [
 ]
 
 # Seller_id → CommissionInfo
+unknown_sellers = {}
 for item in items:
     sid = item.pop("seller_id", None)
     if sid:
-        seller_info = seller_map[sid]
+        seller_info = seller_map.get(sid)
+        if seller_info is None:
+            unknown_sellers[sid] = unknown_sellers.get(sid, 0) + 1
+            continue
         item["CommissionInfo"] = {
             "TIN": seller_info["TIN"],
             "PINFL": seller_info["PINFL"]
         }
+if unknown_sellers:
+    seller_map.note_unknown(unknown_sellers)
+    exit(1)
 
 # Sequence
 os.makedirs("logs", exist_ok=True)
-seq_file = "logs/last_seq.txt"
-if os.path.exists(seq_file):
-    last_seq = int(open(seq_file).read().strip() or "0")
-else:
-    last_seq = 0
-ReceiptSeq = last_seq + 1
-with open(seq_file, "w") as f:
-    f.write(str(ReceiptSeq))
+timer.reset()
+ReceiptSeq = next_receipt_seq()  # qulf ostida, logs/last_seq.txt bilan mos
+timer.lap("seq_alloc")
 
 # Summalar
 total_price = sum(i["Price"] for i in items)
@@ -126,25 +141,28 @@ receipt_data = {
 }
 
 receipt_json_path = "logs/ReceiptInfo.json"
-with open(receipt_json_path, "w", encoding="utf-8") as f:
-    json.dump(receipt_data, f, ensure_ascii=False, indent=4)
-print(f"✅ ReceiptInfo.json yaratildi: {receipt_json_path}")
+receipt_bytes = encode_receipt(receipt_data, "sale")  # ixcham, deterministik UTF-8
+with open(receipt_json_path, "wb") as f:
+    f.write(receipt_bytes)
+timer.lap("json_dump")
+print(f"✅ ReceiptInfo.json yaratildi: {receipt_json_path} ({len(receipt_bytes)} bayt)")
 
 # Sign
 signed_path = "keys/ReceiptInfo.p7b"
-cmd = [
-    "openssl", "cms", "-sign", "-nodetach", "-binary",
-    "-in", receipt_json_path, "-text", "-outform", "der",
-    "-out", signed_path, "-nocerts",
-    "-signer", CERT_FILE, "-inkey", KEY_FILE
-]
-subprocess.run(cmd, check=True)
+signed_data = signer.sign(receipt_bytes)
+with open(signed_path, "wb") as f:
+    f.write(signed_data)
+timer.lap("sign")
 print(f"✅ Imzolangan fayl yaratildi: {signed_path}")
 
 # Send
-headers = {"Content-Type": "application/octet-stream"}
-with open(signed_path, "rb") as f:
-    resp = requests.post(OFD_URL, headers=headers, data=f, timeout=60)
+outbox_id = outbox.put(signed_data, {"type": "sale", "ReceiptSeq": ReceiptSeq, "url": OFD_URL})
+resp = ofd_client.post_receipt(signed_data)
+timer.lap("send")
+_, ofd_body = outbox.settle(outbox_id, resp)  # FiscalSign kelmasa chek outbox’da qoladi
+timer.response(ofd_body.get("Code") if ofd_body else None)
+record_receipt("sale", receipt_data, ofd_body, resp.status_code)  # db/receipts.db
+archive_receipt("sale", receipt_data, receipt_bytes, signed_data, resp.text, ofd_body)  # logs/archive (tarix)
 
 print("Status:", resp.status_code)
 print("Body:", resp.text)
@@ -167,3 +185,4 @@ try:
 except Exception:
     print("❌ Server javobi JSON emas")
 
+timer.lap("persist")
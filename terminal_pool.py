@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+terminal_pool.py – Bir nechta fiskal modul (EP/EZ terminallar) bo‘yicha cheklarni taqsimlash
+
+- Har bir terminal o‘z sertifikati va kaliti, o‘z ReceiptSeq hisoblagichi
+  (logs/terminals/<TerminalID>/last_seq.txt), o‘z outbox’i va fon worker’i hamda o‘z
+  OfdClient’i (parallellik chegarasi va circuit terminal bo‘yicha) bilan ishlaydi.
+- Yangi sotuv / avans cheklari eng kam yuklangan terminalga: yuk = ishlovdagi cheklar +
+  outbox’da kutayotganlar, weight ga bo‘linadi; teng bo‘lsa navbat bilan.
+- RefundInfo / SaleReceiptInfo bor cheklar (qaytuv, kredit) asl chekni bergan terminalga
+  biriktiriladi (TerminalID bo‘yicha); u terminal pulda bo‘lmasa TerminalError (bitta
+  terminalli pulda ham – qaytuv boshqa fiskal modulga ketmaydi).
+- Konfiguratsiya: db/terminals.json. Fayl bo‘lmasa – bitta terminal (CERT_FILE), eski
+  logs/last_seq.txt va logs/outbox.log bilan (skriptlar bilan mos).
+- Asosiy terminal (primary yoki birinchisi) eski fayllarni saqlab qoladi.
+
+db/terminals.json:
+    {"terminals": [
+        {"id": "EP000000000589", "cert": "certificates/EP000000000589.crt",
+         "key": "certificates/amaar.key", "primary": true},
+        {"id": "EZ000000000931", "cert": "certificates/EZ000000000931.crt",
+         "key": "certificates/amaar.key", "weight": 1}
+    ]}
+    id – OFD javobidagi TerminalID bilan bir xil bo‘lishi kerak (odatda sertifikat CN).
+
+Foydalanish:
+    python terminal_pool.py --init        # certificates/*.crt dan db/terminals.json
+    python terminal_pool.py               # terminallar holati (seq, outbox, OFD)
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from functools import partial
+
+from metrics import REGISTRY
+from ofd_client import get_client
+from ofd_signer import get_signer
+from outbox import OUTBOX_FILE, Outbox, OutboxWorker
+from receipt_seq import SEQ_FILE, get_allocator
+
+TERMINALS_FILE = "db/terminals.json"
+TERMINALS_DIR = "logs/terminals"
+CERT_FILE = "certificates/EP000000000589.crt"
+KEY_FILE = "certificates/amaar.key"
+OFD_URL = "https://txkm.soliq.uz/emp/v3/receipt"
+
+TERMINAL_ID_RE = re.compile(r"E[PZ]\d{12}")
+LINK_FIELDS = ("RefundInfo", "SaleReceiptInfo")
+
+
+class TerminalError(ValueError):
+    """Chek uchun terminal yo‘q (asl chek terminali pulda emas yoki konfiguratsiya xato)."""
+
+
+def terminal_id_of(cert_file):
+    """Sertifikat fayl nomidan TerminalID (certificates/EP000000000589.crt -> EP000000000589)."""
+    return os.path.splitext(os.path.basename(cert_file))[0]
+
+
+def linked_terminal(receipt_data):
+    """Asl chekning TerminalID si (RefundInfo / SaleReceiptInfo) yoki None."""
+    for field in LINK_FIELDS:
+        info = receipt_data.get(field)
+        if isinstance(info, dict) and info.get("TerminalID"):
+            return info["TerminalID"]
+    return None
+
+
+class Terminal:
+    """Bitta fiskal modul: imzolovchi, ReceiptSeq, outbox va OFD klienti."""
+
+    def __init__(self, terminal_id, cert_file, key_file=KEY_FILE, url=OFD_URL, seq_file=None,
+                 outbox_file=None, weight=1.0, seq_block=10, seq=None):
+        self.id = terminal_id
+        self.cert_file = cert_file
+        self.url = url
+        self.weight = max(float(weight), 0.01)
+        directory = os.path.join(TERMINALS_DIR, terminal_id)
+        self.signer = get_signer(cert_file, key_file)
+        self.seq = seq or get_allocator(seq_file or os.path.join(directory, "last_seq.txt"), seq_block)
+        self.outbox = Outbox(outbox_file or os.path.join(directory, "outbox.log"))
+        self.client = get_client(url, terminal_id=terminal_id)
+        self.worker = None
+        self._active = 0  # TerminalPool._lock ostida o‘zgaradi
+
+    def load(self):
+        """Yuk: shu jarayonda ishlovdagi cheklar + outbox’dagi yakunlanmaganlar, weight ga nisbatan."""
+        return (self._active + self.outbox.backlog()) / self.weight
+
+    def start_worker(self, on_result=None):
+        if self.worker is None:
+            self.worker = OutboxWorker(self.outbox, partial(get_client, terminal_id=self.id), self.url,
+                                       on_result=on_result)
+            self.worker.start()
+        return self.worker
+
+    def status(self):
+        return {"id": self.id, "weight": self.weight, "active": self._active, "backlog": self.outbox.backlog(),
+                "seq": self.seq.current(), "ofd": self.client.status()}
+
+    def close(self):
+        if self.worker is not None:
+            self.worker.stop()
+        self.seq.release()
+
+
+class TerminalPool:
+    """Terminallar to‘plami va yo‘naltiruvchi (router)."""
+
+    def __init__(self, terminals):
+        self.terminals = list(terminals)
+        if not self.terminals:
+            raise TerminalError("Pulda terminal yo‘q")
+        self.by_id = {t.id: t for t in self.terminals}
+        if len(self.by_id) != len(self.terminals):
+            raise TerminalError("Terminal id’lari takrorlangan")
+        self.primary = self.terminals[0]
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+
+    def __len__(self):
+        return len(self.terminals)
+
+    def __iter__(self):
+        return iter(self.terminals)
+
+    def get(self, terminal_id):
+        return self.by_id.get(terminal_id)
+
+    def pick(self, receipt_data=None, terminal_id=None):
+        """
+        Chek uchun terminal: terminal_id berilgan yoki chek asl chekka bog‘langan bo‘lsa – o‘sha
+        terminal (bitta terminalli pulda ham tekshiriladi), aks holda eng kam yuklangani.
+        """
+        if terminal_id is None and receipt_data is not None:
+            terminal_id = linked_terminal(receipt_data)
+        if terminal_id is not None:
+            terminal = self.by_id.get(terminal_id)
+            if terminal is None:
+                raise TerminalError(f"Asl chek terminali {terminal_id} pulda yo‘q "
+                                    f"({', '.join(self.by_id)})")
+            return terminal
+        if len(self.terminals) == 1:
+            return self.primary
+        start = next(self._turn) % len(self.terminals)
+        order = self.terminals[start:] + self.terminals[:start]
+        return min(order, key=Terminal.load)
+
+    @contextmanager
+    def routed(self, receipt_data=None, terminal_id=None):
+        """pick() + ishlovdagi cheklar hisobi (parallel so‘rovlar bir terminalga yopirilmasin)."""
+        with self._lock:
+            terminal = self.pick(receipt_data, terminal_id)
+            terminal._active += 1
+        REGISTRY.inc("ofd_terminal_routed_total", terminal=terminal.id)
+        try:
+            yield terminal
+        finally:
+            with self._lock:
+                terminal._active -= 1
+
+    def start_workers(self, on_result=None):
+        for terminal in self.terminals:
+            terminal.start_worker(on_result)
+
+    def status(self):
+        return [terminal.status() for terminal in self.terminals]
+
+    def close(self):
+        for terminal in self.terminals:
+            terminal.close()
+
+
+def load_terminals(path=TERMINALS_FILE, cert_file=CERT_FILE, key_file=KEY_FILE, url=OFD_URL,
+                   seq_block=10, seq=None):
+    """
+    db/terminals.json dan pul; fayl bo‘lmasa cert_file bilan bitta terminal.
+    Asosiy terminal eski logs/last_seq.txt va logs/outbox.log ni ishlatadi; seq berilsa – o‘sha hisoblagich.
+    """
+    if not os.path.exists(path):
+        return TerminalPool([Terminal(terminal_id_of(cert_file), cert_file, key_file, url, SEQ_FILE,
+                                      OUTBOX_FILE, seq_block=seq_block, seq=seq)])
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    entries = config.get("terminals", []) if isinstance(config, dict) else config
+    if not entries:
+        raise TerminalError(f"{path}: terminals ro‘yxati bo‘sh")
+    entries = sorted(entries, key=lambda e: not e.get("primary"))  # asosiy terminal birinchi
+    terminals = []
+    for n, entry in enumerate(entries):
+        cert = entry.get("cert")
+        if not cert:
+            raise TerminalError(f"{path}: {n + 1}-terminalda cert yo‘q")
+        primary = n == 0
+        terminals.append(Terminal(
+            entry.get("id") or terminal_id_of(cert), cert, entry.get("key", key_file), entry.get("url", url),
+            entry.get("seq_file", SEQ_FILE if primary else None),
+            entry.get("outbox_file", OUTBOX_FILE if primary else None),
+            entry.get("weight", 1), seq_block, seq if primary else None))
+    return TerminalPool(terminals)
+
+
+def discover(cert_glob="certificates/*.crt", key_file=KEY_FILE, primary_cert=CERT_FILE):
+    """certificates/ dagi terminal sertifikatlari (nomi EP/EZ + 12 raqam) -> terminals.json yozuvlari."""
+    entries = []
+    for cert in sorted(glob.glob(cert_glob)):
+        terminal_id = terminal_id_of(cert)
+        if TERMINAL_ID_RE.fullmatch(terminal_id):
+            entry = {"id": terminal_id, "cert": cert, "key": key_file, "weight": 1}
+            if os.path.normpath(cert) == os.path.normpath(primary_cert):
+                entry["primary"] = True
+            entries.append(entry)
+    return entries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fiskal modullar (terminallar) puli")
+    parser.add_argument("--config", default=TERMINALS_FILE)
+    parser.add_argument("--init", action="store_true", help="certificates/*.crt dan konfiguratsiya yozish")
+    parser.add_argument("--key", default=KEY_FILE)
+    args = parser.parse_args()
+
+    if args.init:
+        if os.path.exists(args.config):
+            print(f"❌ {args.config} allaqachon bor")
+            raise SystemExit(1)
+        found = discover(key_file=args.key)
+        os.makedirs(os.path.dirname(args.config) or ".", exist_ok=True)
+        with open(args.config, "w", encoding="utf-8") as f:
+            json.dump({"terminals": found}, f, ensure_ascii=False, indent=4)
+        print(f"✅ {len(found)} terminal: {', '.join(e['id'] for e in found)} -> {args.config}")
+    else:
+        pool = load_terminals(args.config, key_file=args.key)
+        print(json.dumps(pool.status(), ensure_ascii=False, indent=4))